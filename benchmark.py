@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+
+
+"""
+    Synthetic load benchmark for Yve.
+
+    Times the startup (imports and database bootstrap), builds a
+    temporary database, feeds synthetic updates through process_message
+    and times the statistics handlers at growing database sizes. The
+    handlers talk to a local stub bot, no network is needed. The
+    results are printed as JSON.
+
+    Usage: ./benchmark.py [--sizes 10000,1000000,10000000] [--output FILE]
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import sqlite3
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+from telegram import Update
+
+import config
+import yve_main
+from dbhelper import DBHelper, ConnectionManager, to_epoch
+from dbqueries import db_add_groups, db_get_stats_snapshot
+from migrations import create_schema
+from statscache import StatsCache
+from util import hash_uid
+from writequeue import WriteQueue
+from words import WordStats
+
+
+# Minimal message content for each message type
+MESSAGE_CONTENT = {
+    "text": lambda i: {"text": f"synthetic message number {i} with some words"},
+    "sticker": lambda i: {
+        "sticker": {
+            "file_id": f"s{i}",
+            "file_unique_id": f"s{i}",
+            "width": 512,
+            "height": 512,
+            "is_animated": False,
+        }
+    },
+    "photo": lambda i: {
+        "photo": [
+            {"file_id": f"p{i}", "file_unique_id": f"p{i}", "width": 1, "height": 1}
+        ]
+    },
+    "voice": lambda i: {
+        "voice": {"file_id": f"v{i}", "file_unique_id": f"v{i}", "duration": 3}
+    },
+    "audio": lambda i: {
+        "audio": {"file_id": f"a{i}", "file_unique_id": f"a{i}", "duration": 3}
+    },
+    "document": lambda i: {"document": {"file_id": f"d{i}", "file_unique_id": f"d{i}"}},
+    "video": lambda i: {
+        "video": {
+            "file_id": f"vi{i}",
+            "file_unique_id": f"vi{i}",
+            "width": 1,
+            "height": 1,
+            "duration": 3,
+        }
+    },
+    "video_note": lambda i: {
+        "video_note": {
+            "file_id": f"vn{i}",
+            "file_unique_id": f"vn{i}",
+            "length": 1,
+            "duration": 3,
+        }
+    },
+    "location": lambda i: {"location": {"longitude": 13.4, "latitude": 52.5}},
+    "contact": lambda i: {"contact": {"phone_number": "0", "first_name": "C"}},
+    "new_chat_title": lambda i: {"new_chat_title": f"Title {i}"},
+}
+
+
+class StubBot:
+    """Stands in for telegram.Bot and records the calls."""
+
+    defaults = None
+
+    def __init__(self):
+        self.calls = 0
+        self.message_id = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        """Pretend to send a message."""
+        self.calls += 1
+        self.message_id += 1
+        return Update.de_json(
+            {
+                "update_id": 0,
+                "message": {
+                    "message_id": self.message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "supergroup"},
+                    "text": text,
+                },
+            },
+            self,
+        ).message
+
+    def editMessageText(self, **kwargs):  # pylint: disable=invalid-name
+        """Pretend to edit a message."""
+        self.calls += 1
+        return True
+
+    edit_message_text = editMessageText
+
+    def answer_callback_query(self, *args, **kwargs):
+        """Pretend to answer a callback query."""
+        self.calls += 1
+        return True
+
+
+class StubContext:
+    """Stands in for telegram.ext.CallbackContext."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.chat_data = {}
+
+
+class Workload:
+    """Generate synthetic updates for a number of groups and users."""
+
+    def __init__(self, bot, groups, users, days=365, seed=0):
+        self.bot = bot
+        self.group_ids = [-1000000000000 - n for n in range(groups)]
+        self.users = users
+        self.days = days
+        self.types = [t for t in config.MESSAGE_TYPES if t in MESSAGE_CONTENT]
+        self.random = random.Random(seed)
+        self.update_id = 0
+
+    def _user(self, user_id):
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+        }
+
+    def _chat(self, group_id):
+        return {"id": group_id, "type": "supergroup", "title": "Benchmark"}
+
+    def message(self):
+        """Return an Update with a new message of a random group, user
+        and message type.
+
+        """
+        self.update_id += 1
+        msg_type = self.random.choice(self.types)
+        data = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": self._chat(self.random.choice(self.group_ids)),
+            "from": self._user(self.random.randrange(self.users)),
+        }
+        data.update(MESSAGE_CONTENT[msg_type](self.update_id))
+        return Update.de_json({"update_id": self.update_id, "message": data}, self.bot)
+
+    def command(self, text, group_id=None):
+        """Return an Update with a bot command."""
+        self.update_id += 1
+        data = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": self._chat(group_id or self.random.choice(self.group_ids)),
+            "from": self._user(self.random.randrange(self.users)),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        }
+        return Update.de_json({"update_id": self.update_id, "message": data}, self.bot)
+
+    def button(self, message_id, direction, group_id):
+        """Return an Update with a callback query of the stats buttons."""
+        self.update_id += 1
+        data = {
+            "id": str(self.update_id),
+            "from": self._user(self.random.randrange(self.users)),
+            "chat_instance": "benchmark",
+            "data": direction,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": self._chat(group_id),
+                "text": "Nachrichten gesamt",
+            },
+        }
+        return Update.de_json(
+            {"update_id": self.update_id, "callback_query": data}, self.bot
+        )
+
+
+def create_database(workload):
+    """Create the schema and register the groups like the bot does at
+    startup, twice to include the start with an existing database.
+
+    Returns:
+        Seconds of the first and of the second run.
+
+    """
+    seconds = []
+    for _ in range(2):
+        start = time.perf_counter()
+        create_schema()
+        db_add_groups(workload.group_ids)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def bench_startup(repeat=5):
+    """Time the imports of the admin CLI and of the bot in a new
+    interpreter, the interpreter start alone for comparison.
+
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, code in (
+        ("python_ms", "pass"),
+        ("import_yve_admin_ms", "import yve_admin"),
+        ("import_yve_main_ms", "import yve_main"),
+    ):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True)
+            samples.append(time.perf_counter() - start)
+        results[name] = round(statistics.median(samples) * 1000, 1)
+    return results
+
+
+def seed_messages(path, workload, count, chunk=100000):
+    """Insert count messages spread over the last days directly, which is
+    much faster than process_message for millions of rows.
+
+    """
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA synchronous=OFF")
+    db.executemany(
+        "INSERT OR IGNORE INTO Telegram_User (user_id, user_name) VALUES (?, ?)",
+        [(hash_uid(n), f"user{n}") for n in range(workload.users)],
+    )
+    groups = [row[0] for row in db.execute("SELECT id FROM Telegram_Group")]
+    users = [row[0] for row in db.execute("SELECT id FROM Telegram_User")]
+    stmt = "SELECT id FROM Telegram_Type WHERE message_type IN ({})".format(
+        ",".join("?" * len(workload.types))
+    )
+    types = [row[0] for row in db.execute(stmt, workload.types)]
+
+    rnd = workload.random
+    now = time.time()
+    stmt = (
+        "INSERT INTO Message "
+        "(group_id, user_id, msg_type, msg_length, timestamp, ts) "
+        "VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    while count > 0:
+        rows = []
+        for _ in range(min(chunk, count)):
+            date = datetime.fromtimestamp(
+                now - rnd.random() * workload.days * 86400, timezone.utc
+            )
+            rows.append(
+                (
+                    rnd.choice(groups),
+                    rnd.choice(users),
+                    rnd.choice(types),
+                    rnd.randrange(30),
+                    date,
+                    to_epoch(date),
+                )
+            )
+        db.executemany(stmt, rows)
+        db.commit()
+        count -= len(rows)
+    db.close()
+
+
+def percentiles(samples):
+    """Return p50/p95/p99 and the mean of the samples in milliseconds."""
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": round(cuts[49] * 1000, 3),
+        "p95": round(cuts[94] * 1000, 3),
+        "p99": round(cuts[98] * 1000, 3),
+        "mean": round(statistics.fmean(samples) * 1000, 3),
+        "n": len(samples),
+    }
+
+
+def timed(func, repeat, setup=None):
+    """Call func() repeat times and return the latencies. setup() runs
+    before every call and isn't timed.
+
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_ingest(yve, workload, count):
+    """Feed count synthetic messages through the message filter and
+    process_message, like the dispatcher does.
+
+    """
+    updates = [workload.message() for _ in range(count)]
+    context = StubContext(workload.bot)
+    start = time.perf_counter()
+    for update in updates:
+        selected = yve.SELECTED_MESSAGES(update)
+        if selected:
+            context.msg_type = selected["msg_type"]
+            yve.process_message(update, context)
+    # Wait until everything is written
+    yve.WRITE_QUEUE.submit(lambda: None).result()
+    seconds = time.perf_counter() - start
+    return {
+        "messages": count,
+        "seconds": round(seconds, 3),
+        "messages_per_sec": round(count / seconds, 1),
+    }
+
+
+def bench_words(workload, count):
+    """Time the word statistics per text message: queuing the text in
+    process_message and counting it in the background thread.
+
+    """
+    rnd = workload.random
+    vocabulary = [f"wort{n}" for n in range(5000)] + ["die", "und", "ist"]
+    emoji = ["😀", "👍", "🐼", "❤"]
+    texts = []
+    for _ in range(count):
+        words = [
+            vocabulary[min(int(rnd.paretovariate(1.1)), len(vocabulary)) - 1]
+            for _ in range(rnd.randrange(1, 20))
+        ]
+        if rnd.random() < 0.3:
+            words.append(rnd.choice(emoji))
+        texts.append(" ".join(words))
+    timestamp = datetime.now(timezone.utc)
+
+    words = WordStats(maxsize=count)
+    start = time.perf_counter()
+    for text in texts:
+        words.put(workload.group_ids[0], timestamp, text)
+    queued = time.perf_counter() - start
+    start = time.perf_counter()
+    while words.depth():
+        words._count(*words._queue.get_nowait())  # pylint: disable=protected-access
+    counted = time.perf_counter() - start
+    return {
+        "messages": count,
+        "put_us": round(queued / count * 1e6, 2),
+        "count_us": round(counted / count * 1e6, 2),
+        "evicted": words.stats()["evicted"],
+    }
+
+
+def bench_handlers(yve, workload, repeat):
+    """Time the statistics handlers."""
+    rnd = workload.random
+    context = StubContext(workload.bot)
+    results = {}
+
+    def snapshot():
+        db_get_stats_snapshot(rnd.choice(workload.group_ids + [None]), rnd.randrange(4))
+
+    def statistic_message():
+        group_id = rnd.choice(workload.group_ids + [None])
+        yve.get_statistic_message(group_id, rnd.randrange(4))
+
+    def user_statistic():
+        yve.user_statistic(workload.command("/me"), context)
+
+    sent = {}
+
+    def button_pressed():
+        group_id = rnd.choice(workload.group_ids)
+        if group_id not in sent:
+            yve.total_statistics(workload.command("/stats", group_id), context)
+            sent[group_id] = workload.bot.message_id
+        message_id = sent[group_id]
+        _, state = yve.PAGINATION.get(group_id, message_id)
+        if state == 3 or (state > 0 and rnd.random() < 0.5):
+            direction = "backward"
+        else:
+            direction = "forward"
+        yve.button_pressed(workload.button(message_id, direction, group_id), context)
+
+    results["stats_snapshot"] = percentiles(timed(snapshot, repeat))
+    # Every call computes the message, the snapshot cache is empty
+    results["get_statistic_message"] = percentiles(
+        timed(statistic_message, repeat, setup=yve.STATS_CACHE.clear)
+    )
+    results["get_statistic_message_cached"] = percentiles(
+        timed(statistic_message, repeat)
+    )
+    results["user_statistic"] = percentiles(timed(user_statistic, repeat))
+    results["button_pressed"] = percentiles(timed(button_pressed, repeat))
+    return results
+
+
+def main():
+    """Run the benchmark and output the results as JSON."""
+    parser = argparse.ArgumentParser(description="Yve load benchmark.")
+    parser.add_argument(
+        "--sizes",
+        default="10000,1000000,10000000",
+        help="comma separated database sizes in messages",
+    )
+    parser.add_argument("--groups", type=int, default=10, help="number of groups")
+    parser.add_argument("--users", type=int, default=1000, help="number of users")
+    parser.add_argument(
+        "--ingest",
+        type=int,
+        default=10000,
+        help="messages fed through process_message per size",
+    )
+    parser.add_argument("--repeat", type=int, default=200, help="calls per handler")
+    parser.add_argument("--write-behind", action="store_true", help="batch writes")
+    parser.add_argument("--output", help="write the JSON to this file")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "benchmark.sqlite3")
+        bot = StubBot()
+        workload = Workload(bot, args.groups, args.users)
+
+        # Point the bot to the temporary database and the synthetic groups
+        DBHelper.connections = ConnectionManager(
+            path, config.SQLITE3_MMAP_SIZE, config.SQLITE3_CACHE_SIZE
+        )
+        DBHelper.ids.clear()
+        config.GROUPS.extend(workload.group_ids)
+        yve_main.SELECTED_MESSAGES.reload(config.GROUPS, config.MESSAGE_TYPES)
+        create, restart = create_database(workload)
+        startup = bench_startup()
+        startup["create_database_ms"] = round(create * 1000, 1)
+        startup["open_database_ms"] = round(restart * 1000, 1)
+
+        yve_main.WRITE_BEHIND = args.write_behind
+        # The stub bot has no flood limits and sends text only
+        yve_main.OUTBOX = None
+        yve_main.CHART_CACHE = None
+        yve_main.WRITE_QUEUE = WriteQueue(
+            config.WRITE_BEHIND_BATCH_SIZE,
+            config.WRITE_BEHIND_FLUSH_MS,
+            config.WRITE_BEHIND_QUEUE_SIZE,
+            on_commit=yve_main.LEADERBOARDS.add,
+        )
+        yve_main.WRITE_QUEUE.start()
+        if yve_main.WORDS:
+            yve_main.WORDS.start()
+
+        results = []
+        rows = 0
+        for size in sizes:
+            print(f"Seeding {size} messages... ", end="", file=sys.stderr, flush=True)
+            seed_messages(path, workload, max(0, size - rows - args.ingest))
+            print("Done.", file=sys.stderr)
+            # The seeded rows bypass the writer thread
+            start = time.perf_counter()
+            yve_main.WRITE_QUEUE.submit(yve_main.LEADERBOARDS.rebuild).result()
+            rebuild = time.perf_counter() - start
+            ingest = bench_ingest(yve_main, workload, min(args.ingest, size))
+            rows = DBHelper().db.execute("SELECT COUNT(*) FROM Message").fetchone()[0]
+            # Measure the database, not the snapshot cache of the last size
+            yve_main.STATS_CACHE = StatsCache(
+                config.STATS_MAX_AGE, config.STATS_MAX_WRITES
+            )
+            results.append(
+                {
+                    "rows": rows,
+                    "ingest": ingest,
+                    "leaderboard_rebuild_s": round(rebuild, 3),
+                    "latency_ms": bench_handlers(yve_main, workload, args.repeat),
+                }
+            )
+
+        if yve_main.WORDS:
+            yve_main.WORDS.stop()
+            yve_main.WORDS.flush()
+        yve_main.WRITE_QUEUE.stop()
+        DBHelper.connections.close()
+
+    report = {
+        "groups": args.groups,
+        "users": args.users,
+        "write_behind": args.write_behind,
+        "message_types": workload.types,
+        "startup": startup,
+        "words": bench_words(workload, 20000),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Optional charts of the statistics messages (matplotlib).
+
+The charts are drawn in worker processes, so the CPU time of matplotlib
+neither holds up the dispatcher threads nor the GIL of the bot. The
+workers run chartworker.py, which imports neither the bot nor its
+config. Every chart is cached by a digest of the plotted data. After
+the first upload only its Telegram file_id is kept, further sends of
+the same chart neither draw nor upload it again.
+
+"""
+
+
+import os
+import sys
+import pickle
+import select
+import hashlib
+import threading
+import subprocess
+from queue import Empty, LifoQueue
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+
+try:
+    import matplotlib
+except ImportError:  # pragma: no cover
+    matplotlib = None
+
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chartworker.py")
+
+# Longest caption of a photo message
+CAPTION_LIMIT = 1024
+
+
+def available():
+    """Return True if matplotlib is installed."""
+    return matplotlib is not None
+
+
+def chart_key(title, days, types):
+    """Return the cache key of a chart, a digest of the plotted data.
+
+    Args:
+        title (str): Title of the chart
+        days (list): (day, count) tuples in day order
+        types (list): (count, type name) tuples
+
+    """
+    data = repr((title, list(days), list(types))).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def caption(text):
+    """Shorten a statistics message to the caption limit of a photo by
+    dropping its last lines.
+
+    """
+    while len(text) > CAPTION_LIMIT and "\n" in text:
+        text = text.rsplit("\n", 1)[0]
+    return text[:CAPTION_LIMIT]
+
+
+class _Worker:
+    """A chart worker process, see chartworker.py."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def render(self, args, timeout):
+        """Draw a chart, raise TimeoutError if it takes longer than
+        timeout seconds.
+
+        """
+        pickle.dump(args, self.process.stdin)
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f"No chart after {timeout}s")
+        # Raises EOFError if the worker died
+        ok, result = pickle.load(self.process.stdout)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        """Stop the worker, it exits when stdin is closed."""
+        try:
+            self.process.stdin.close()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        """Stop a busy or hung worker."""
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class Charts:
+    """Draw and cache the charts of the statistics messages.
+
+    Args:
+        workers (int): Processes drawing the charts
+        cache_size (int): Number of cached charts
+        timeout (int): Seconds to wait for a chart, the message is sent
+                       without it otherwise
+
+    """
+
+    def __init__(self, workers=1, cache_size=256, timeout=10):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+        # Idle workers, at most workers are started
+        self._idle = LifoQueue()
+        self._started = 0
+        # key: PNG (bytes) until uploaded, then the file_id (str)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.renders = 0
+        self.uploads = 0
+        self.errors = 0
+
+    def get(self, key, args):
+        """Return the cached chart of key or draw it, once for all
+        concurrent calls with the same key.
+
+        Args:
+            key (str): chart_key() of the arguments
+            args (tuple): The arguments of chartworker.render()
+
+        Returns:
+            The file_id (str) or the PNG (bytes), None if the chart
+            couldn't be drawn in time.
+
+        """
+        with self._lock:
+            chart = self._cache.get(key)
+            if chart is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return chart
+        return self._flights.do(key, self._render, key, args)
+
+    def _acquire(self):
+        # An idle worker, a new one or the next one that gets idle
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            start = self._started < self.workers
+            if start:
+                self._started += 1
+        if start:
+            try:
+                return _Worker()
+            except OSError:
+                self._stopped()
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except Empty:
+            raise TimeoutError("All chart workers are busy") from None
+
+    def _stopped(self):
+        with self._lock:
+            self._started -= 1
+
+    def _render(self, key, args):
+        worker = None
+        try:
+            worker = self._acquire()
+            png = worker.render(args, self.timeout)
+        except Exception as error:  # pylint: disable=broad-except
+            # Includes the timeout, the message is sent without chart
+            print(f"Can't draw the chart: {error!r}")
+            with self._lock:
+                self.errors += 1
+            if isinstance(error, RuntimeError):
+                # matplotlib failed, the worker is fine
+                self._idle.put(worker)
+            elif worker is not None:
+                # Timed out or died, the next chart starts a new one
+                worker.kill()
+                self._stopped()
+            return None
+        self._idle.put(worker)
+        with self._lock:
+            self.renders += 1
+        self._store(key, png)
+        return png
+
+    def uploaded(self, key, file_id):
+        """Keep only the file_id of an uploaded chart."""
+        with self._lock:
+            if isinstance(self._cache.get(key), bytes):
+                self.uploads += 1
+        self._store(key, file_id)
+
+    def _store(self, key, chart):
+        with self._lock:
+            self._cache[key] = chart
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        """Return the counters of the chart cache."""
+        with self._lock:
+            return {
+                "charts": len(self._cache),
+                "hits": self.hits,
+                "renders": self.renders,
+                "uploads": self.uploads,
+                "errors": self.errors,
+            }
+
+    def close(self):
+        """Stop the idle worker processes."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except Empty:
+                break
+            worker.close()
+            self._stopped()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+
+"""
+    Worker process of the charts (matplotlib).
+
+    Started by charts.Charts as a script of its own, so the worker
+    imports neither the bot nor its config. Reads the pickled arguments
+    of render() from stdin and writes the pickled (ok, PNG or error)
+    for every chart to stdout, until stdin is closed.
+
+"""
+
+import io
+import sys
+import pickle
+
+
+def render(title, days, types):
+    """Draw the messages per day and the share of the message types.
+
+    Args:
+        title (str): Title of the chart
+        days (list): (day, count) tuples in day order
+        types (list): (count, type name) tuples
+
+    Returns:
+        The PNG image (bytes).
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4), dpi=100)
+    per_day, share = fig.subplots(1, 2, gridspec_kw={"width_ratios": [2, 1]})
+
+    per_day.bar(range(len(days)), [count for _, count in days], color="#4c72b0")
+    ticks = range(0, len(days), max(1, len(days) // 6))
+    per_day.set_xticks(list(ticks))
+    per_day.set_xticklabels([days[tick][0][5:] for tick in ticks])
+    per_day.set_title("Nachrichten pro Tag")
+
+    total = sum(count for count, _ in types) or 1
+    names = [name for _, name in reversed(types)]
+    shares = [count / total * 100 for count, _ in reversed(types)]
+    share.barh(names, shares, color="#dd8452")
+    share.set_xlabel("%")
+    share.set_title("Nachrichtentypen")
+
+    fig.suptitle(title)
+    fig.tight_layout()
+    png = io.BytesIO()
+    fig.savefig(png, format="png")
+    return png.getvalue()
+
+
+def main():
+    """Draw the charts requested on stdin."""
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        try:
+            args = pickle.load(stdin)
+        except EOFError:
+            break
+        try:
+            result = (True, render(*args))
+        except Exception as error:  # pylint: disable=broad-except
+            result = (False, repr(error))
+        pickle.dump(result, stdout)
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
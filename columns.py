@@ -0,0 +1,228 @@
+"""Optional in-memory columnar copy of the Message table (NumPy).
+
+The statistics are answered from NumPy columns of all messages instead
+of the daily rollups: the counts and the type histogram with one
+bincount over the messages of the timespan, the top posters with
+argpartition. The engine needs numpy and is used for the commands in
+ANALYTICS_NUMPY_COMMANDS only, the rollups stay the default.
+
+"""
+
+
+import threading
+from datetime import date, datetime, timezone
+
+from dbhelper import DBHelper, to_epoch
+from dbqueries import StatsSnapshot, db_get_type_names, db_get_user_names
+from queries import timespan_start
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+# Column: dtype
+COLUMNS = {
+    "group": "int32",
+    "user": "int32",
+    "type": "int32",
+    "length": "int16",
+    "ts": "int64",
+}
+LENGTH_MAX = 32767
+
+
+def available():
+    """Return True if numpy is installed."""
+    return np is not None
+
+
+def _empty_columns():
+    return {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+
+
+def _to_values(rows):
+    # rows: (group row id, user row id, type row id, length, ts)
+    values = np.array(rows, dtype="int64").reshape(-1, len(COLUMNS))
+    np.clip(values[:, 3], 0, LENGTH_MAX, out=values[:, 3])
+    return values
+
+
+def _append_values(columns, size, values):
+    """Write values after the first size rows of columns, doubling the
+    capacity if needed. Grown columns are new arrays, the old ones stay
+    valid for their readers.
+
+    Returns:
+        The new size.
+
+    """
+    capacity = len(columns["ts"])
+    if size + len(values) > capacity:
+        capacity = max(size + len(values), capacity * 2, 1024)
+        for name, column in columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:size] = column[:size]
+            columns[name] = grown
+    for index, column in enumerate(columns.values()):
+        column[size : size + len(values)] = values[:, index]
+    return size + len(values)
+
+
+def _since_epoch(since):
+    # First day (YYYY-MM-DD) to the epoch of its midnight (UTC)
+    if not since:
+        return 0
+    day = date.fromisoformat(since)
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+class ColumnStore:
+    """All messages as NumPy columns, keyed by the row ids of group,
+    user and type like in the Message table.
+
+    The columns are loaded by load() and appended to by add() for every
+    written message. Both run in the writer thread, so no message is
+    missed or counted twice. Readers work on the first n rows, which
+    add() never changes, so they don't block the writer. load() builds
+    new columns and swaps them in when they are complete, readers see
+    the old or the new columns, never a partial load.
+
+    Args:
+        top_size (int): Number of top posters
+        chunk_size (int): Rows read from the database at once by load()
+
+    """
+
+    def __init__(self, top_size=10, chunk_size=50000):
+        if np is None:
+            raise RuntimeError("The columnar engine needs numpy")
+        self.top_size = top_size
+        self.chunk_size = chunk_size
+        self.loaded = False
+        self.stale = False
+        self._type_names = {}
+        self._columns = _empty_columns()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _append(self, rows):
+        if not rows:
+            return
+        values = _to_values(rows)
+        with self._lock:
+            self._size = _append_values(self._columns, self._size, values)
+
+    def load(self):
+        """Load all messages from the database. Run it in the writer
+        thread, so no message is written meanwhile.
+
+        """
+        # Readers keep using the old columns until the new ones are
+        # complete, then both are swapped at once
+        columns = _empty_columns()
+        size = 0
+        for rows in DBHelper().sql_iter_message_columns(self.chunk_size):
+            if rows:
+                size = _append_values(columns, size, _to_values(rows))
+        type_names = db_get_type_names()
+        with self._lock:
+            self._columns = columns
+            self._size = size
+            self._type_names = type_names
+        self.loaded = True
+        self.stale = False
+
+    def add(self, rows):
+        """Append written messages. Called by the writer thread after the
+        messages are committed.
+
+        Args:
+            rows (list): Tuples of (group_id, user_id_hash, user_name,
+                         msg_type, length, timestamp)
+
+        """
+        ids = DBHelper.ids
+        resolved = []
+        for group_id, user_id_hash, _, msg_type, length, timestamp in rows:
+            group_rowid = ids.groups.get(group_id)
+            user_rowid = ids.users.get(user_id_hash)
+            if group_rowid is None or user_rowid is None:
+                self.stale = True
+                continue
+            resolved.append(
+                (
+                    group_rowid,
+                    user_rowid,
+                    ids.types.get(msg_type) or 0,
+                    length or 0,
+                    to_epoch(timestamp),
+                )
+            )
+        self._append(resolved)
+
+    def _select(self, group_id, timespan):
+        # Views of the columns restricted to the group and the timespan
+        with self._lock:
+            size = self._size
+            columns = {name: column[:size] for name, column in self._columns.items()}
+        mask = columns["ts"] >= _since_epoch(timespan_start(timespan))
+        if group_id:
+            group_rowid = DBHelper.ids.groups.get(group_id)
+            if group_rowid is None:
+                return None
+            mask &= columns["group"] == group_rowid
+        return columns, mask
+
+    def snapshot(self, group_id, timespan):
+        """Count the messages and the message types of a group, or of all
+        groups if group_id is None, like db_get_stats_snapshot().
+
+        Returns:
+            StatsSnapshot
+
+        """
+        selected = self._select(group_id, timespan)
+        if selected is None:
+            return StatsSnapshot(group_id, timespan, 0, [])
+        columns, mask = selected
+
+        counts = np.bincount(columns["type"][mask])
+        type_ids = np.flatnonzero(counts)
+        types = [
+            (int(counts[type_id]), self._type_names[type_id])
+            for type_id in type_ids[np.argsort(-counts[type_ids], kind="stable")]
+            if type_id in self._type_names
+        ]
+        return StatsSnapshot(group_id, timespan, int(np.count_nonzero(mask)), types)
+
+    def top(self, group_id, timespan):
+        """Return the top posters of a group (or all groups if group_id
+        is None) and timespan.
+
+        Returns:
+            List of (count, user name) tuples.
+
+        """
+        selected = self._select(group_id, timespan)
+        if selected is None:
+            return []
+        columns, mask = selected
+
+        counts = np.bincount(columns["user"][mask])
+        size = min(self.top_size, np.count_nonzero(counts))
+        if not size:
+            return []
+        top = np.argpartition(counts, -size)[-size:]
+        top = top[np.argsort(-counts[top], kind="stable")]
+        names = db_get_user_names([int(user_rowid) for user_rowid in top])
+        return [(int(counts[rowid]), names.get(int(rowid), "")) for rowid in top]
+
+    def stats(self):
+        """Return the number of messages and the memory of the columns."""
+        with self._lock:
+            return {
+                "messages": self._size,
+                "bytes": sum(column.nbytes for column in self._columns.values()),
+            }
@@ -3,7 +3,6 @@
 
 import os
 import sys
-from pathlib import Path
 import yaml
 
 
@@ -11,14 +10,22 @@ import yaml
 # Load config.yaml                        #
 ###########################################
 PATH = os.path.dirname(os.path.abspath(__file__))
-config_file = PATH + "/config.yaml"
-my_file = Path(config_file)
-if my_file.is_file():
+# YVE_CONFIG points to another config file, e.g. for the tests
+config_file = os.environ.get("YVE_CONFIG", PATH + "/config.yaml")
+
+
+def load_config():
+    """Read config.yaml, also used to reload it on SIGHUP."""
     with open(config_file) as fp:
-        config = yaml.safe_load(fp)
+        return yaml.safe_load(fp)
+
+
+if os.path.isfile(config_file):
+    config = load_config()
 else:
-    print("config.yaml file does not exists. Please make one  from config.sample.yaml file")
-    sys.exit()
+    sys.exit(
+        f"{config_file} does not exist. Please make one from config.sample.yaml"
+    )
 
 
 BOTNAME = config["BOT_USERNAME"]
@@ -28,8 +35,81 @@ ADMINS = config["ADMINS"]
 GROUPS = config["GROUPS"]
 MESSAGE_TYPES = config["MESSAGE_TYPES"]
 SQLITE3_DB = config["SQLITE3_DB"]
+SQLITE3_MMAP_SIZE = config.get("SQLITE3_MMAP_SIZE", 67108864)
+SQLITE3_CACHE_SIZE = config.get("SQLITE3_CACHE_SIZE", -16000)
+
+# user ID hashing: "sha512" (hex string) or "blake2b" (keyed, 16 byte blob)
+USER_HASH = config.get("USER_HASH", "sha512")
+USER_HASH_KEY = config.get("USER_HASH_KEY", "")
+USER_HASH_CACHE_SIZE = config.get("USER_HASH_CACHE_SIZE", 4096)
+
+# metrics endpoint, off if the port is 0
+METRICS_HOST = config.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = config.get("METRICS_PORT", 0)
+
+# statistics cache
+STATS_MAX_AGE = config.get("STATS_MAX_AGE", 60)
+STATS_MAX_WRITES = config.get("STATS_MAX_WRITES", 1000)
+
+# online schema migrations
+MIGRATION_BATCH_SIZE = config.get("MIGRATION_BATCH_SIZE", 5000)
+MIGRATION_PAUSE_MS = config.get("MIGRATION_PAUSE_MS", 50)
+
+# page state of the statistics messages
+PAGINATION_MAX_PER_CHAT = config.get("PAGINATION_MAX_PER_CHAT", 100)
+PAGINATION_TTL_DAYS = config.get("PAGINATION_TTL_DAYS", 30)
+PAGINATION_PERSIST = config.get("PAGINATION_PERSIST", True)
+
+# retention of the raw messages, off if the number of days is 0
+RETENTION_DAYS = config.get("RETENTION_DAYS", 0)
+RETENTION_INTERVAL = config.get("RETENTION_INTERVAL", 3600)
+RETENTION_BATCH_SIZE = config.get("RETENTION_BATCH_SIZE", 1000)
+RETENTION_PAUSE_MS = config.get("RETENTION_PAUSE_MS", 50)
+RETENTION_VACUUM_PAGES = config.get("RETENTION_VACUUM_PAGES", 1000)
+
+# word and emoji statistics (/words)
+WORD_STATS = config.get("WORD_STATS", True)
+WORD_STATS_VOCABULARY = config.get("WORD_STATS_VOCABULARY", 1000)
+WORD_STATS_QUEUE_SIZE = config.get("WORD_STATS_QUEUE_SIZE", 10000)
+WORD_STATS_FLUSH_INTERVAL = config.get("WORD_STATS_FLUSH_INTERVAL", 60)
+WORD_STATS_STOP_WORDS = config.get("WORD_STATS_STOP_WORDS", [])
+
+# charts of the /stats messages (matplotlib)
+CHARTS = config.get("CHARTS", False)
+CHART_WORKERS = config.get("CHART_WORKERS", 1)
+CHART_CACHE_SIZE = config.get("CHART_CACHE_SIZE", 256)
+CHART_TIMEOUT = config.get("CHART_TIMEOUT", 10)
+
+# commands answered by the NumPy columnar engine: "stats", "networkstats"
+ANALYTICS_NUMPY_COMMANDS = config.get("ANALYTICS_NUMPY_COMMANDS", [])
+
+# databases of all shards for the network statistics, empty for one process
+SHARDS = config.get("SHARDS", [])
+if SHARDS and SQLITE3_DB not in SHARDS:
+    SHARDS = [SQLITE3_DB] + SHARDS
 
 # webhook
 PUB_IP = config["PUB_IP"]
 CERT = config["CERT"]
 PRIV_KEY = config["PRIV_KEY"]
+
+# number of worker threads for the read-only commands
+DISPATCHER_WORKERS = config.get("DISPATCHER_WORKERS", 8)
+
+# flood limits of the sent messages
+RATE_LIMIT = config.get("RATE_LIMIT", True)
+RATE_LIMIT_GROUP_PER_MINUTE = config.get("RATE_LIMIT_GROUP_PER_MINUTE", 20)
+RATE_LIMIT_CHAT_PER_SECOND = config.get("RATE_LIMIT_CHAT_PER_SECOND", 1)
+RATE_LIMIT_GLOBAL_PER_SECOND = config.get("RATE_LIMIT_GLOBAL_PER_SECOND", 30)
+RATE_LIMIT_RETRIES = config.get("RATE_LIMIT_RETRIES", 3)
+RATE_LIMIT_STOP_TIMEOUT = config.get("RATE_LIMIT_STOP_TIMEOUT", 10)
+
+# journal of the received updates (optional)
+JOURNAL_DB = config.get("JOURNAL_DB", "")
+JOURNAL_CHECKPOINT_INTERVAL = config.get("JOURNAL_CHECKPOINT_INTERVAL", 1)
+
+# write-behind ingestion (optional)
+WRITE_BEHIND = config.get("WRITE_BEHIND", False)
+WRITE_BEHIND_BATCH_SIZE = config.get("WRITE_BEHIND_BATCH_SIZE", 500)
+WRITE_BEHIND_FLUSH_MS = config.get("WRITE_BEHIND_FLUSH_MS", 250)
+WRITE_BEHIND_QUEUE_SIZE = config.get("WRITE_BEHIND_QUEUE_SIZE", 10000)
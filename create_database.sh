@@ -1,5 +1,16 @@
 #!/bin/bash
 
-[ -f ./db/panda.sqlite3 ] && mv ./db/panda.sqlite3 ./db/panda.sqlite3.bak
-sqlite3 ./db/panda.sqlite3 < ./db/create_panda_db.sql
-[ -f ./db/panda.sqlite3 ] && echo "Done."
+set -e
+cd "$(dirname "$0")"
+
+# The database of the config, init fails without a config.yaml
+DB=$(python3 -c "from config import SQLITE3_DB; print(SQLITE3_DB)")
+
+if [ -f "$DB" ]; then
+    mv "$DB" "$DB.bak"
+    # Keep the not yet checkpointed WAL with the backup
+    [ -f "$DB-wal" ] && mv "$DB-wal" "$DB.bak-wal"
+    rm -f "$DB-shm"
+fi
+./yve_admin.py init
+echo "Done."
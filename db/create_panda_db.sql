@@ -1,3 +1,5 @@
+-- Free pages are returned to the file system by the retention job
+PRAGMA auto_vacuum = INCREMENTAL;
 BEGIN TRANSACTION;
 	CREATE TABLE IF NOT EXISTS `Telegram_User` (
 		`id`		INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,11 +25,30 @@ BEGIN TRANSACTION;
 		`msg_type`	INTEGER,
 		`msg_length`	INTEGER,
 		`timestamp`	TEXT,
+		`ts`		INTEGER,
 		FOREIGN KEY(`group_id`) REFERENCES `Telegram_Group`(`id`),
 		FOREIGN KEY(`user_id`) REFERENCES `Telegram_User`(`id`),
 		FOREIGN KEY(`msg_type`) REFERENCES `Telegram_Type`(`id`)
 	);
-	INSERT INTO Telegram_Type (message_type,msg_type_ger) VALUES
+	CREATE INDEX IF NOT EXISTS `Message_group_ts` ON `Message` (`group_id`, `ts`);
+	CREATE TABLE IF NOT EXISTS `Pagination_State` (
+		`chat_id`	INTEGER NOT NULL,
+		`message_id`	INTEGER NOT NULL,
+		`group_id`	INTEGER,
+		`timespan`	INTEGER NOT NULL DEFAULT 0,
+		`updated`	INTEGER NOT NULL,
+		PRIMARY KEY(`chat_id`, `message_id`)
+	) WITHOUT ROWID;
+	CREATE TABLE IF NOT EXISTS `Word_Daily` (
+		`group_id`	INTEGER NOT NULL,
+		`day`		TEXT NOT NULL,
+		`word`		TEXT NOT NULL,
+		`emoji`		INTEGER NOT NULL DEFAULT 0,
+		`word_count`	INTEGER NOT NULL DEFAULT 0,
+		PRIMARY KEY(`group_id`, `day`, `word`)
+	) WITHOUT ROWID;
+	CREATE INDEX IF NOT EXISTS `Word_Daily_day` ON `Word_Daily` (`day`);
+	INSERT OR IGNORE INTO Telegram_Type (message_type,msg_type_ger) VALUES
 		('audio','Audio'), ('game','Spiel'), ('document','Dokument'), ('photo','Foto'),
 		('animation','Animation'), ('sticker','Sticker'), ('video','Video'),
 		('voice','Sprache'), ('video_note','Videonachricht'), ('contact','Kontakt'),
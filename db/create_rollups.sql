@@ -0,0 +1,29 @@
+BEGIN TRANSACTION;
+	CREATE TABLE IF NOT EXISTS `Message_Day_Type` (
+		`group_id`	INTEGER NOT NULL,
+		`day`		TEXT NOT NULL,
+		`msg_type`	INTEGER NOT NULL,
+		`msg_count`	INTEGER NOT NULL DEFAULT 0,
+		PRIMARY KEY(`group_id`, `day`, `msg_type`)
+	) WITHOUT ROWID;
+	CREATE TABLE IF NOT EXISTS `Message_Day_User` (
+		`group_id`	INTEGER NOT NULL,
+		`day`		TEXT NOT NULL,
+		`user_id`	INTEGER NOT NULL,
+		`msg_count`	INTEGER NOT NULL DEFAULT 0,
+		PRIMARY KEY(`group_id`, `day`, `user_id`)
+	) WITHOUT ROWID;
+	CREATE INDEX IF NOT EXISTS `Message_Day_Type_day` ON `Message_Day_Type` (`day`);
+	CREATE INDEX IF NOT EXISTS `Message_Day_User_day` ON `Message_Day_User` (`day`);
+	CREATE INDEX IF NOT EXISTS `Message_Day_User_user` ON `Message_Day_User` (`user_id`, `group_id`);
+	-- Keep the daily counters up to date in the same transaction as the insert
+	CREATE TRIGGER IF NOT EXISTS `Message_Rollup` AFTER INSERT ON `Message`
+	BEGIN
+		INSERT INTO Message_Day_Type (group_id, day, msg_type, msg_count)
+			VALUES (NEW.group_id, date(NEW.timestamp), IFNULL(NEW.msg_type, 0), 1)
+			ON CONFLICT(group_id, day, msg_type) DO UPDATE SET msg_count=msg_count+1;
+		INSERT INTO Message_Day_User (group_id, day, user_id, msg_count)
+			VALUES (NEW.group_id, date(NEW.timestamp), NEW.user_id, 1)
+			ON CONFLICT(group_id, day, user_id) DO UPDATE SET msg_count=msg_count+1;
+	END;
+	COMMIT;
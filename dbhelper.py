@@ -1,21 +1,128 @@
 """DB helper functions."""
 
 
+import json
 import sqlite3
+import threading
+from contextlib import contextmanager
 from sqlite3 import Error as DB_Error
-from config import SQLITE3_DB
+from config import PATH, SQLITE3_DB, SQLITE3_MMAP_SIZE, SQLITE3_CACHE_SIZE
+from metrics import instrument_methods
+from queries import QUERIES
+
+
+SCHEMA = PATH + "/db/create_panda_db.sql"
+ROLLUP_SCHEMA = PATH + "/db/create_rollups.sql"
+
+
+def to_epoch(timestamp):
+    """Convert a datetime as sent by Telegram to seconds since the epoch."""
+    return int(timestamp.timestamp())
+
+
+class ConnectionManager:
+    """Hold one writer connection and one read connection per thread.
+
+    The connections are opened on first use and stay open until close()
+    is called. The database runs in WAL mode, so readers never wait for
+    the writer and vice versa.
+
+    """
+
+    def __init__(self, dbpath, mmap_size=0, cache_size=-2000):
+        self.dbpath = dbpath
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._readers = []
+        self._writer = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA foreign_keys=on")
+        db.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        db.execute(f"PRAGMA cache_size={self.cache_size}")
+        return db
+
+    def reader(self):
+        """Return the read connection of the current thread."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._connect()
+            db.execute("PRAGMA query_only=on")
+            self._local.db = db
+            with self._lock:
+                self._readers.append(db)
+        return db
+
+    @contextmanager
+    def writer(self):
+        """Lock the writer connection and run the block in a transaction,
+        which is committed at the end or rolled back on an exception.
 
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            with self._writer:
+                yield self._writer
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            for db in self._readers:
+                db.close()
+            self._readers = []
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            # Readers of other threads are closed now, too
+            self._local = threading.local()
+
+
+class IdCache:
+    """Map Telegram group IDs, user ID hashes and message types to the
+    row ids of Telegram_Group, Telegram_User and Telegram_Type.
+
+    Only used with the writer connection (under its lock). All mappings
+    are loaded once and filled on a miss.
+
+    """
 
+    def __init__(self):
+        self.loaded = False
+        self.groups = {}
+        self.users = {}
+        self.types = {}
+
+    def load(self, db):
+        """Load all mappings from the database."""
+        self.groups = dict(db.execute("SELECT group_id, id FROM Telegram_Group"))
+        self.users = dict(db.execute("SELECT user_id, id FROM Telegram_User"))
+        self.types = dict(db.execute("SELECT message_type, id FROM Telegram_Type"))
+        self.loaded = True
+
+    def clear(self):
+        """Forget all mappings, they are loaded again on the next insert."""
+        self.loaded = False
+        self.groups = {}
+        self.users = {}
+        self.types = {}
+
+
+@instrument_methods
 class DBHelper:
     """DB helper class."""
 
-    dbpath = SQLITE3_DB
+    connections = ConnectionManager(SQLITE3_DB, SQLITE3_MMAP_SIZE, SQLITE3_CACHE_SIZE)
+    ids = IdCache()
 
     def __init__(self):
         try:
-            self.db = sqlite3.connect(self.dbpath)
-            self.cursor = self.db.cursor()
-            self.db.execute("PRAGMA foreign_keys=on")
+            self.db = self.connections.reader()
         except DB_Error as db_error:
             print(db_error)
 
@@ -34,8 +141,22 @@ class DBHelper:
             "INSERT OR IGNORE INTO Telegram_Group (group_id, group_name) VALUES (?, ?)"
         )
         arg = (group_id, group_name)
-        self.db.execute(stmt, arg)
-        self.db.commit()
+        with self.connections.writer() as db:
+            db.execute(stmt, arg)
+
+    def sql_add_groups(self, group_ids):
+        """Add groups to the Telegram_Group table in one transaction.
+
+        Args:
+            group_ids (list): Telegram group IDs
+
+        Return:
+            None.
+
+        """
+        stmt = "INSERT OR IGNORE INTO Telegram_Group (group_id) VALUES (?)"
+        with self.connections.writer() as db:
+            db.executemany(stmt, [(group_id,) for group_id in group_ids])
 
     def sql_add_user(self, user_id_hash, user_name):
         """Add a user to the Telegram_User table.
@@ -50,15 +171,74 @@ class DBHelper:
         """
         stmt = "INSERT OR IGNORE INTO Telegram_User (user_id, user_name) VALUES (?, ?)"
         arg = (user_id_hash, user_name)
-        self.db.execute(stmt, arg)
-        self.db.commit()
+        with self.connections.writer() as db:
+            db.execute(stmt, arg)
 
-    def sql_add_message(self, group_id, user_id_hash, msg_type, length, timestamp):
-        """Add an entry to the message table.
+    def _resolve_message(self, db, row, added):
+        """Resolve the row ids of group, user and type of a message.
+        Unknown users are added within the current transaction and
+        their hash is appended to added.
+
+        Args:
+            db: The writer connection
+            row (tuple): (group_id, user_id_hash, user_name, msg_type,
+                          length, timestamp)
+            added (list): Hashes of the users added in this transaction
+
+        Returns:
+            The values for the Message table (tuple).
+
+        """
+        group_id, user_id_hash, user_name, msg_type, length, timestamp = row
+        ids = self.ids
+        if not ids.loaded:
+            ids.load(db)
+
+        group_rowid = ids.groups.get(group_id)
+        if group_rowid is None:
+            stmt = "SELECT id FROM Telegram_Group WHERE group_id=(?)"
+            found = db.execute(stmt, (group_id,)).fetchone()
+            if found:
+                group_rowid = ids.groups[group_id] = found[0]
+
+        type_rowid = ids.types.get(msg_type)
+        if type_rowid is None:
+            stmt = "SELECT id FROM Telegram_Type WHERE message_type=(?)"
+            found = db.execute(stmt, (msg_type,)).fetchone()
+            if found:
+                type_rowid = ids.types[msg_type] = found[0]
+
+        user_rowid = ids.users.get(user_id_hash)
+        if user_rowid is None:
+            stmt = (
+                "INSERT OR IGNORE INTO Telegram_User (user_id, user_name) "
+                "VALUES (?, ?)"
+            )
+            db.execute(stmt, (user_id_hash, user_name))
+            stmt = "SELECT id FROM Telegram_User WHERE user_id=(?)"
+            user_rowid = db.execute(stmt, (user_id_hash,)).fetchone()[0]
+            ids.users[user_id_hash] = user_rowid
+            added.append(user_id_hash)
+
+        return (
+            group_rowid,
+            user_rowid,
+            type_rowid,
+            length,
+            timestamp,
+            to_epoch(timestamp),
+        )
+
+    def sql_add_message(
+        self, group_id, user_id_hash, user_name, msg_type, length, timestamp
+    ):
+        """Add an entry to the message table. Unknown users are added
+        to the Telegram_User table in the same transaction.
 
         Args:
             group (int)         : Telegram Group ID
             user_id_hash (str)  : Hash value of the user ID (foreign key -> User(id))
+            user_name (str)     : Telegram user name
             type (str)          : Type of the message (foreign key -> Type(id))
             length (int)        : Length of the message (words)
             timestamp (datetime): Date and time as sent by Telegram
@@ -66,63 +246,255 @@ class DBHelper:
         Return:
             None.
 
-        Raises ValueError if user(/group/type) does not exist in db.
+        Raises ValueError if group does not exist in db.
 
         """
+        self.sql_add_messages(
+            [(group_id, user_id_hash, user_name, msg_type, length, timestamp)]
+        )
+
+    def _insert_messages(self, db, rows):
+        added = []
         try:
-            stmt = (
+            messages = [self._resolve_message(db, row, added) for row in rows]
+            db.executemany(
                 "INSERT INTO Message "
-                "   (group_id, user_id, msg_type, msg_length, timestamp) "
-                "VALUES "
-                "   ((SELECT id FROM Telegram_Group WHERE group_id=(?)), "
-                "    (SELECT id FROM Telegram_User WHERE user_id=(?)), "
-                "    (SELECT id FROM Telegram_Type WHERE message_type=(?)), "
-                "    ?, ?)"
+                "   (group_id, user_id, msg_type, msg_length, timestamp, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                messages,
             )
-            arg = (group_id, user_id_hash, msg_type, length, timestamp)
-            self.db.execute(stmt, arg)
-            self.db.commit()
+        except DB_Error:
+            # The users are rolled back, too
+            for user_id_hash in added:
+                self.ids.users.pop(user_id_hash, None)
+            raise
+
+    def sql_add_messages(self, rows):
+        """Add a batch of entries to the message table in one transaction.
+        Unknown users are added to the Telegram_User table in the same
+        transaction.
+
+        Args:
+            rows (list): Tuples of (group_id, user_id_hash, user_name,
+                         msg_type, length, timestamp)
+
+        Return:
+            None.
+
+        Raises ValueError if a group of the batch does not exist in db.
+
+        """
+        try:
+            with self.connections.writer() as db:
+                self._insert_messages(db, rows)
         except sqlite3.IntegrityError:
             raise ValueError("IntegrityError")
         except DB_Error as db_error:
             raise Exception(db_error)
-        finally:
-            if self.db:
-                self.db.close()
 
-    def sql_get_all_messages_from_group(self, group_id, sql_timespan):
+    def sql_import_messages(self, rows, group_id, last_id):
+        """Add a batch of imported messages and move the checkpoint of
+        the import in the same transaction.
+
+        Args:
+            rows (list)   : Tuples like in sql_add_messages()
+            group_id (int): Telegram Group ID of the import
+            last_id (int) : Message id of the export of the last row
+
+        Return:
+            None.
+
+        """
+        with self.connections.writer() as db:
+            self._insert_messages(db, rows)
+            db.execute(
+                "UPDATE Import_Progress SET last_id=(?), imported=imported+(?) "
+                "WHERE group_id=(?)",
+                (last_id, len(rows), group_id),
+            )
+
+    def sql_load_pagination(self, since):
+        """Get the page states of the statistics messages updated since
+        a point in time, oldest first.
+
+        Args:
+            since (int): Epoch seconds
+
+        Return:
+            List of (chat_id, message_id, group_id, timespan, updated) tuples.
+
+        """
+        return self._query("pagination", (since,)).fetchall()
+
+    def sql_save_pagination(self, rows, deleted, expired):
+        """Write and delete page states of statistics messages in one
+        transaction.
+
+        Args:
+            rows (list): (chat_id, message_id, group_id, timespan, updated)
+                         tuples to write
+            deleted (list): (chat_id, message_id) tuples to delete
+            expired (int): Delete all states not updated since then (epoch)
+
+        Return:
+            None.
+
+        """
+        with self.connections.writer() as db:
+            db.executemany(
+                "INSERT INTO Pagination_State "
+                "   (chat_id, message_id, group_id, timespan, updated) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(chat_id, message_id) DO UPDATE SET "
+                "   group_id=excluded.group_id, timespan=excluded.timespan, "
+                "   updated=excluded.updated",
+                rows,
+            )
+            db.executemany(
+                "DELETE FROM Pagination_State WHERE chat_id=(?) AND message_id=(?)",
+                deleted,
+            )
+            db.execute("DELETE FROM Pagination_State WHERE updated<(?)", (expired,))
+
+    def sql_rehash_users(self, rehash):
+        """Rewrite all user hashes stored as SHA-512 hexdigest (text)
+        with rehash(user_id_hash), which returns a blob.
+
+        Args:
+            rehash (function): Maps the old hash to the new one
+
+        Return:
+            Number of rewritten users.
+
+        """
+        with self.connections.writer() as db:
+            stmt = "SELECT id, user_id FROM Telegram_User WHERE typeof(user_id)='text'"
+            users = [(rehash(user_id), rowid) for rowid, user_id in db.execute(stmt)]
+            db.executemany("UPDATE Telegram_User SET user_id=(?) WHERE id=(?)", users)
+            self.ids.clear()
+        return len(users)
+
+    def sql_rebuild_rollups(self, since=""):
+        """(Re)build the daily rollup tables Message_Day_Type and
+        Message_Day_User from the rows in the Message table.
+
+        Creates the rollup tables and the trigger that keeps them up
+        to date if they don't exist yet.
+
+        Args:
+            since (str): First day (YYYY-MM-DD) whose Message rows are
+                         complete. The rollups of older days are kept,
+                         their rows may be deleted by the retention.
+
+        Return:
+            Number of messages counted in the rollups.
+
+        """
+        with open(ROLLUP_SCHEMA) as fp:
+            schema = fp.read()
+        with self.connections.writer() as db:
+            db.executescript(schema)
+
+        # The trigger keeps the rollups up to date from here on, so the
+        # rebuild only has to be consistent with the rows committed so far.
+        # Days before the oldest message or before since were deleted
+        # (at least partly) by the retention, only their rollups are
+        # left. Older imported messages were counted by the trigger.
+        with self.connections.writer() as db:
+            first_day = db.execute("SELECT MIN(date(timestamp)) FROM Message")
+            first_day = max(first_day.fetchone()[0] or "", since)
+            db.execute("DELETE FROM Message_Day_Type WHERE day>=(?)", (first_day,))
+            db.execute("DELETE FROM Message_Day_User WHERE day>=(?)", (first_day,))
+            db.execute(
+                "INSERT INTO Message_Day_Type (group_id, day, msg_type, msg_count) "
+                "SELECT group_id, date(timestamp), IFNULL(msg_type, 0), COUNT(*) "
+                "FROM Message WHERE date(timestamp)>=(?) GROUP BY 1, 2, 3",
+                (first_day,),
+            )
+            db.execute(
+                "INSERT INTO Message_Day_User (group_id, day, user_id, msg_count) "
+                "SELECT group_id, date(timestamp), user_id, COUNT(*) "
+                "FROM Message WHERE date(timestamp)>=(?) GROUP BY 1, 2, 3",
+                (first_day,),
+            )
+            cur = db.execute("SELECT IFNULL(SUM(msg_count), 0) FROM Message_Day_Type")
+            return cur.fetchone()[0]
+
+    def sql_delete_messages_before(self, timestamp, limit):
+        """Delete the oldest Message rows written before timestamp, group
+        by group on the (group_id, ts) index, so no batch scans the whole
+        table. Their counts stay in the daily rollup tables.
+
+        Args:
+            timestamp (int): Epoch seconds, rows with a lower ts are deleted
+            limit (int)    : Maximum number of rows deleted in this transaction
+
+        Return:
+            Number of deleted rows.
+
+        """
+        deleted = 0
+        with self.connections.writer() as db:
+            groups = [row[0] for row in db.execute("SELECT id FROM Telegram_Group")]
+            for group_rowid in groups:
+                cur = db.execute(
+                    QUERIES["delete_messages_from_group"],
+                    (group_rowid, timestamp, limit - deleted),
+                )
+                deleted += cur.rowcount
+                if deleted >= limit:
+                    break
+        return deleted
+
+    def sql_incremental_vacuum(self, pages):
+        """Return up to pages free pages to the file system. Does nothing
+        unless the database uses auto_vacuum=INCREMENTAL.
+
+        Return:
+            Number of free pages left in the database file.
+
+        """
+        with self.connections.writer() as db:
+            # execute() steps the pragma only once, which frees one page
+            db.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            return db.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def sql_vacuum(self):
+        """Rebuild the database file and switch it to incremental
+        auto-vacuum. Needs exclusive access to the database.
+
+        """
+        with self.connections.writer() as db:
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            db.execute("VACUUM")
+
+    def _query(self, name, args=()):
+        return self.db.execute(QUERIES[name], args)
+
+    def sql_get_all_messages_from_group(self, group_id, since):
         """Get all messages from a group.
 
         Args:
             group_id (int): Telegram Group ID from the group from which
-            sql_timespan (str):
+            since (str): First day (YYYY-MM-DD), "" for all days
 
         Returns:
             Number of all messages in this group (tuple).
 
         """
-        stmt = (
-            "SELECT COUNT(*) FROM Message "
-            "WHERE group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
-            f"{sql_timespan}"
-        )
-        arg = (group_id,)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchone()
+        return self._query("messages_from_group", (group_id, since)).fetchone()
 
-    def sql_get_all_messages(self, sql_timespan):
+    def sql_get_all_messages(self, since):
         """Get the number of messages from all groups.
 
         Args:
-            sql_timespan (str):
+            since (str): First day (YYYY-MM-DD), "" for all days
 
         Returns:
             Number of all messages (tuple).
 
         """
-        stmt = f"SELECT COUNT(*) FROM Message WHERE 1=1 {sql_timespan}"
-        cur = self.db.execute(stmt)
-        return cur.fetchone()
+        return self._query("messages", (since,)).fetchone()
 
     def sql_get_user_messages_from_group(self, user_id_hash, group_id):
         """Query the statistics for users in groups.
@@ -136,14 +508,8 @@ class DBHelper:
             Number of user messages in this group (tuple).
 
         """
-        stmt = (
-            "SELECT COUNT(*) FROM Message WHERE "
-            "user_id=(SELECT id FROM Telegram_User WHERE user_id=(?)) "
-            "AND group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
-        )
         arg = (user_id_hash, group_id)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchone()
+        return self._query("user_messages_from_group", arg).fetchone()
 
     def sql_get_all_user_messages(self, user_id_hash):
         """Query the statistics for user in all groups.
@@ -155,96 +521,206 @@ class DBHelper:
             Number of user messages in all groups (tuple).
 
         """
-        stmt = (
-            "SELECT COUNT(*) FROM Message WHERE "
-            "user_id=(SELECT id FROM Telegram_User WHERE user_id=(?))"
-        )
-        arg = (user_id_hash,)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchone()
+        return self._query("user_messages", (user_id_hash,)).fetchone()
 
-    def sql_get_message_types_from_group(self, group_id, sql_timespan):
+    def sql_get_message_types_from_group(self, group_id, since):
         """Query the message types in a group, sorted and by number
         in descending order.
 
         Args:
             group_id (int): Telegram Group ID
-            sql_timespan (str):
+            since (str): First day (YYYY-MM-DD), "" for all days
 
         Returns:
             Number of messages with message types (Tuple or list of tuples).
 
         """
-        stmt = (
-            "SELECT count(m.id) AS mCount, t.msg_type_ger "
-            "FROM Message m, Telegram_Type t "
-            "WHERE t.id=m.msg_type "
-            "AND m.group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?)) "
-            f" {sql_timespan} "
-            "GROUP BY t.id ORDER BY mCount DESC"
-        )
-        arg = (group_id,)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchall()
+        return self._query("message_types_from_group", (group_id, since)).fetchall()
 
-    def sql_get_all_message_types(self, sql_timespan):
+    def sql_get_all_message_types(self, since):
         """Query all message types of all groups, sorted and by number
         in descending order.
 
         Args:
-            sql_timespan (str):
+            since (str): First day (YYYY-MM-DD), "" for all days
 
         Returns:
             Number of messages with message types (Tuple or list of tuples).
 
         """
-        stmt = (
-            "SELECT count(m.id) AS mCount, t.msg_type_ger "
-            "FROM Message m, Telegram_Type t "
-            f"WHERE t.id=m.msg_type {sql_timespan} "
-            "GROUP BY t.id ORDER BY mCount DESC"
-        )
-        return self.db.execute(stmt)
+        return self._query("message_types", (since,)).fetchall()
 
-    def sql_get_top_posters_from_group(self, group_id, sql_timespan, limit=10):
-        """Get the top posters in a group.
+    def sql_get_user_counts(self, since):
+        """Get the number of messages per user and group since a day.
 
         Args:
-            sql_timespan (str):
-            limit (int): Number of results (default 5)
+            since (str): First day (YYYY-MM-DD), "" for all days
 
         Returns:
+            List of (group row id, user row id, count) tuples.
 
         """
-        stmt = (
-            "SELECT count(m.id) AS mCount, u.user_name "
-            "FROM Message m, Telegram_User u "
-            "WHERE u.id=m.user_id "
-            "AND m.group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
-            f"{sql_timespan} "
-            "GROUP BY u.user_name ORDER BY mCount DESC LIMIT ?"
-        )
-        arg = (group_id, limit)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchall()
+        return self._query("user_counts", (since,)).fetchall()
 
-    def sql_get_top_posters_overall(self, sql_timespan, limit=10):
-        """Get the top posters from all groups.
+    def sql_get_user_names(self, user_rowids):
+        """Get the names of users by their row ids.
 
         Args:
-            sql_timespan (str):
-            limit (int): Number of results (default 5)
+            user_rowids (list): Row ids of the Telegram_User table
 
         Returns:
+            Dict of row id: user name.
+
+        """
+        return dict(self._query("user_names", (json.dumps(user_rowids),)).fetchall())
+
+    def sql_add_words(self, rows):
+        """Add word and emoji counts to the daily counts in one
+        transaction.
+
+        Args:
+            rows (list): Tuples of (group_id, day, token, emoji, count)
+
+        Return:
+            None.
 
         """
         stmt = (
-            "SELECT count(m.id) AS mCount, u.user_name "
-            "FROM Message m, Telegram_User u "
-            "WHERE u.id=m.user_id"
-            f"{sql_timespan} "
-            "GROUP BY u.user_name ORDER BY mCount DESC LIMIT ?"
+            "INSERT INTO Word_Daily (group_id, day, word, emoji, word_count) "
+            "SELECT id, ?, ?, ?, ? FROM Telegram_Group WHERE group_id=(?) "
+            "ON CONFLICT(group_id, day, word) "
+            "DO UPDATE SET word_count=word_count+excluded.word_count"
         )
-        arg = (limit,)
-        cur = self.db.execute(stmt, arg)
-        return cur.fetchall()
+        with self.connections.writer() as db:
+            db.executemany(
+                stmt,
+                [
+                    (day, token, emoji, count, group_id)
+                    for group_id, day, token, emoji, count in rows
+                ],
+            )
+
+    def sql_get_top_words(self, group_id, since, emoji, limit):
+        """Get the most frequent words or emoji of a group, or of all
+        groups if group_id is None.
+
+        Args:
+            group_id (int or None): Telegram Group ID or None
+            since (str): First day (YYYY-MM-DD), "" for all days
+            emoji (bool): Emoji instead of words
+            limit (int): Number of words
+
+        Returns:
+            List of (count, word) tuples.
+
+        """
+        if group_id:
+            args = (group_id, since, int(emoji), limit)
+            return self._query("words_from_group", args).fetchall()
+        return self._query("words", (since, int(emoji), limit)).fetchall()
+
+    def sql_get_day_counts(self, group_id, since):
+        """Get the number of messages per day of a group, or of all
+        groups if group_id is None.
+
+        Args:
+            group_id (int or None): Telegram Group ID or None
+            since (str): First day (YYYY-MM-DD), "" for all days
+
+        Returns:
+            List of (day, count) tuples in day order.
+
+        """
+        if group_id:
+            return self._query("day_counts_from_group", (group_id, since)).fetchall()
+        return self._query("day_counts", (since,)).fetchall()
+
+    def sql_get_type_names(self):
+        """Get the German names of all message types as dict of
+        row id: name.
+
+        """
+        return dict(self._query("type_names").fetchall())
+
+    def sql_get_stats_snapshot(self, group_id, since):
+        """Get the number of messages and the message types of a group,
+        or of all groups if group_id is None, in one read transaction.
+
+        Args:
+            group_id (int or None): Telegram Group ID or None
+            since (str): First day (YYYY-MM-DD), "" for all days
+
+        Returns:
+            Tuple of the number of messages and the list of
+            (count, type) tuples.
+
+        """
+        self.db.execute("BEGIN")
+        try:
+            if group_id:
+                total = self.sql_get_all_messages_from_group(group_id, since)
+                types = self.sql_get_message_types_from_group(group_id, since)
+            else:
+                total = self.sql_get_all_messages(since)
+                types = self.sql_get_all_message_types(since)
+        finally:
+            self.db.commit()
+
+        return total[0], types
+
+    def _iter_snapshot(self, name, args, chunk_size):
+        """Yield the rows of a query in chunks of chunk_size rows. All rows
+        are read from one snapshot, writers are not blocked meanwhile.
+
+        """
+        self.db.execute("BEGIN")
+        try:
+            cur = self._query(name, args)
+            rows = cur.fetchmany(chunk_size)
+            while rows:
+                yield rows
+                rows = cur.fetchmany(chunk_size)
+        finally:
+            self.db.commit()
+
+    def _export(self, name, group_id, since, until, chunk_size):
+        if group_id:
+            return self._iter_snapshot(
+                f"{name}_from_group", (since, until, group_id), chunk_size
+            )
+        return self._iter_snapshot(name, (since, until), chunk_size)
+
+    def sql_export_messages(self, group_id, since, until, chunk_size=5000):
+        """Yield chunks of the messages of a group, or of all groups if
+        group_id is None, with since <= ts < until.
+
+        Rows: (group_id, user_id_hash, user_name, msg_type, msg_length, ts)
+
+        """
+        return self._export("export_messages", group_id, since, until, chunk_size)
+
+    def sql_export_day_types(self, group_id, since, until, chunk_size=5000):
+        """Yield chunks of the daily message counts per type of a group,
+        or of all groups if group_id is None, with since <= day < until.
+
+        Rows: (group_id, day, msg_type, count)
+
+        """
+        return self._export("export_day_types", group_id, since, until, chunk_size)
+
+    def sql_export_day_users(self, group_id, since, until, chunk_size=5000):
+        """Yield chunks of the daily message counts per user of a group,
+        or of all groups if group_id is None, with since <= day < until.
+
+        Rows: (group_id, day, user_id_hash, user_name, count)
+
+        """
+        return self._export("export_day_users", group_id, since, until, chunk_size)
+
+    def sql_iter_message_columns(self, chunk_size=50000):
+        """Yield chunks of all messages from one snapshot.
+
+        Rows: (group row id, user row id, type row id or 0, length, ts)
+
+        """
+        return self._iter_snapshot("message_columns", (), chunk_size)
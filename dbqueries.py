@@ -1,16 +1,22 @@
 """All database inquiries."""
 
 
+from collections import namedtuple
 from sqlite3 import Error as DB_Error
-from telegram.utils.helpers import escape_markdown
 from dbhelper import DBHelper
+from queries import timespan_start
 
 
-def db_add_message(group_id, user_id_hash, msg_type, msg_length, timestamp):
-    """Add a new entry to the Message table."""
+# The statistics of one group (or all groups if group_id is None) and
+# timespan. types is a list of (count, type) tuples.
+StatsSnapshot = namedtuple("StatsSnapshot", ["group_id", "timespan", "total", "types"])
+
+
+def db_add_message(group_id, user_id_hash, user_name, msg_type, msg_length, timestamp):
+    """Add a new entry to the Message table and the user if unknown."""
     try:
         DBHelper().sql_add_message(
-            group_id, user_id_hash, msg_type, msg_length, timestamp
+            group_id, user_id_hash, user_name, msg_type, msg_length, timestamp
         )
     except ValueError as error:
         raise ValueError(error)
@@ -18,6 +24,27 @@ def db_add_message(group_id, user_id_hash, msg_type, msg_length, timestamp):
         print(f"An error has occured: {db_error}")
 
 
+def db_add_messages(rows):
+    """Add a batch of new entries to the Message table."""
+    try:
+        DBHelper().sql_add_messages(rows)
+    except ValueError as error:
+        raise ValueError(error)
+    except DB_Error as db_error:
+        print(f"An error has occured: {db_error}")
+
+
+def db_load_ids():
+    """Load the row ids of all groups, users and message types."""
+    with DBHelper.connections.writer() as db:
+        DBHelper.ids.load(db)
+
+
+def db_close():
+    """Close all database connections."""
+    DBHelper.connections.close()
+
+
 def db_add_group(group_id, group_name):
     """Add a group to the table Telegram_Group."""
     try:
@@ -26,6 +53,17 @@ def db_add_group(group_id, group_name):
         raise ValueError(db_error)
 
 
+def db_add_groups(group_ids):
+    """Add groups to the table Telegram_Group in one transaction. Empty
+    entries of the GROUPS list are skipped.
+
+    """
+    try:
+        DBHelper().sql_add_groups([group_id for group_id in group_ids if group_id])
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
 def db_add_user(user_id_hash, user_name):
     """Add a Telegram user to the database."""
     try:
@@ -34,6 +72,49 @@ def db_add_user(user_id_hash, user_name):
         raise ValueError(db_error)
 
 
+def db_rehash_users(rehash):
+    """Rewrite the SHA-512 user hashes with rehash(user_id_hash)."""
+    try:
+        return DBHelper().sql_rehash_users(rehash)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_delete_messages_before(timestamp, limit):
+    """Delete up to limit messages written before timestamp (epoch)."""
+    try:
+        return DBHelper().sql_delete_messages_before(timestamp, limit)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_incremental_vacuum(pages):
+    """Free up to pages unused pages of the database file."""
+    try:
+        return DBHelper().sql_incremental_vacuum(pages)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_load_pagination(since):
+    """Fetch the page states of the statistics messages updated since
+    since (epoch), oldest first.
+
+    """
+    try:
+        return DBHelper().sql_load_pagination(since)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_save_pagination(rows, deleted, expired):
+    """Write and delete page states of statistics messages."""
+    try:
+        DBHelper().sql_save_pagination(rows, deleted, expired)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
 def db_get_all_messages(group_id=None, timespan=0):
     """Fetch the number of all messages from one group or from
     all groups if group_id is omitted.
@@ -46,20 +127,13 @@ def db_get_all_messages(group_id=None, timespan=0):
         First element of the tuple from the database query.
 
     """
-    sql_timespan = {
-        0: " AND date(timestamp)>=date('now', 'start of month')",
-        1: " AND date(timestamp)>=date('now','-30 day')",
-        2: " AND date(timestamp)=date('now')",
-        3: "",
-    }
+    since = timespan_start(timespan)
 
     try:
         if group_id:
-            total_msg = DBHelper().sql_get_all_messages_from_group(
-                group_id, sql_timespan[timespan]
-            )
+            total_msg = DBHelper().sql_get_all_messages_from_group(group_id, since)
         else:
-            total_msg = DBHelper().sql_get_all_messages(sql_timespan[timespan])
+            total_msg = DBHelper().sql_get_all_messages(since)
     except DB_Error as db_error:
         raise ValueError(db_error)
 
@@ -91,79 +165,88 @@ def db_get_user_messages(user_id_hash, group_id=None):
     return total_msg[0]
 
 
-def db_get_message_types(group_id=None, timespan=0):
-    """Query the different message types either from one group
-    or from all messages if the group_id is omitted.
+def db_get_stats_snapshot(group_id=None, timespan=0):
+    """Fetch the number of messages and the message types from one
+    group or from all groups if group_id is omitted.
+    All numbers are read in one transaction, so they are consistent.
 
     Args:
         group_id (int or None): Telegram Group ID or None
-        timestamp (int):
+        timespan (int):
 
     Returns:
-        Formatted text with all types and their number.
+        StatsSnapshot
 
     """
-    sql_timespan = {
-        0: " AND date(timestamp)>=date('now', 'start of month')",
-        1: " AND date(timestamp)>=date('now','-30 day')",
-        2: " AND date(timestamp)=date('now')",
-        3: "",
-    }
+    since = timespan_start(timespan)
 
     try:
-        if group_id:
-            msg_types = DBHelper().sql_get_message_types_from_group(
-                group_id, sql_timespan[timespan]
-            )
-        else:
-            msg_types = DBHelper().sql_get_all_message_types(sql_timespan[timespan])
+        total_msg, msg_types = DBHelper().sql_get_stats_snapshot(group_id, since)
     except DB_Error as db_error:
         raise ValueError(db_error)
 
-    #
-    # Check for division by zero!!!
-    #
-    total_msg = db_get_all_messages(group_id, timespan)
-    text = "\n\n`"
-    for posts, msg_type in msg_types:
-        text += f"{posts:<4} - {msg_type:>10} ({posts/total_msg*100:>4.1f}%)\n"
-    text += "`\n"
+    return StatsSnapshot(group_id, timespan, total_msg, msg_types)
 
-    return text
 
+def db_get_user_counts(since):
+    """Fetch (group row id, user row id, count) of all users with
+    messages since a day (YYYY-MM-DD, "" for all days).
 
-def db_get_top_posters(group_id=None, timespan=0):
-    """Get the top posters in a group or from all groups if group_id
-    is omitted.
+    """
+    try:
+        return DBHelper().sql_get_user_counts(since)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
 
-    Args:
-        group_id (int or None): Telegram Group ID or None
-        timespan (int):
 
-    Returns:
-        Formatted text with user names and their numbers.
+def db_add_words(rows):
+    """Add word and emoji counts, rows of (group_id, day, token, emoji,
+    count).
+
+    """
+    try:
+        DBHelper().sql_add_words(rows)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_get_top_words(group_id=None, timespan=0, emoji=False, limit=10):
+    """Fetch the most frequent words or emoji of a group or of all groups
+    as list of (count, word) tuples.
 
     """
-    sql_timespan = {
-        0: " AND date(timestamp)>=date('now', 'start of month')",
-        1: " AND date(timestamp)>=date('now','-30 day')",
-        2: " AND date(timestamp)=date('now')",
-        3: "",
-    }
+    try:
+        return DBHelper().sql_get_top_words(
+            group_id, timespan_start(timespan), emoji, limit
+        )
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_get_day_counts(group_id=None, timespan=0):
+    """Fetch the number of messages per day of a group or of all groups
+    as list of (day, count) tuples.
 
+    """
     try:
-        if group_id:
-            top_posters = DBHelper().sql_get_top_posters_from_group(
-                group_id, sql_timespan[timespan]
-            )
-        else:
-            top_posters = DBHelper().sql_get_top_posters_overall(sql_timespan[timespan])
+        return DBHelper().sql_get_day_counts(group_id, timespan_start(timespan))
+    except DB_Error as db_error:
+        raise ValueError(db_error)
+
+
+def db_get_type_names():
+    """Fetch the German names of the message types by their row ids."""
+    try:
+        return DBHelper().sql_get_type_names()
     except DB_Error as db_error:
         raise ValueError(db_error)
 
-    text = "\n*Highscore*:\n\n"
-    for posts, user in top_posters:
-        user = escape_markdown(user)
-        text += f"{user} {posts} Nachrichten\n"
 
-    return text
+def db_get_user_names(user_rowids):
+    """Fetch the names of users by their row ids as dict."""
+    if not user_rowids:
+        return {}
+    try:
+        return DBHelper().sql_get_user_names(user_rowids)
+    except DB_Error as db_error:
+        raise ValueError(db_error)
@@ -0,0 +1,98 @@
+"""Export of the messages and the daily statistics to CSV or NDJSON.
+
+The rows are read in chunks from one read snapshot and written right
+away, so the memory use doesn't depend on the number of rows and the
+bot keeps writing while an export runs. Output files ending in .gz are
+gzip compressed.
+
+"""
+
+
+import csv
+import gzip
+import json
+from datetime import datetime, timezone
+
+from dbhelper import DBHelper
+
+
+CHUNK_SIZE = 5000
+
+# Dataset: (DBHelper method, column names)
+DATASETS = {
+    "messages": (
+        DBHelper.sql_export_messages,
+        ("group_id", "user", "user_name", "msg_type", "msg_length", "date"),
+    ),
+    "types": (
+        DBHelper.sql_export_day_types,
+        ("group_id", "day", "msg_type", "count"),
+    ),
+    "users": (
+        DBHelper.sql_export_day_users,
+        ("group_id", "day", "user", "user_name", "count"),
+    ),
+}
+
+FORMATS = ("csv", "ndjson")
+
+
+def _value(value):
+    # user hashes are stored as hex string or as blob
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def _iso_date(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _day_epoch(day):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def export(dataset, path, fmt="csv", group_id=None, since=None, until=None):
+    """Write a dataset to a file.
+
+    Args:
+        dataset (str): "messages", "types" (daily counts per message
+                       type) or "users" (daily counts per user)
+        path (str): Output file, gzip compressed if it ends in .gz
+        fmt (str): "csv" or "ndjson"
+        group_id (int or None): Telegram Group ID or None for all groups
+        since (date or None): First day (UTC) of the export
+        until (date or None): Day after the last day (UTC) of the export
+
+    Returns:
+        Number of exported rows.
+
+    """
+    query, columns = DATASETS[dataset]
+    if dataset == "messages":
+        since = _day_epoch(since) if since else 0
+        until = _day_epoch(until) if until else 2 ** 62
+    else:
+        since = since.isoformat() if since else ""
+        until = until.isoformat() if until else "9999-12-31"
+
+    opener = gzip.open if path.endswith(".gz") else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8", newline="") as fp:
+        if fmt == "csv":
+            writer = csv.writer(fp)
+            writer.writerow(columns)
+            write = writer.writerow
+        else:
+
+            def write(row):
+                fp.write(json.dumps(dict(zip(columns, row))) + "\n")
+
+        for rows in query(DBHelper(), group_id, since, until, CHUNK_SIZE):
+            for row in rows:
+                row = [_value(value) for value in row]
+                if dataset == "messages":
+                    row[-1] = _iso_date(row[-1])
+                write(row)
+            count += len(rows)
+    return count
@@ -0,0 +1,284 @@
+"""Import of the chat history from a Telegram Desktop export (result.json).
+
+The export is read in chunks and decoded one message at a time, so the
+memory use doesn't depend on the size of the export. The messages are
+counted like process_message() counts them: same message types, same
+user hashes, words only for text messages. Every batch is written in
+one transaction together with the id of its last message, so an
+interrupted import continues after the last written batch.
+
+"""
+
+
+import re
+import json
+import time
+from datetime import datetime, timezone
+
+from telegram import Message
+
+from dbhelper import DBHelper
+from dbqueries import db_add_group
+from util import hash_uid
+from config import GROUPS, MESSAGE_TYPES
+
+
+BATCH_SIZE = 10000
+CHUNK_SIZE = 1 << 20
+
+PROGRESS_TABLE = (
+    "CREATE TABLE IF NOT EXISTS `Import_Progress` ("
+    "   `group_id` INTEGER PRIMARY KEY,"
+    "   `last_id` INTEGER NOT NULL,"
+    "   `stop_ts` INTEGER,"
+    "   `imported` INTEGER NOT NULL DEFAULT 0"
+    ")"
+)
+
+# media_type of an exported message and the matching Message attribute
+EXPORT_MEDIA_TYPES = {
+    "animation": "animation",
+    "audio_file": "audio",
+    "sticker": "sticker",
+    "video_file": "video",
+    "video_message": "video_note",
+    "voice_message": "voice",
+}
+
+# Other keys of an exported message and the matching Message attribute
+EXPORT_FIELDS = {
+    "photo": "photo",
+    "contact_information": "contact",
+    "location_information": "location",
+    "place_name": "venue",
+    "poll": "poll",
+    "game_title": "game",
+    "invoice_information": "invoice",
+}
+
+# action of an exported service message and the matching Message attribute
+EXPORT_ACTIONS = {
+    "create_group": "group_chat_created",
+    "edit_group_title": "new_chat_title",
+    "edit_group_photo": "new_chat_photo",
+    "delete_group_photo": "delete_chat_photo",
+    "invite_members": "new_chat_members",
+    "join_group_by_link": "new_chat_members",
+    "remove_members": "left_chat_member",
+    "migrate_from_group": "migrate_from_chat_id",
+    "pin_message": "pinned_message",
+}
+
+MESSAGES_KEY = re.compile(r'"messages"\s*:\s*\[')
+SEPARATOR = re.compile(r"[\s,]*")
+
+
+class ExportReader:
+    """Read the chat of a result.json: the header (name, type, id) when
+    created, the messages one by one when iterated.
+
+    Args:
+        fp: The export, opened in text mode
+        chunk_size (int): Number of characters read at once
+
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self.header = self._read_header()
+
+    def _fill(self):
+        data = self._fp.read(self._chunk_size)
+        if not data:
+            return False
+        self._buf = self._buf[self._pos :] + data
+        self._pos = 0
+        return True
+
+    def _read_header(self):
+        match = MESSAGES_KEY.search(self._buf)
+        while not match:
+            if not self._fill():
+                raise ValueError("No messages found in the export.")
+            match = MESSAGES_KEY.search(self._buf)
+        # name, type and id come before the messages
+        header = self._buf[: match.start()].rstrip().rstrip(",") + "}"
+        self._pos = match.end()
+        try:
+            return json.loads(header)
+        except json.JSONDecodeError:
+            raise ValueError("Not the export of a single chat.")
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        while True:
+            self._pos = SEPARATOR.match(self._buf, self._pos).end()
+            if self._pos == len(self._buf):
+                if not self._fill():
+                    raise ValueError("Unexpected end of the export.")
+                continue
+            if self._buf[self._pos] == "]":
+                return
+            try:
+                message, end = decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # The message continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            yield message
+
+
+def export_group_id(header):
+    """Return the Telegram Group ID (as seen by the bot) of an export."""
+    if header.get("type") in ("private_supergroup", "public_supergroup"):
+        return int(f"-100{header['id']}")
+    if header.get("type") == "private_group":
+        return -header["id"]
+    raise ValueError(f"Not a group: {header.get('type')}")
+
+
+def export_text(message):
+    """Return the text of an exported message as plain string."""
+    text = message.get("text", "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part["text"] for part in text)
+    return text
+
+
+def export_message_type(message):
+    """Return the type of an exported message like
+    effective_message_type() does for an update.
+
+    """
+    attrs = set()
+    if message.get("type") == "service":
+        attrs.add(EXPORT_ACTIONS.get(message.get("action")))
+    else:
+        if "media_type" in message:
+            attrs.add(EXPORT_MEDIA_TYPES.get(message["media_type"]))
+        elif "file" in message:
+            attrs.add("document")
+        attrs.update(attr for key, attr in EXPORT_FIELDS.items() if key in message)
+        # The text of a media message is its caption
+        if not attrs and export_text(message):
+            attrs.add("text")
+
+    for msg_type in Message.MESSAGE_TYPES:
+        if msg_type in attrs:
+            return msg_type
+    return None
+
+
+def export_user(message):
+    """Return (user_id, user_name) of the sender of an exported message,
+    user_id is None if it was sent by a channel.
+
+    """
+    if message.get("type") == "service":
+        from_id, name = message.get("actor_id"), message.get("actor")
+    else:
+        from_id, name = message.get("from_id"), message.get("from")
+    if isinstance(from_id, str):
+        from_id = int(from_id[4:]) if from_id.startswith("user") else None
+    return from_id, name or "unknown user"
+
+
+def export_timestamp(message):
+    """Return the UTC datetime of an exported message."""
+    if "date_unixtime" in message:
+        return datetime.fromtimestamp(int(message["date_unixtime"]), timezone.utc)
+    # Older exports only have the local time of the exporting computer
+    return datetime.fromisoformat(message["date"]).astimezone(timezone.utc)
+
+
+def _start(group_id, group_name):
+    """Return (last_id, stop_ts) of the import of a group.
+
+    The first import stops at the first day counted by the bot itself,
+    the messages from there on are in the database already.
+
+    """
+    db_add_group(group_id, group_name)
+    with DBHelper.connections.writer() as db:
+        db.execute(PROGRESS_TABLE)
+        stmt = "SELECT last_id, stop_ts FROM Import_Progress WHERE group_id=(?)"
+        row = db.execute(stmt, (group_id,)).fetchone()
+        if row:
+            return row
+        stmt = (
+            "SELECT CAST(strftime('%s', MIN(day)) AS INTEGER) FROM Message_Day_Type "
+            "WHERE group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
+        )
+        stop_ts = db.execute(stmt, (group_id,)).fetchone()[0]
+        db.execute(
+            "INSERT INTO Import_Progress (group_id, last_id, stop_ts) VALUES (?, 0, ?)",
+            (group_id, stop_ts),
+        )
+        return 0, stop_ts
+
+
+def import_export(path, group_id=None, batch_size=BATCH_SIZE, report=None):
+    """Import the messages of a Telegram Desktop export.
+
+    Args:
+        path (str): Path of the result.json
+        group_id (int): Telegram Group ID, read from the export if None
+        batch_size (int): Number of messages per transaction
+        report (function): Called with the stats after every batch
+
+    Returns:
+        Dict with the number of imported and skipped messages, the
+        seconds and the rows per second.
+
+    """
+    stats = {"group_id": group_id, "imported": 0, "skipped": 0, "seconds": 0.0}
+    start = time.perf_counter()
+
+    def write(rows, last_id):
+        DBHelper().sql_import_messages(rows, stats["group_id"], last_id)
+        stats["imported"] += len(rows)
+        stats["seconds"] = time.perf_counter() - start
+        stats["rows_per_sec"] = stats["imported"] / stats["seconds"]
+        if report:
+            report(stats)
+
+    with open(path, encoding="utf-8") as fp:
+        reader = ExportReader(fp)
+        group_id = stats["group_id"] = group_id or export_group_id(reader.header)
+        if group_id not in GROUPS:
+            print(f"Warning: group {group_id} is not in GROUPS.")
+        last_id, stop_ts = _start(group_id, reader.header.get("name"))
+
+        rows = []
+        for message in reader:
+            if message["id"] <= last_id:
+                continue
+            timestamp = export_timestamp(message)
+            if stop_ts and timestamp.timestamp() >= stop_ts:
+                break
+            msg_type = export_message_type(message)
+            user_id, user_name = export_user(message)
+            if msg_type not in MESSAGE_TYPES or user_id is None:
+                stats["skipped"] += 1
+                continue
+            msg_length = 0
+            if msg_type == "text":
+                msg_length = len(export_text(message).split())
+            user_id_hash = hash_uid(user_id)
+            rows.append(
+                (group_id, user_id_hash, user_name, msg_type, msg_length, timestamp)
+            )
+            if len(rows) >= batch_size:
+                write(rows, message["id"])
+                rows = []
+        if rows:
+            write(rows, message["id"])
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_sec"] = stats["imported"] / max(stats["seconds"], 1e-9)
+    return stats
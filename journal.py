@@ -0,0 +1,137 @@
+"""Durable journal of the received updates.
+
+The updater (polling or webhook) puts every update into the journal
+before the dispatcher sees it: the update is appended to a small
+SQLite database and then queued in memory. The dispatcher marks an
+update as processed when its handlers returned, checkpoint() later
+deletes all processed entries. Entries that are still in the journal
+after a crash or a restart are replayed on the next start, so no update
+is lost. Updates processed after the last checkpoint are replayed too,
+their messages may be counted twice.
+
+"""
+
+
+import json
+import sqlite3
+import threading
+from queue import Queue
+
+from telegram import Update
+
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL
+);
+"""
+
+
+class JournalQueue(Queue):
+    """Update queue of the dispatcher, backed by the journal.
+
+    Only the dispatcher thread calls get() and task_done(), so the
+    update of the last get() is the one task_done() marks as processed.
+
+    Args:
+        path (str): The journal database file
+
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(JOURNAL_SCHEMA)
+        self._lock = threading.Lock()
+        self._current = None
+        self.processed = 0
+        self.checkpointed = 0
+        self.entries = self._db.execute("SELECT COUNT(*) FROM Journal").fetchone()[0]
+        self.appended = 0
+        self.replayed = 0
+        self.checkpoints = 0
+
+    def replay(self, bot):
+        """Queue the entries left from the last run, before the updater
+        starts.
+
+        Returns:
+            The number of replayed updates.
+
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT seq, data FROM Journal ORDER BY seq")
+            rows = rows.fetchall()
+        for seq, data in rows:
+            super().put((seq, Update.de_json(json.loads(data), bot)))
+        self.replayed = len(rows)
+        return self.replayed
+
+    def put(self, item, block=True, timeout=None):
+        """Append an update to the journal and queue it. Other items,
+        like the errors of the updater, are only queued.
+
+        """
+        seq = None
+        if isinstance(item, Update):
+            with self._lock:
+                seq = self._db.execute(
+                    "INSERT INTO Journal (data) VALUES (?)", (item.to_json(),)
+                ).lastrowid
+                self._db.commit()
+                self.entries += 1
+                self.appended += 1
+        super().put((seq, item), block, timeout)
+
+    def get(self, block=True, timeout=None):
+        seq, item = super().get(block, timeout)
+        self._current = seq
+        return item
+
+    def task_done(self):
+        if self._current is not None:
+            self.processed = self._current
+            self._current = None
+        super().task_done()
+
+    def checkpoint(self, processed):
+        """Delete the entries up to the processed one. Run it after the
+        messages of these updates are written.
+
+        Args:
+            processed (int): The value of processed when the messages
+                             were queued for writing
+
+        """
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM Journal WHERE seq<=(?)", (processed,)
+            ).rowcount
+            self._db.commit()
+            self.entries -= deleted
+            self.checkpointed = max(self.checkpointed, processed)
+            self.checkpoints += 1
+
+    def backlog(self):
+        """Return the number of updates waiting for the dispatcher."""
+        return self.qsize()
+
+    def stats(self):
+        """Return the backlog and the journal counters."""
+        with self._lock:
+            return {
+                "backlog": self.backlog(),
+                "entries": self.entries,
+                "appended": self.appended,
+                "replayed": self.replayed,
+                "checkpoints": self.checkpoints,
+            }
+
+    def close(self):
+        """Close the journal database."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,123 @@
+"""In-memory top posters of every group and of all groups."""
+
+
+import threading
+from datetime import datetime, timezone
+
+from dbhelper import DBHelper
+from dbqueries import db_get_user_counts, db_get_user_names
+from queries import timespan_starts
+
+
+class Leaderboards:
+    """Message counts per user for every group and for all groups in
+    the four timespans, keyed by the row id of the user.
+
+    The counts are loaded from the daily rollups by rebuild() and
+    increased by add() for every written message. Every board keeps
+    its size users with the most messages sorted, so top() only has to
+    look up their names. The timespans move with the day, so the boards
+    have to be rebuilt once needs_rebuild() says so.
+
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self.day = None
+        self.rebuilds = 0
+        self._starts = {}
+        # (group row id or None, timespan): {user row id: count}
+        self._counts = {}
+        # (group row id or None, timespan): [user row id, ...]
+        self._top = {}
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def _select(self, board):
+        return sorted(board, key=board.__getitem__, reverse=True)[: self.size]
+
+    def rebuild(self):
+        """Load the counts of all users from the database. Run it in
+        the writer thread, so no message is written meanwhile.
+
+        """
+        today = datetime.now(timezone.utc).date()
+        starts = timespan_starts(today)
+        counts = {}
+        for timespan, since in starts.items():
+            for group_rowid, user_rowid, count in db_get_user_counts(since):
+                for scope in (group_rowid, None):
+                    board = counts.setdefault((scope, timespan), {})
+                    board[user_rowid] = board.get(user_rowid, 0) + count
+        top = {key: self._select(board) for key, board in counts.items()}
+
+        with self._lock:
+            self.day = today
+            self._starts = starts
+            self._counts = counts
+            self._top = top
+            self._stale = False
+            self.rebuilds += 1
+
+    def add(self, rows):
+        """Count written messages. Called by the writer thread after the
+        messages are committed.
+
+        Args:
+            rows (list): Tuples of (group_id, user_id_hash, user_name,
+                         msg_type, length, timestamp)
+
+        """
+        ids = DBHelper.ids
+        with self._lock:
+            for group_id, user_id_hash, _, _, _, timestamp in rows:
+                group_rowid = ids.groups.get(group_id)
+                user_rowid = ids.users.get(user_id_hash)
+                if group_rowid is None or user_rowid is None:
+                    self._stale = True
+                    continue
+                day = timestamp.astimezone(timezone.utc).date().isoformat()
+                for timespan, since in self._starts.items():
+                    if day >= since:
+                        self._bump((group_rowid, timespan), user_rowid)
+                        self._bump((None, timespan), user_rowid)
+
+    def _bump(self, key, user_rowid):
+        board = self._counts.setdefault(key, {})
+        count = board[user_rowid] = board.get(user_rowid, 0) + 1
+        top = self._top.setdefault(key, [])
+        if user_rowid not in top:
+            if len(top) >= self.size and count <= board[top[-1]]:
+                return
+            top.append(user_rowid)
+        top.sort(key=board.__getitem__, reverse=True)
+        del top[self.size :]
+
+    def invalidate(self):
+        """Rebuild the boards with the next check, e.g. after the
+        rollups were backfilled.
+
+        """
+        self._stale = True
+
+    def needs_rebuild(self):
+        """Return True on a new day or if a message couldn't be counted."""
+        return self._stale or self.day != datetime.now(timezone.utc).date()
+
+    def top(self, group_id, timespan):
+        """Return the top posters of a group (or all groups if group_id
+        is None) and timespan.
+
+        Returns:
+            List of (count, user name) tuples.
+
+        """
+        scope = DBHelper.ids.groups.get(group_id) if group_id else None
+        if group_id and scope is None:
+            return []
+        key = (scope, timespan)
+        with self._lock:
+            board = self._counts.get(key, {})
+            top = [(board[rowid], rowid) for rowid in self._top.get(key, [])]
+        names = db_get_user_names([user_rowid for _, user_rowid in top])
+        return [(count, names.get(user_rowid, "")) for count, user_rowid in top]
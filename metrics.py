@@ -0,0 +1,216 @@
+"""Call counters and latency histograms in the Prometheus text format."""
+
+
+import time
+import inspect
+import threading
+from functools import wraps
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300, 900)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """A counter, optionally with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """Increase the counter of the label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """Return (name, labels, value) tuples."""
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, k), v) for k, v in values]
+
+
+class Histogram:
+    """A histogram with fixed buckets, optionally with labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Add a value to the histogram of the label values."""
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket, +Inf, sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        """Return (name, labels, value) tuples."""
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        samples = []
+        for labels, counts in values:
+            names = self.labelnames + ("le",)
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                samples.append(
+                    (f"{self.name}_bucket", _labels(names, labels + (bound,)), total)
+                )
+            label_text = _labels(self.labelnames, labels)
+            samples.append((f"{self.name}_sum", label_text, counts[-1]))
+            samples.append((f"{self.name}_count", label_text, total))
+        return samples
+
+
+class Gauge:
+    """A value read from a function when the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description, func):
+        self.name = name
+        self.description = description
+        self.func = func
+
+    def samples(self):
+        """Return (name, labels, value) tuples."""
+        return [(self.name, "", self.func())]
+
+
+class Registry:
+    """Collection of all metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Add a metric and return it."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_CALLS = REGISTRY.register(
+    Counter("yve_handler_calls_total", "Calls of the bot handlers.", ("handler",))
+)
+HANDLER_ERRORS = REGISTRY.register(
+    Counter(
+        "yve_handler_errors_total", "Failed calls of the bot handlers.", ("handler",)
+    )
+)
+HANDLER_LATENCY = REGISTRY.register(
+    Histogram("yve_handler_seconds", "Run time of the bot handlers.", ("handler",))
+)
+DB_CALLS = REGISTRY.register(
+    Counter("yve_db_calls_total", "Calls of the DBHelper methods.", ("method",))
+)
+DB_ERRORS = REGISTRY.register(
+    Counter("yve_db_errors_total", "Failed calls of the DBHelper methods.", ("method",))
+)
+DB_LATENCY = REGISTRY.register(
+    Histogram("yve_db_seconds", "Run time of the DBHelper methods.", ("method",))
+)
+INGESTION_LAG = REGISTRY.register(
+    Histogram(
+        "yve_ingestion_lag_seconds",
+        "Time between sending and processing of a message.",
+        buckets=LAG_BUCKETS,
+    )
+)
+
+
+def _timed(func, name, calls, errors, latency):
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            calls.inc(name)
+            latency.observe(time.perf_counter() - start, name)
+
+    return wrapped
+
+
+def instrument_handler(func):
+    """Wrapper for bot handlers: count calls and errors, measure the run time."""
+    return _timed(func, func.__name__, HANDLER_CALLS, HANDLER_ERRORS, HANDLER_LATENCY)
+
+
+def instrument_methods(cls):
+    """Wrap all public methods of a class: count calls and errors,
+    measure the run time.
+
+    """
+    for name, attr in list(vars(cls).items()):
+        if inspect.isfunction(attr) and not name.startswith("_"):
+            setattr(cls, name, _timed(attr, name, DB_CALLS, DB_ERRORS, DB_LATENCY))
+    return cls
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve the metrics on http://host:port/ in a background thread."""
+    # Imported here, http.server is slow to import and only the bot needs it
+    from http.server import (  # pylint: disable=import-outside-toplevel
+        BaseHTTPRequestHandler,
+        ThreadingHTTPServer,
+    )
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Answer every GET request with the metrics."""
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,335 @@
+"""Versioned online schema migrations.
+
+Every migration has a schema step and an optional backfill. The schema
+steps are cheap and run at startup before any message is processed.
+The backfills walk the existing Message rows in small id ranges, one
+short write transaction per batch, so they can run while the bot keeps
+ingesting. Their progress is stored in the database, so an interrupted
+backfill resumes where it stopped. PRAGMA user_version is set to the
+version of a migration once its backfill is complete.
+
+"""
+
+
+import time
+import threading
+
+from dbhelper import DBHelper, SCHEMA, ROLLUP_SCHEMA
+from config import MIGRATION_BATCH_SIZE, MIGRATION_PAUSE_MS
+
+
+PROGRESS_TABLE = (
+    "CREATE TABLE IF NOT EXISTS `Migration_Progress` ("
+    "   `version` INTEGER PRIMARY KEY,"
+    "   `last_id` INTEGER NOT NULL,"
+    "   `stop_id` INTEGER NOT NULL"
+    ")"
+)
+
+
+def _has_trigger(db, name):
+    stmt = "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=(?)"
+    return db.execute(stmt, (name,)).fetchone() is not None
+
+
+def _has_table(db, name):
+    stmt = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=(?)"
+    return db.execute(stmt, (name,)).fetchone() is not None
+
+
+def _has_column(db, table, column):
+    return any(row[1] == column for row in db.execute(f"PRAGMA table_info({table})"))
+
+
+def _max_message_id(db):
+    return db.execute("SELECT IFNULL(MAX(id), 0) FROM Message").fetchone()[0]
+
+
+def schema_rollups(db):
+    """Create the daily rollup tables and their trigger.
+
+    Returns the last Message id that has to be backfilled. Rows with a
+    higher id are counted by the trigger.
+
+    """
+    if _has_trigger(db, "Message_Rollup"):
+        return 0
+    with open(ROLLUP_SCHEMA) as fp:
+        schema = fp.read()
+    # executescript() commits, so clear and capture the id range afterwards
+    db.executescript(schema)
+    db.execute("DELETE FROM Message_Day_Type")
+    db.execute("DELETE FROM Message_Day_User")
+    return _max_message_id(db)
+
+
+BACKFILL_ROLLUPS = (
+    (
+        "INSERT INTO Message_Day_Type (group_id, day, msg_type, msg_count) "
+        "SELECT group_id, date(timestamp), IFNULL(msg_type, 0), COUNT(*) "
+        "FROM Message WHERE id>? AND id<=? GROUP BY 1, 2, 3 "
+        "ON CONFLICT(group_id, day, msg_type) "
+        "DO UPDATE SET msg_count=msg_count+excluded.msg_count"
+    ),
+    (
+        "INSERT INTO Message_Day_User (group_id, day, user_id, msg_count) "
+        "SELECT group_id, date(timestamp), user_id, COUNT(*) "
+        "FROM Message WHERE id>? AND id<=? GROUP BY 1, 2, 3 "
+        "ON CONFLICT(group_id, day, user_id) "
+        "DO UPDATE SET msg_count=msg_count+excluded.msg_count"
+    ),
+)
+
+
+def schema_epoch(db):
+    """Add the integer epoch column Message.ts and its group index.
+
+    Returns the last Message id that has to be backfilled. New rows are
+    written with ts set.
+
+    """
+    if not _has_column(db, "Message", "ts"):
+        db.execute("ALTER TABLE Message ADD COLUMN ts INTEGER")
+    db.execute("CREATE INDEX IF NOT EXISTS Message_group_ts ON Message (group_id, ts)")
+    return _max_message_id(db)
+
+
+BACKFILL_EPOCH = (
+    (
+        "UPDATE Message SET ts=CAST(strftime('%s', timestamp) AS INTEGER) "
+        "WHERE id>? AND id<=? AND ts IS NULL"
+    ),
+)
+
+
+def schema_user_rollup(db):
+    """Index the user rollups by user, /me reads them instead of Message.
+
+    Returns 0, there is nothing to backfill.
+
+    """
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS Message_Day_User_user "
+        "ON Message_Day_User (user_id, group_id)"
+    )
+    return 0
+
+
+def schema_pagination(db):
+    """Create the table for the page state of the statistics messages.
+
+    Returns 0, there is nothing to backfill.
+
+    """
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS Pagination_State ("
+        "   chat_id INTEGER NOT NULL,"
+        "   message_id INTEGER NOT NULL,"
+        "   group_id INTEGER,"
+        "   timespan INTEGER NOT NULL DEFAULT 0,"
+        "   updated INTEGER NOT NULL,"
+        "   PRIMARY KEY(chat_id, message_id)"
+        ") WITHOUT ROWID"
+    )
+    return 0
+
+
+def schema_words(db):
+    """Create the table of the daily word and emoji counts.
+
+    Returns 0, there is nothing to backfill.
+
+    """
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS Word_Daily ("
+        "   group_id INTEGER NOT NULL,"
+        "   day TEXT NOT NULL,"
+        "   word TEXT NOT NULL,"
+        "   emoji INTEGER NOT NULL DEFAULT 0,"
+        "   word_count INTEGER NOT NULL DEFAULT 0,"
+        "   PRIMARY KEY(group_id, day, word)"
+        ") WITHOUT ROWID"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS Word_Daily_day ON Word_Daily (day)")
+    return 0
+
+
+# (version, description, schema step, backfill statements)
+MIGRATIONS = [
+    (1, "daily rollup tables", schema_rollups, BACKFILL_ROLLUPS),
+    (2, "integer epoch column Message.ts", schema_epoch, BACKFILL_EPOCH),
+    (3, "user index on the rollups", schema_user_rollup, ()),
+    (4, "pagination state table", schema_pagination, ()),
+    (5, "word statistics table", schema_words, ()),
+]
+
+
+def get_version():
+    """Return the schema version of the database."""
+    return DBHelper().db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def is_complete():
+    """Return True if all migrations and their backfills are done."""
+    return get_version() >= MIGRATIONS[-1][0]
+
+
+def create_schema():
+    """Create the schema of a new database, at the latest version.
+
+    Safe to call on every start: a database that already has the
+    Message table is left to the migrations of apply_schema().
+
+    Returns:
+        True if the schema was created.
+
+    """
+    with DBHelper.connections.writer() as db:
+        if _has_table(db, "Message"):
+            return False
+        for path in (SCHEMA, ROLLUP_SCHEMA):
+            with open(path) as fp:
+                db.executescript(fp.read())
+        db.execute(f"PRAGMA user_version = {MIGRATIONS[-1][0]}")
+        # The writer is in WAL mode, there the auto_vacuum setting of the
+        # schema only takes effect with a VACUUM (fast, the file is empty)
+        db.execute("VACUUM")
+    return True
+
+
+def apply_schema():
+    """Run the schema steps of all pending migrations.
+
+    Returns:
+        List of the pending migration versions.
+
+    """
+    pending = []
+    with DBHelper.connections.writer() as db:
+        db.execute(PROGRESS_TABLE)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        stmt = "SELECT version FROM Migration_Progress"
+        started = {row[0] for row in db.execute(stmt)}
+
+    for number, description, schema, _ in MIGRATIONS:
+        if number <= version:
+            continue
+        pending.append(number)
+        if number in started:
+            continue
+        print(f"Migration {number}: {description}... ", end="")
+        with DBHelper.connections.writer() as db:
+            stop_id = schema(db)
+            db.execute(
+                "INSERT INTO Migration_Progress (version, last_id, stop_id) "
+                "VALUES (?, 0, ?)",
+                (number, stop_id),
+            )
+        print(f"Done. {stop_id} rows to backfill.")
+
+    return pending
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+def _backfill_batch(number, backfill, last_id, next_id):
+    # One transaction per batch, the progress is saved with it
+    with DBHelper.connections.writer() as db:
+        for stmt in backfill:
+            db.execute(stmt, (last_id, next_id))
+        db.execute(
+            "UPDATE Migration_Progress SET last_id=(?) WHERE version=(?)",
+            (next_id, number),
+        )
+
+
+def _complete(number):
+    with DBHelper.connections.writer() as db:
+        db.execute("DELETE FROM Migration_Progress WHERE version=(?)", (number,))
+        db.execute(f"PRAGMA user_version={number}")
+
+
+def run_backfills(stop_event=None, batch_size=None, pause_ms=None, run=None):
+    """Run the backfills of all pending migrations in version order.
+
+    Args:
+        stop_event (threading.Event): Stop after the current batch if set
+        batch_size (int): Number of Message ids per transaction
+        pause_ms (int): Pause between two batches, gives the writer
+                        connection to the ingestion
+        run (function): Calls a database function, run(func, *args).
+                        The bot passes the writer thread here.
+
+    Returns:
+        True if all backfills are complete.
+
+    """
+    run = run or _call
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    pause = (MIGRATION_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+
+    for number, description, _, backfill in MIGRATIONS:
+        row = (
+            DBHelper()
+            .db.execute(
+                "SELECT last_id, stop_id FROM Migration_Progress WHERE version=(?)",
+                (number,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            continue
+        last_id, stop_id = row
+        start = time.perf_counter()
+
+        while last_id < stop_id:
+            if stop_event and stop_event.is_set():
+                return False
+            next_id = min(last_id + batch_size, stop_id)
+            run(_backfill_batch, number, backfill, last_id, next_id)
+            last_id = next_id
+            time.sleep(pause)
+
+        run(_complete, number)
+        print(
+            f"Migration {number} ({description}) complete "
+            f"after {time.perf_counter() - start:.1f}s."
+        )
+
+    return True
+
+
+class MigrationRunner:
+    """Run the pending backfills in a background thread.
+
+    Args:
+        run (function): Calls a database function, run(func, *args).
+                        The bot passes the writer thread here.
+        on_complete (function): Called in the thread once all backfills
+                                are complete
+
+    """
+
+    def __init__(self, run=None, on_complete=None):
+        self.run = run
+        self.on_complete = on_complete
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="migrations", daemon=True
+        )
+
+    def _run(self):
+        if run_backfills(self._stop_event, run=self.run) and self.on_complete:
+            self.on_complete()
+
+    def start(self):
+        """Start the backfill thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the current batch. The next start resumes there."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
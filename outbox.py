@@ -0,0 +1,253 @@
+"""Flood limits for the messages sent by the bot.
+
+Telegram allows about one message per second in a private chat, 20 per
+minute in a group and 30 per second overall, and answers more with
+RetryAfter. Outbox.send() only queues a call, one sender thread makes
+the calls of every chat in order in the next free slot of the chat and
+of the bot, so the worker threads never wait for a slot. A pending edit
+of a message is replaced by a newer edit of the same message, so only
+the latest state of a statistics message is sent when the buttons are
+pressed faster than the chat may be updated.
+
+"""
+
+
+import time
+import heapq
+import threading
+from collections import deque, namedtuple
+
+from telegram.error import RetryAfter, TelegramError
+
+
+# A queued call, see Outbox.send()
+_Call = namedtuple("_Call", "method kwargs callback attempts")
+
+
+class _Bucket:
+    """Token bucket in the form of a theoretical arrival time: a
+    burst of calls goes through at once, later ones are spaced by
+    interval.
+
+    """
+
+    def __init__(self, rate, burst):
+        self.interval = 1 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = 0.0
+
+    def start(self, now):
+        """Return the earliest time for the next call."""
+        return max(now, self.tat - self.tolerance)
+
+    def take(self, start):
+        """Use the slot at start."""
+        self.tat = max(self.tat, start) + self.interval
+
+    def block(self, until):
+        """No calls until the time until."""
+        self.tat = max(self.tat, until + self.tolerance)
+
+
+class Outbox:
+    """Send the messages of the bot within the flood limits.
+
+    Args:
+        group_per_minute (int): Messages per minute in a group
+        chat_per_second (int): Messages per second in a private chat
+        global_per_second (int): Messages per second in all chats
+        retries (int): Calls after a RetryAfter of Telegram
+
+    """
+
+    def __init__(
+        self,
+        group_per_minute=20,
+        chat_per_second=1,
+        global_per_second=30,
+        retries=3,
+    ):
+        self.group_per_minute = group_per_minute
+        self.chat_per_second = chat_per_second
+        self.retries = retries
+        self._global = _Bucket(global_per_second, global_per_second)
+        self._chats = {}
+        # Pending calls of every chat and the chats by their next slot
+        self._pending = {}
+        self._ready = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self.sent = 0
+        self.delayed = 0
+        self.replaced = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune()
+            if chat_id < 0:
+                bucket = _Bucket(self.group_per_minute / 60, self.group_per_minute)
+            else:
+                bucket = _Bucket(self.chat_per_second, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        # Buckets of idle chats are full again, a new one is the same
+        now = time.monotonic()
+        self._chats = {
+            chat_id: bucket
+            for chat_id, bucket in self._chats.items()
+            if bucket.tat > now or chat_id in self._pending
+        }
+
+    def start(self):
+        """Start the sender thread."""
+        self._thread.start()
+
+    def send(self, method, callback=None, **kwargs):
+        """Queue a call of a send or edit method of the bot for
+        kwargs["chat_id"] and return at once.
+
+        Args:
+            method: The bound method of the bot
+            callback: Called with the result of the method in the sender
+                      thread, not if the call failed or was replaced
+
+        """
+        chat_id = kwargs["chat_id"]
+        call = _Call(method, kwargs, callback, 0)
+        with self._lock:
+            pending = self._pending.get(chat_id)
+            if pending and "message_id" in kwargs and self._replace(pending, call):
+                return
+            now = time.monotonic()
+            bucket = self._bucket(chat_id)
+            if pending or self._global.start(bucket.start(now)) > now:
+                self.delayed += 1
+            if pending is None:
+                pending = self._pending[chat_id] = deque()
+                heapq.heappush(self._ready, (bucket.start(now), chat_id))
+            pending.append(call)
+            self._wakeup.notify()
+
+    def _replace(self, pending, call):
+        # Replace a pending edit of the same message by the newer one
+        for index, queued in enumerate(pending):
+            if (
+                queued.method == call.method
+                and queued.kwargs.get("message_id") == call.kwargs["message_id"]
+            ):
+                pending[index] = call
+                self.replaced += 1
+                return True
+        return False
+
+    def stop(self, timeout=None):
+        """Send the queued calls and stop the sender thread."""
+        if not self._thread.is_alive():
+            return
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join(timeout)
+
+    def _next(self):
+        # Wait for the next slot, take it and return its chat and call
+        with self._lock:
+            while True:
+                if not self._ready:
+                    if self._stopping:
+                        return None, None
+                    self._wakeup.wait()
+                    continue
+                _, chat_id = self._ready[0]
+                bucket = self._bucket(chat_id)
+                now = time.monotonic()
+                start = self._global.start(bucket.start(now))
+                if start > now:
+                    heapq.heapreplace(self._ready, (start, chat_id))
+                    self._wakeup.wait(self._ready[0][0] - now)
+                    continue
+                heapq.heappop(self._ready)
+                bucket.take(start)
+                self._global.take(start)
+                pending = self._pending[chat_id]
+                call = pending.popleft()
+                if pending:
+                    heapq.heappush(self._ready, (bucket.start(now), chat_id))
+                else:
+                    del self._pending[chat_id]
+                return chat_id, call
+
+    def _retry(self, chat_id, call, retry_after):
+        # Pause the chat as long as Telegram asks and queue the call first
+        with self._lock:
+            self.retried += 1
+            bucket = self._bucket(chat_id)
+            bucket.block(time.monotonic() + retry_after)
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                pending = self._pending[chat_id] = deque()
+                heapq.heappush(self._ready, (bucket.start(time.monotonic()), chat_id))
+            pending.appendleft(call._replace(attempts=call.attempts + 1))
+
+    def _run(self):
+        while True:
+            chat_id, call = self._next()
+            if call is None:
+                break
+            try:
+                result = call.method(**call.kwargs)
+            except RetryAfter as error:
+                if call.attempts < self.retries:
+                    self._retry(chat_id, call, error.retry_after)
+                    continue
+                print(f"Outbox: giving up on chat {chat_id}: {error}")
+                with self._lock:
+                    self.failed += 1
+                continue
+            except TelegramError as error:
+                print(f"Outbox: call failed in chat {chat_id}: {error}")
+                with self._lock:
+                    self.failed += 1
+                continue
+            except Exception as error:  # pylint: disable=broad-except
+                # E.g. bad kwargs, the thread must keep sending the others
+                print(f"Outbox: call failed in chat {chat_id}: {error!r}")
+                with self._lock:
+                    self.failed += 1
+                continue
+            with self._lock:
+                self.sent += 1
+            if call.callback:
+                try:
+                    call.callback(result)
+                except Exception as error:  # pylint: disable=broad-except
+                    print(f"Outbox: callback failed in chat {chat_id}: {error}")
+
+    def depth(self):
+        """Return the number of queued calls."""
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def stats(self):
+        """Return the queued calls and the counters of the sent, delayed,
+        replaced, retried and failed calls.
+
+        """
+        with self._lock:
+            return {
+                "queued": sum(len(pending) for pending in self._pending.values()),
+                "sent": self.sent,
+                "delayed": self.delayed,
+                "replaced": self.replaced,
+                "retried": self.retried,
+                "failed": self.failed,
+                "chats": len(self._chats),
+            }
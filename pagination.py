@@ -0,0 +1,137 @@
+"""Page state of the statistics messages."""
+
+
+import time
+import threading
+from collections import OrderedDict
+
+from dbqueries import db_load_pagination, db_save_pagination
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+class PaginationStore:
+    """Remember which group (or all groups) and timespan every statistics
+    message shows, so its buttons can page through the timespans.
+
+    The states are kept per chat in LRU order. A chat keeps at most
+    max_per_chat states, states not used for ttl seconds are dropped.
+    With persist, changed states are written to the database in
+    batches by flush() and loaded again by load() after a restart.
+
+    Args:
+        max_per_chat (int): Number of states per chat
+        ttl (int): Seconds a state is kept after its last use
+        persist (bool): Write the states to the database
+        run (function): Calls a database function, run(func, *args).
+                        The bot passes the writer thread here.
+
+    """
+
+    def __init__(self, max_per_chat=100, ttl=30 * 86400, persist=True, run=None):
+        self.max_per_chat = max_per_chat
+        self.ttl = ttl
+        self.persist = persist
+        self._run = run or _call
+        # chat_id: OrderedDict(message_id: (group_id, timespan, updated))
+        self._chats = {}
+        self._dirty = {}
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _drop(self, chat_id, message_id):
+        self._dirty.pop((chat_id, message_id), None)
+        self._deleted.add((chat_id, message_id))
+        self.evicted += 1
+
+    def get(self, chat_id, message_id):
+        """Return (group_id, timespan) of a statistics message, None if
+        the message is unknown.
+
+        """
+        with self._lock:
+            states = self._chats.get(chat_id)
+            state = states.get(message_id) if states else None
+            if state is None:
+                return None
+            if state[2] < time.time() - self.ttl:
+                del states[message_id]
+                self._drop(chat_id, message_id)
+                return None
+            states.move_to_end(message_id)
+            return state[:2]
+
+    def put(self, chat_id, message_id, group_id, timespan=0, updated=None):
+        """Store the state of a statistics message.
+
+        Args:
+            chat_id (int): Chat of the message
+            message_id (int): Telegram message ID
+            group_id (int or None): Shown group, None for all groups
+            timespan (int): Shown timespan
+            updated (int): Time of the change (epoch), default now
+
+        """
+        state = (group_id, timespan, updated or int(time.time()))
+        with self._lock:
+            states = self._chats.setdefault(chat_id, OrderedDict())
+            states[message_id] = state
+            states.move_to_end(message_id)
+            self._deleted.discard((chat_id, message_id))
+            self._dirty[(chat_id, message_id)] = state
+
+            expired = time.time() - self.ttl
+            while states:
+                oldest_id, oldest = next(iter(states.items()))
+                if len(states) <= self.max_per_chat and oldest[2] >= expired:
+                    break
+                del states[oldest_id]
+                self._drop(chat_id, oldest_id)
+
+    def load(self):
+        """Load the stored states that are not expired."""
+        if not self.persist:
+            return
+        for row in db_load_pagination(int(time.time() - self.ttl)):
+            self.put(*row)
+        # Only the states dropped while loading have to be written
+        with self._lock:
+            self._dirty.clear()
+
+    def flush(self, context=None):  # pylint: disable=unused-argument
+        """Write the changed and delete the dropped states. Used as
+        JobQueue callback.
+
+        """
+        if not self.persist:
+            return
+        with self._lock:
+            rows = [key + state for key, state in self._dirty.items()]
+            deleted = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+        if not rows and not deleted:
+            return
+        try:
+            self._run(db_save_pagination, rows, deleted, int(time.time() - self.ttl))
+        except ValueError as error:
+            print(f"Can't save the pagination states: {error}")
+            # Retry with the next flush, unless changed meanwhile
+            with self._lock:
+                for row in rows:
+                    if row[:2] not in self._deleted:
+                        self._dirty.setdefault(row[:2], row[2:])
+                self._deleted.update(key for key in deleted if key not in self._dirty)
+
+    def stats(self):
+        """Return the number of chats, states and evicted states."""
+        with self._lock:
+            return {
+                "chats": len(self._chats),
+                "states": sum(len(states) for states in self._chats.values()),
+                "pending": len(self._dirty) + len(self._deleted),
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,194 @@
+"""Fixed SQL text of all read queries and of the retention delete.
+
+Parameters, including the time bounds, are always bound as values, so
+every query is prepared once and then reused from the statement cache
+of its connection. check_plans() shows which plan SQLite chooses for
+every query.
+
+"""
+
+
+import re
+from datetime import datetime, timedelta, timezone
+
+
+_GROUP = "(SELECT id FROM Telegram_Group WHERE group_id=(?))"
+_USER = "(SELECT id FROM Telegram_User WHERE user_id=(?))"
+
+QUERIES = {
+    # Statistics from the daily rollups, parameters: [group_id,] first day
+    "messages_from_group": (
+        "SELECT IFNULL(SUM(msg_count), 0) FROM Message_Day_Type "
+        f"WHERE group_id={_GROUP} AND day>=(?)"
+    ),
+    "messages": (
+        "SELECT IFNULL(SUM(msg_count), 0) FROM Message_Day_Type WHERE day>=(?)"
+    ),
+    "message_types_from_group": (
+        "SELECT SUM(r.msg_count) AS mCount, t.msg_type_ger "
+        "FROM Message_Day_Type r, Telegram_Type t "
+        f"WHERE t.id=r.msg_type AND r.group_id={_GROUP} AND r.day>=(?) "
+        "GROUP BY t.id ORDER BY mCount DESC"
+    ),
+    "message_types": (
+        "SELECT SUM(r.msg_count) AS mCount, t.msg_type_ger "
+        "FROM Message_Day_Type r, Telegram_Type t "
+        "WHERE t.id=r.msg_type AND r.day>=(?) "
+        "GROUP BY t.id ORDER BY mCount DESC"
+    ),
+    # Charts, parameters: [group_id,] first day
+    "day_counts_from_group": (
+        "SELECT day, SUM(msg_count) FROM Message_Day_Type "
+        f"WHERE group_id={_GROUP} AND day>=(?) GROUP BY day ORDER BY day"
+    ),
+    "day_counts": (
+        "SELECT day, SUM(msg_count) FROM Message_Day_Type "
+        "WHERE day>=(?) GROUP BY day ORDER BY day"
+    ),
+    # /me, parameters: user hash[, group_id]
+    "user_messages_from_group": (
+        "SELECT IFNULL(SUM(msg_count), 0) FROM Message_Day_User "
+        f"WHERE user_id={_USER} AND group_id={_GROUP}"
+    ),
+    "user_messages": (
+        f"SELECT IFNULL(SUM(msg_count), 0) FROM Message_Day_User WHERE user_id={_USER}"
+    ),
+    # Leaderboards, parameters: first day / JSON array of user row ids
+    "user_counts": (
+        "SELECT group_id, user_id, SUM(msg_count) FROM Message_Day_User "
+        "WHERE day>=(?) GROUP BY group_id, user_id"
+    ),
+    "user_names": (
+        "SELECT id, user_name FROM Telegram_User "
+        "WHERE id IN (SELECT value FROM json_each(?))"
+    ),
+    # Network statistics of a shard, parameter: first day
+    "user_totals": (
+        "SELECT u.user_id, u.user_name, SUM(r.msg_count) "
+        "FROM Message_Day_User r INNER JOIN Telegram_User u ON u.id=r.user_id "
+        "WHERE r.day>=(?) GROUP BY r.user_id"
+    ),
+    # Columnar engine
+    "message_columns": (
+        "SELECT group_id, user_id, IFNULL(msg_type, 0), IFNULL(msg_length, 0), ts "
+        "FROM Message"
+    ),
+    "type_names": "SELECT id, msg_type_ger FROM Telegram_Type",
+    # /words, parameters: [group_id,] first day, emoji (0/1), limit
+    "words_from_group": (
+        "SELECT SUM(word_count) AS wCount, word FROM Word_Daily "
+        f"WHERE group_id={_GROUP} AND day>=(?) AND emoji=(?) "
+        "GROUP BY word ORDER BY wCount DESC LIMIT (?)"
+    ),
+    "words": (
+        "SELECT SUM(word_count) AS wCount, word FROM Word_Daily "
+        "WHERE day>=(?) AND emoji=(?) GROUP BY word ORDER BY wCount DESC LIMIT (?)"
+    ),
+    # Pagination, parameter: updated since (epoch)
+    "pagination": (
+        "SELECT chat_id, message_id, group_id, timespan, updated "
+        "FROM Pagination_State WHERE updated>=(?) ORDER BY updated"
+    ),
+    # Exports, parameters: since, until[, group_id]. The group IN list lets
+    # the messages of all groups use the (group_id, ts) index, too
+    "export_messages": (
+        "SELECT g.group_id, u.user_id, u.user_name, t.message_type, "
+        "   m.msg_length, m.ts "
+        "FROM Message m "
+        "INNER JOIN Telegram_Group g ON g.id=m.group_id "
+        "INNER JOIN Telegram_User u ON u.id=m.user_id "
+        "LEFT JOIN Telegram_Type t ON t.id=m.msg_type "
+        "WHERE m.group_id IN (SELECT id FROM Telegram_Group) "
+        "   AND m.ts>=(?) AND m.ts<(?)"
+    ),
+    "export_day_types": (
+        "SELECT g.group_id, d.day, t.message_type, d.msg_count "
+        "FROM Message_Day_Type d "
+        "INNER JOIN Telegram_Group g ON g.id=d.group_id "
+        "LEFT JOIN Telegram_Type t ON t.id=d.msg_type "
+        "WHERE d.day>=(?) AND d.day<(?)"
+    ),
+    "export_day_users": (
+        "SELECT g.group_id, d.day, u.user_id, u.user_name, d.msg_count "
+        "FROM Message_Day_User d "
+        "INNER JOIN Telegram_Group g ON g.id=d.group_id "
+        "INNER JOIN Telegram_User u ON u.id=d.user_id "
+        "WHERE d.day>=(?) AND d.day<(?)"
+    ),
+    # Retention, parameters: group row id, cutoff (epoch), limit. One
+    # group at a time, so every batch is a range of the (group_id, ts) index
+    "delete_messages_from_group": (
+        "DELETE FROM Message WHERE id IN "
+        "(SELECT id FROM Message WHERE group_id=(?) AND ts<(?) LIMIT (?))"
+    ),
+}
+QUERIES["export_messages_from_group"] = (
+    QUERIES["export_messages"] + f" AND m.group_id={_GROUP}"
+)
+QUERIES["export_day_types_from_group"] = (
+    QUERIES["export_day_types"] + f" AND d.group_id={_GROUP}"
+)
+QUERIES["export_day_users_from_group"] = (
+    QUERIES["export_day_users"] + f" AND d.group_id={_GROUP}"
+)
+
+# Queries that read the whole Message table on purpose: the columnar
+# engine loads every message into memory once at startup
+FULL_SCANS = {"message_columns"}
+
+SCAN = re.compile(r"\bSCAN (\w+)")
+
+
+def timespan_starts(today):
+    """Return the first day (YYYY-MM-DD) of every timespan, "" for all days.
+
+    Args:
+        today (date): The current day (UTC)
+
+    """
+    return {
+        0: today.replace(day=1).isoformat(),
+        1: (today - timedelta(days=30)).isoformat(),
+        2: today.isoformat(),
+        3: "",
+    }
+
+
+def timespan_start(timespan):
+    """Return the first day (YYYY-MM-DD) of a timespan, "" for all days.
+
+    Args:
+        timespan (int): 0 this month, 1 last 30 days, 2 today, 3 all
+
+    """
+    return timespan_starts(datetime.now(timezone.utc).date())[timespan]
+
+
+def _message_names(sql):
+    # The table name and its alias, if any
+    names = {"Message"}
+    names.update(re.findall(r"\bMessage (?:AS )?(\w+)", sql))
+    return names - {"INNER", "LEFT", "WHERE", "GROUP", "ORDER"}
+
+
+def check_plans(db):
+    """Run EXPLAIN QUERY PLAN for every query.
+
+    Args:
+        db: A connection to a database with the Yve schema
+
+    Returns:
+        List of (name, plan lines, ok) tuples. ok is False if the query
+        scans the whole Message table, but isn't in FULL_SCANS.
+
+    """
+    results = []
+    for name, sql in QUERIES.items():
+        params = (None,) * sql.count("?")
+        plan = [row[-1] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        scanned = {
+            match.group(1) for line in plan for match in [SCAN.search(line)] if match
+        }
+        ok = name in FULL_SCANS or not scanned & _message_names(sql)
+        results.append((name, plan, ok))
+    return results
@@ -0,0 +1,111 @@
+"""Retention of the raw Message rows.
+
+Every message is counted in the daily rollup tables when it is added,
+so the statistics of all timespans don't need the Message rows. Rows
+older than the retention are deleted in small batches, one short write
+transaction each, and the free pages are returned to the file system
+with an incremental vacuum afterwards.
+
+"""
+
+
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+import migrations
+from dbqueries import db_delete_messages_before, db_incremental_vacuum
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+class Retention:
+    """Delete the messages older than days, used as JobQueue callback.
+
+    Args:
+        days (int)        : Keep the messages of this many days
+        batch_size (int)  : Number of messages deleted per transaction
+        pause_ms (int)    : Pause between two transactions
+        vacuum_pages (int): Free pages returned per run
+        run (function)    : Calls a database function, run(func, *args).
+                            The bot passes the writer thread here.
+
+    """
+
+    def __init__(self, days, batch_size=1000, pause_ms=50, vacuum_pages=1000, run=None):
+        self.days = days
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self.vacuum_pages = vacuum_pages
+        self._run = run or _call
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.deleted = 0
+        self.runs = 0
+        self.free_pages = 0
+        self.last_run = None
+        self.last_seconds = 0.0
+
+    def cutoff(self):
+        """Return the epoch of midnight (UTC) days ago. Only whole days
+        are deleted, so the rollups of the remaining days can always be
+        rebuilt from the Message rows.
+
+        """
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        return int((today - timedelta(days=self.days)).timestamp())
+
+    def __call__(self, context=None):  # pylint: disable=unused-argument
+        self.run_once()
+
+    def run_once(self):
+        """Delete all messages before the cutoff, then vacuum.
+
+        Returns:
+            Number of deleted messages.
+
+        """
+        if not self.days or not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            # The backfills count the existing rows in the rollups,
+            # they must not disappear before that
+            if not migrations.is_complete():
+                return 0
+            start = time.perf_counter()
+            cutoff = self.cutoff()
+            deleted = 0
+            while not self._stop_event.is_set():
+                count = self._run(db_delete_messages_before, cutoff, self.batch_size)
+                deleted += count
+                if count < self.batch_size:
+                    break
+                time.sleep(self.pause)
+            self.free_pages = self._run(db_incremental_vacuum, self.vacuum_pages)
+
+            self.deleted += deleted
+            self.runs += 1
+            self.last_run = datetime.now()
+            self.last_seconds = time.perf_counter() - start
+            return deleted
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """Stop a running retention after the current batch."""
+        self._stop_event.set()
+
+    def stats(self):
+        """Return the counters of the retention."""
+        return {
+            "days": self.days,
+            "deleted": self.deleted,
+            "runs": self.runs,
+            "free_pages": self.free_pages,
+            "last_run": self.last_run,
+            "last_seconds": self.last_seconds,
+        }
@@ -0,0 +1,104 @@
+"""Network statistics over the databases of several Yve processes.
+
+Every process (shard) owns some of the groups and writes its own
+database. The network statistics read the daily rollups of all shard
+databases in parallel, each over its own read-only connection, and
+merge them. Users are matched across the shards by their hash, so all
+shards have to use the same USER_HASH and USER_HASH_KEY.
+
+"""
+
+
+import heapq
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from dbqueries import StatsSnapshot
+from queries import QUERIES, timespan_start
+
+
+class Shards:
+    """Read the network statistics from all shard databases.
+
+    Args:
+        paths (list): Database files of all shards
+        limit (int): Number of top posters
+
+    """
+
+    def __init__(self, paths, limit=10):
+        self.paths = list(paths)
+        self.limit = limit
+        self.failures = 0
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.paths), thread_name_prefix="shard"
+        )
+
+    def _connect(self, path):
+        # One read-only connection per shard and thread
+        if not hasattr(self._local, "dbs"):
+            self._local.dbs = {}
+        db = self._local.dbs.get(path)
+        if db is None:
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            self._local.dbs[path] = db
+        return db
+
+    def _read(self, path, since):
+        """Return the total, the types and the user counts of a shard,
+        read in one transaction. None if the shard can't be read.
+
+        """
+        try:
+            db = self._connect(path)
+            db.execute("BEGIN")
+            try:
+                total = db.execute(QUERIES["messages"], (since,)).fetchone()[0]
+                types = db.execute(QUERIES["message_types"], (since,)).fetchall()
+                users = db.execute(QUERIES["user_totals"], (since,)).fetchall()
+            finally:
+                db.commit()
+        except sqlite3.Error as error:
+            print(f"Can't read shard {path}: {error}")
+            self.failures += 1
+            return None
+        return total, types, users
+
+    def snapshot(self, group_id, timespan):  # pylint: disable=unused-argument
+        """Read and merge the statistics of all shards. Used as loader of
+        a StatsCache, group_id is always None.
+
+        Returns:
+            Tuple of the StatsSnapshot and the list of (count, user name)
+            tuples of the top posters.
+
+        """
+        since = timespan_start(timespan)
+        results = self._executor.map(lambda path: self._read(path, since), self.paths)
+
+        total = 0
+        types = Counter()
+        users = Counter()
+        names = {}
+        for result in results:
+            if result is None:
+                continue
+            shard_total, shard_types, shard_users = result
+            total += shard_total
+            for count, msg_type in shard_types:
+                types[msg_type] += count
+            for user_id_hash, user_name, count in shard_users:
+                users[user_id_hash] += count
+                names.setdefault(user_id_hash, user_name)
+
+        types = [(count, msg_type) for msg_type, count in types.most_common()]
+        top = heapq.nlargest(self.limit, users.items(), key=lambda item: item[1])
+        top_posters = [(count, names[user_id_hash]) for user_id_hash, count in top]
+        return StatsSnapshot(None, timespan, total, types), top_posters
+
+    def close(self):
+        """Stop the reader threads."""
+        self._executor.shutdown()
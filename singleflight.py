@@ -0,0 +1,59 @@
+"""Share one computation between concurrent identical requests.
+
+The read-only commands run in the worker pool, so the same /stats can
+be computed by several threads at once when a group spams the command
+or the buttons. SingleFlight runs a function only once per key at a
+time, the other callers wait for and get the same result.
+
+"""
+
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args):
+        """Return func(*args), or the result of the running call with
+        the same key. Exceptions are raised in all waiting callers.
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = Future()
+                self.calls += 1
+                leader = True
+        if not leader:
+            return call.result()
+
+        try:
+            result = func(*args)
+        except BaseException as error:
+            self._done(key)
+            call.set_exception(error)
+            raise
+        self._done(key)
+        call.set_result(result)
+        return result
+
+    def _done(self, key):
+        # Later calls compute a new result
+        with self._lock:
+            del self._calls[key]
+
+    def stats(self):
+        """Return the number of computed and of shared calls."""
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared}
@@ -0,0 +1,108 @@
+"""Cache for the statistics snapshots."""
+
+
+import time
+import threading
+
+from dbqueries import db_get_stats_snapshot
+from singleflight import SingleFlight
+
+
+# Seconds between two checks whether the snapshots need a refresh
+REFRESH_CHECK_INTERVAL = 5
+
+
+class StatsCache:
+    """Cache the StatsSnapshot per (group_id, timespan).
+
+    Handlers always get the cached snapshot, even if it is stale. Only
+    a snapshot that was never requested before is loaded with
+    load(group_id, timespan) in the handler, once for all handlers that
+    request it at the same time. All cached snapshots are
+    refreshed in the background by refresh(), which runs in the
+    JobQueue, when the oldest is older than max_age seconds or more than
+    max_writes messages were added since the last refresh.
+
+    """
+
+    def __init__(self, max_age=60, max_writes=1000, load=db_get_stats_snapshot):
+        self.max_age = max_age
+        self.max_writes = max_writes
+        self.load = load
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.writes = 0
+
+    def get(self, group_id, timespan):
+        """Return the snapshot of a group (or all groups if group_id is
+        None) and timespan.
+
+        """
+        key = (group_id, timespan)
+        with self._lock:
+            entry = self._snapshots.get(key)
+            if entry:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        return self._flights.do(key, self._load, group_id, timespan)
+
+    def _load(self, group_id, timespan):
+        snapshot = self.load(group_id, timespan)
+        with self._lock:
+            self._snapshots[(group_id, timespan)] = (snapshot, time.monotonic())
+        return snapshot
+
+    def clear(self):
+        """Forget all snapshots, the next get() of each loads it again."""
+        with self._lock:
+            self._snapshots = {}
+
+    def count_write(self, count=1):
+        """Count added messages."""
+        with self._lock:
+            self.writes += count
+
+    def refresh(self, context=None):  # pylint: disable=unused-argument
+        """Refresh all cached snapshots if they are too old or too many
+        messages were added. Used as JobQueue callback.
+
+        """
+        with self._lock:
+            if not self._snapshots:
+                return
+            oldest = min(computed for _, computed in self._snapshots.values())
+            if (
+                time.monotonic() - oldest < self.max_age
+                and self.writes < self.max_writes
+            ):
+                return
+            keys = list(self._snapshots)
+            self.writes = 0
+
+        for group_id, timespan in keys:
+            snapshot = self.load(group_id, timespan)
+            with self._lock:
+                self._snapshots[(group_id, timespan)] = (snapshot, time.monotonic())
+        with self._lock:
+            self.refreshes += 1
+
+    def stats(self):
+        """Return the hit/miss counters and the snapshot ages in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - computed for _, computed in self._snapshots.values()]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "snapshots": len(ages),
+                "pending_writes": self.writes,
+                "max_age": max(ages, default=0.0),
+                "min_age": min(ages, default=0.0),
+            }
@@ -0,0 +1,108 @@
+"""Shared fixtures of the tests.
+
+The modules of Yve read the config when they are imported, so a config
+of the tests is written to a temporary directory first and YVE_CONFIG
+points to it. Every test gets a new database from the database fixture.
+
+"""
+
+
+import os
+import sys
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import yaml
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GROUPS = [-1001, -1002, -1003]
+MESSAGE_TYPES = ["text", "sticker", "photo", "voice", "video"]
+
+
+def _write_config():
+    with open(os.path.join(ROOT, "config.sample.yaml")) as fp:
+        config = yaml.safe_load(fp)
+    directory = tempfile.mkdtemp(prefix="yve-tests-")
+    config.update(
+        BOT_TOKEN="123:abc",
+        # A blank entry, like the empty lines of config.sample.yaml
+        GROUPS=GROUPS + [None],
+        MESSAGE_TYPES=MESSAGE_TYPES,
+        SQLITE3_DB=os.path.join(directory, "panda.sqlite3"),
+        METRICS_PORT=0,
+    )
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as fp:
+        yaml.safe_dump(config, fp)
+    os.environ["YVE_CONFIG"] = path
+
+
+_write_config()
+
+
+# pylint: disable=wrong-import-position
+from dbhelper import DBHelper, ConnectionManager
+from dbqueries import db_add_groups, db_add_messages
+from migrations import create_schema
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A new database with the schema and the GROUPS, used by DBHelper.
+
+    Yields:
+        The path of the database file.
+
+    """
+    path = str(tmp_path / "panda.sqlite3")
+    connections = DBHelper.connections
+    DBHelper.connections = ConnectionManager(path)
+    DBHelper.ids.clear()
+    create_schema()
+    db_add_groups(GROUPS)
+    yield path
+    DBHelper.connections.close()
+    DBHelper.connections = connections
+    DBHelper.ids.clear()
+
+
+def seed_messages(count=3000, days=90, seed=1):
+    """Add count random messages of the last days to all GROUPS, through
+    the insert path of the bot, so the rollup triggers run too.
+
+    """
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for _ in range(count):
+        user = f"user{rnd.randrange(40)}"
+        rows.append(
+            (
+                rnd.choice(GROUPS),
+                user,
+                user,
+                rnd.choice(MESSAGE_TYPES),
+                rnd.randrange(30),
+                now - timedelta(seconds=rnd.random() * days * 86400),
+            )
+        )
+    # The first seconds of today and of the month, the timespan bounds
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    rows += [(group_id, "user0", "user0", "text", 1, today) for group_id in GROUPS]
+    rows += [
+        (group_id, "user1", "user1", "photo", 1, today.replace(day=1))
+        for group_id in GROUPS
+    ]
+    db_add_messages(rows)
+
+
+@pytest.fixture
+def messages(database):
+    """The database fixture with seeded messages."""
+    seed_messages()
+    return database
@@ -0,0 +1,68 @@
+"""The chart workers and the chart cache."""
+
+
+import pytest
+
+pytest.importorskip("matplotlib")
+
+# pylint: disable=wrong-import-position
+import charts
+
+ARGS = (
+    "Heute",
+    [("2026-10-01", 5), ("2026-10-02", 7)],
+    [(9, "Text"), (3, "Sticker")],
+)
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    # A worker that imported the bot or its config would exit at once
+    monkeypatch.setenv("YVE_CONFIG", str(tmp_path / "missing.yaml"))
+    cache = charts.Charts(workers=1, cache_size=2, timeout=30)
+    yield cache
+    cache.close()
+
+
+def test_chart_key_of_the_plotted_data():
+    assert charts.chart_key(*ARGS) == charts.chart_key(*ARGS)
+    days = ARGS[1] + [("2026-10-03", 1)]
+    assert charts.chart_key(ARGS[0], days, ARGS[2]) != charts.chart_key(*ARGS)
+    types = [(9, "Text"), (4, "Sticker")]
+    assert charts.chart_key(ARGS[0], ARGS[1], types) != charts.chart_key(*ARGS)
+
+
+def test_draw_once_and_upload_once(cache):
+    key = charts.chart_key(*ARGS)
+    png = cache.get(key, ARGS)
+    assert png.startswith(b"\x89PNG")
+    assert cache.get(key, ARGS) is png
+    cache.uploaded(key, "file-id")
+    assert cache.get(key, ARGS) == "file-id"
+    assert cache.stats() == {
+        "charts": 1,
+        "hits": 2,
+        "renders": 1,
+        "uploads": 1,
+        "errors": 0,
+    }
+
+
+def test_timeout_replaces_the_worker(cache):
+    cache.timeout = 0.001
+    assert cache.get("slow", ARGS) is None
+    assert cache.stats()["errors"] == 1
+    cache.timeout = 30
+    assert cache.get(charts.chart_key(*ARGS), ARGS).startswith(b"\x89PNG")
+
+
+def test_drawing_error_keeps_the_worker(cache):
+    assert cache.get("broken", ("Heute", [("2026-10-01",)], [])) is None
+    assert cache.get(charts.chart_key(*ARGS), ARGS).startswith(b"\x89PNG")
+    assert cache.stats()["errors"] == 1
+
+
+def test_caption_fits():
+    text = "\n".join(f"line {n}" for n in range(500))
+    assert len(charts.caption(text)) <= charts.CAPTION_LIMIT
+    assert charts.caption("short") == "short"
@@ -0,0 +1,87 @@
+"""The NumPy columnar engine against plain SQL over the Message table."""
+
+
+from datetime import datetime, timezone
+
+import pytest
+
+from dbhelper import DBHelper
+from dbqueries import db_add_messages, db_load_ids
+from queries import timespan_start
+
+from conftest import GROUPS
+
+np = pytest.importorskip("numpy")
+columns = pytest.importorskip("columns")
+
+# Messages of the first day of the timespan are counted, like the rollups
+WHERE = "strftime('%Y-%m-%d', m.ts, 'unixepoch')>=(?)"
+GROUP = "m.group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
+
+
+def _sql(select, group_id, timespan, group_by=""):
+    stmt = (
+        f"SELECT {select} FROM Message m "
+        f"LEFT JOIN Telegram_Type t ON t.id=m.msg_type WHERE {WHERE}"
+    )
+    params = [timespan_start(timespan)]
+    if group_id is not None:
+        stmt += f" AND {GROUP}"
+        params.append(group_id)
+    return DBHelper().db.execute(stmt + group_by, params).fetchall()
+
+
+def _assert_matches(store, group_id, timespan):
+    total = _sql("COUNT(*)", group_id, timespan)[0][0]
+    types = _sql(
+        "t.msg_type_ger, COUNT(*)",
+        group_id,
+        timespan,
+        " AND m.msg_type IS NOT NULL GROUP BY m.msg_type",
+    )
+    types = [(name, count) for name, count in types]
+    users = dict(
+        _sql(
+            "(SELECT user_name FROM Telegram_User WHERE id=m.user_id), COUNT(*)",
+            group_id,
+            timespan,
+            " GROUP BY m.user_id",
+        )
+    )
+
+    snapshot = store.snapshot(group_id, timespan)
+    assert snapshot.total == total
+    assert sorted((name, count) for count, name in snapshot.types) == sorted(types)
+    # Users with the same count may be ordered differently
+    top = store.top(group_id, timespan)
+    expected = sorted(users.values(), reverse=True)[: store.top_size]
+    assert [count for count, _ in top] == expected
+    assert all(users[name] == count for count, name in top)
+
+
+@pytest.fixture
+def store(messages):
+    db_load_ids()
+    store = columns.ColumnStore()
+    store.load()
+    return store
+
+
+@pytest.mark.parametrize("timespan", range(4))
+@pytest.mark.parametrize("group_id", [None] + GROUPS)
+def test_load_matches_sql(store, group_id, timespan):
+    _assert_matches(store, group_id, timespan)
+
+
+@pytest.mark.parametrize("group_id", [None] + GROUPS)
+def test_add_matches_sql(store, group_id):
+    now = datetime.now(timezone.utc)
+    rows = [
+        (GROUPS[n % len(GROUPS)], f"new{n % 7}", f"new{n % 7}", "sticker", 2, now)
+        for n in range(50)
+    ]
+    db_add_messages(rows)
+    # Like the writer thread after the commit
+    store.add(rows)
+    for timespan in range(4):
+        _assert_matches(store, group_id, timespan)
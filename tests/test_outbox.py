@@ -0,0 +1,127 @@
+"""The outbox: queued sends within the flood limits."""
+
+
+import time
+import threading
+
+from telegram.error import RetryAfter
+
+from outbox import Outbox
+
+
+class Recorder:
+    """Stand-in for the send methods of the bot."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.done = threading.Event()
+        self.expected = 0
+
+    def send_message(self, **kwargs):
+        time.sleep(self.delay)
+        self.calls.append((time.monotonic(), kwargs))
+        if len(self.calls) >= self.expected:
+            self.done.set()
+        return kwargs
+
+    def edit_message_text(self, **kwargs):
+        return self.send_message(**kwargs)
+
+
+def _outbox(**kwargs):
+    outbox = Outbox(**kwargs)
+    outbox.start()
+    return outbox
+
+
+def test_send_does_not_wait():
+    bot = Recorder(delay=0.2)
+    bot.expected = 3
+    outbox = _outbox(chat_per_second=5)
+    start = time.perf_counter()
+    for n in range(3):
+        outbox.send(bot.send_message, chat_id=1, text=str(n))
+    assert time.perf_counter() - start < 0.1
+    assert bot.done.wait(5)
+    outbox.stop()
+    assert [kwargs["text"] for _, kwargs in bot.calls] == ["0", "1", "2"]
+
+
+def test_calls_of_a_chat_are_spaced():
+    bot = Recorder()
+    bot.expected = 3
+    outbox = _outbox(chat_per_second=10)
+    for n in range(3):
+        outbox.send(bot.send_message, chat_id=1, text=str(n))
+    assert bot.done.wait(5)
+    outbox.stop()
+    times = [sent for sent, _ in bot.calls]
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+    stats = outbox.stats()
+    assert stats["sent"] == 3 and stats["delayed"] == 2 and stats["queued"] == 0
+
+
+def test_newer_edit_replaces_pending_edit():
+    bot = Recorder()
+    bot.expected = 2
+    results = []
+    outbox = _outbox(chat_per_second=5)
+    outbox.send(bot.send_message, chat_id=1, text="stats")
+    for state in range(5):
+        outbox.send(
+            bot.edit_message_text,
+            results.append,
+            chat_id=1,
+            message_id=7,
+            text=str(state),
+        )
+    assert bot.done.wait(5)
+    outbox.stop()
+    assert [kwargs["text"] for _, kwargs in bot.calls] == ["stats", "4"]
+    assert [result["text"] for result in results] == ["4"]
+    assert outbox.stats()["replaced"] == 4
+
+
+def test_retry_after():
+    bot = Recorder()
+    bot.expected = 1
+    failures = [RetryAfter(0.2)]
+
+    def flaky(**kwargs):
+        if failures:
+            raise failures.pop()
+        return bot.send_message(**kwargs)
+
+    outbox = _outbox()
+    start = time.monotonic()
+    outbox.send(flaky, chat_id=-100, text="stats")
+    assert bot.done.wait(5)
+    outbox.stop()
+    assert bot.calls[0][0] - start >= 0.2
+    assert outbox.stats()["retried"] == 1
+
+
+def test_stop_sends_the_queued_calls():
+    bot = Recorder()
+    outbox = _outbox(chat_per_second=20)
+    for n in range(5):
+        outbox.send(bot.send_message, chat_id=1, text=str(n))
+    outbox.stop(5)
+    assert len(bot.calls) == 5
+
+
+def test_other_errors_keep_the_sender_running():
+    bot = Recorder()
+    bot.expected = 1
+
+    def broken(**kwargs):
+        raise TypeError("bad media")
+
+    outbox = _outbox(chat_per_second=20)
+    outbox.send(broken, chat_id=1, text="chart")
+    outbox.send(bot.send_message, chat_id=1, text="stats")
+    assert bot.done.wait(5)
+    outbox.stop(5)
+    assert [kwargs["text"] for _, kwargs in bot.calls] == ["stats"]
+    assert outbox.stats()["failed"] == 1
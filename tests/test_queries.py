@@ -0,0 +1,74 @@
+"""Query plans: no registered query may scan the whole Message table."""
+
+
+import time
+
+import pytest
+
+import queries
+from dbhelper import DBHelper
+
+
+def _failed(db):
+    return {name: plan for name, plan, ok in queries.check_plans(db) if not ok}
+
+
+def test_plans_of_a_new_database(messages):
+    with DBHelper.connections.writer() as db:
+        assert _failed(db) == {}
+
+
+def test_plans_after_analyze(messages):
+    # The statistics of ANALYZE must not make SQLite prefer a scan
+    with DBHelper.connections.writer() as db:
+        db.execute("ANALYZE")
+        assert _failed(db) == {}
+
+
+def test_full_scans_still_scan(messages):
+    # An entry of the allow-list that no longer scans is stale
+    with DBHelper.connections.writer() as db:
+        plans = {name: plan for name, plan, _ in queries.check_plans(db)}
+    for name in queries.FULL_SCANS:
+        assert any(queries.SCAN.search(line) for line in plans[name]), name
+
+
+@pytest.mark.parametrize("group_id", [None, -1002])
+def test_export_messages_of_a_time_range(messages, group_id):
+    until = int(time.time())
+    since = until - 7 * 86400
+    exported = [
+        row
+        for chunk in DBHelper().sql_export_messages(group_id, since, until, 100)
+        for row in chunk
+    ]
+    stmt = "SELECT COUNT(*) FROM Message WHERE ts>=(?) AND ts<(?)"
+    params = [since, until]
+    if group_id is not None:
+        stmt += " AND group_id=(SELECT id FROM Telegram_Group WHERE group_id=(?))"
+        params.append(group_id)
+    count = DBHelper().db.execute(stmt, params).fetchone()[0]
+    assert 0 < len(exported) == count
+    assert all(since <= row[-1] < until for row in exported)
+
+
+def test_delete_messages_before(messages):
+    db = DBHelper().db
+    cutoff = int(time.time()) - 30 * 86400
+    old = db.execute("SELECT COUNT(*) FROM Message WHERE ts<(?)", (cutoff,))
+    old = old.fetchone()[0]
+    total = db.execute("SELECT COUNT(*) FROM Message").fetchone()[0]
+    stmt = "SELECT SUM(msg_count) FROM Message_Day_Type"
+    rollups = db.execute(stmt).fetchone()[0]
+
+    deleted = 0
+    while True:
+        count = DBHelper().sql_delete_messages_before(cutoff, 100)
+        assert count <= 100
+        deleted += count
+        if count < 100:
+            break
+    assert 0 < deleted == old
+    assert db.execute("SELECT MIN(ts) FROM Message").fetchone()[0] >= cutoff
+    assert db.execute("SELECT COUNT(*) FROM Message").fetchone()[0] == total - old
+    assert db.execute(stmt).fetchone()[0] == rollups
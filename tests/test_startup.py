@@ -0,0 +1,70 @@
+"""Startup: the database bootstrap and the imports of the admin CLI."""
+
+
+import os
+import sys
+import subprocess
+
+import migrations
+from dbhelper import DBHelper
+
+from conftest import GROUPS, ROOT
+
+
+def test_create_schema_is_idempotent(database):
+    assert not migrations.create_schema()
+    assert migrations.get_version() == migrations.MIGRATIONS[-1][0]
+    assert migrations.is_complete()
+    assert migrations.apply_schema() == []
+
+
+def test_groups_registered_once(database):
+    import yve_admin
+
+    yve_admin.init(None)
+    yve_admin.init(None)
+    rows = DBHelper().db.execute("SELECT group_id FROM Telegram_Group").fetchall()
+    assert sorted(row[0] for row in rows) == sorted(GROUPS)
+
+
+def test_init_counts_configured_groups(database, capsys):
+    import yve_admin
+
+    yve_admin.init(None)
+    assert f"{len(GROUPS)} groups registered" in capsys.readouterr().out
+
+
+def test_admin_imports_without_telegram():
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import yve_admin\n"
+        "print(time.perf_counter() - start)\n"
+        "heavy = {'telegram', 'numpy', 'matplotlib'} & set(sys.modules)\n"
+        "assert not heavy, heavy\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=os.environ,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    # Generous, the imports take about 0.1s
+    assert float(result.stdout) < 2
+
+
+def test_missing_config_fails(tmp_path):
+    env = dict(os.environ, YVE_CONFIG=str(tmp_path / "missing.yaml"))
+    result = subprocess.run(
+        [sys.executable, "-c", "import config"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode != 0
+    assert "missing.yaml does not exist" in result.stderr
@@ -5,11 +5,21 @@ import sys
 import logging
 from logging import handlers
 import hashlib
-from functools import wraps
+from functools import wraps, lru_cache
 
+import yaml
+from telegram.ext import MessageFilter
 from telegram.utils.helpers import effective_message_type
-from config import ADMINS, GROUPS, MESSAGE_TYPES
-from dbqueries import db_add_group, db_add_user
+from config import (
+    ADMINS,
+    GROUPS,
+    MESSAGE_TYPES,
+    USER_HASH,
+    USER_HASH_KEY,
+    USER_HASH_CACHE_SIZE,
+    load_config,
+)
+from dbqueries import db_add_groups, db_add_user, db_rehash_users
 
 
 def init_logging():
@@ -57,8 +67,7 @@ def init_groups():
     """Transfer the groups from the config file to the database."""
     print("Init groups... ", end="")
     try:
-        for group_id in GROUPS:
-            db_add_group(group_id, None)
+        db_add_groups(GROUPS)
     except ValueError as error:
         print(f"Error during initilization: {error}")
     print("Done.")
@@ -88,28 +97,67 @@ def group_chat_only(func):
     return wrapped
 
 
-def selected_groups_only(func):
-    """Wrapper for selected groups."""
+class SelectedMessages(MessageFilter):
+    """Filter for the messages of the selected groups and message types.
 
-    @wraps(func)
-    def wrapped(update, context, *args, **kwargs):
-        if update.effective_chat.id not in GROUPS:
-            return func
-        return func(update, context, *args, **kwargs)
+    The type of a passing message is handed to the handler as
+    context.msg_type[0], so it is determined only once per update.
+    reload() replaces both sets at once, the filter can be used by the
+    dispatcher meanwhile.
 
-    return wrapped
+    """
 
+    data_filter = True
 
-def selected_messages_only(func):
-    """Wrapper for selected message types."""
+    def __init__(self, groups, message_types):
+        self.selected = (frozenset(groups), frozenset(message_types))
 
-    @wraps(func)
-    def wrapped(update, context, *args, **kwargs):
-        if effective_message_type(update) not in MESSAGE_TYPES:
-            return func
-        return func(update, context, *args, **kwargs)
+    def reload(self, groups, message_types):
+        """Replace the selected groups and message types."""
+        self.selected = (frozenset(groups), frozenset(message_types))
 
-    return wrapped
+    def filter(self, message):
+        groups, message_types = self.selected
+        if message.chat.id not in groups:
+            return False
+        msg_type = effective_message_type(message)
+        if msg_type not in message_types:
+            return False
+        return {"msg_type": [msg_type]}
+
+
+SELECTED_MESSAGES = SelectedMessages(GROUPS, MESSAGE_TYPES)
+ADMIN_IDS = frozenset(ADMINS)
+
+
+def reload_selection(run=None):
+    """Reload GROUPS, MESSAGE_TYPES and ADMINS from config.yaml and
+    register new groups. The old selection stays if the file can't be
+    read.
+
+    Args:
+        run (function): Calls a database function, run(func, *args).
+                        The bot passes the writer thread here.
+
+    """
+    global ADMIN_IDS
+    try:
+        config = load_config()
+        groups, message_types = config["GROUPS"], config["MESSAGE_TYPES"]
+        admins = config["ADMINS"]
+        if run:
+            run(db_add_groups, groups)
+        else:
+            db_add_groups(groups)
+    except (OSError, yaml.YAMLError, KeyError, TypeError, ValueError) as error:
+        print(f"Can't reload config.yaml: {error}")
+        return
+    SELECTED_MESSAGES.reload(groups, message_types)
+    ADMIN_IDS = frozenset(admins)
+    print(
+        f"Reloaded config.yaml: {len(groups)} groups, "
+        f"{len(message_types)} message types, {len(admins)} admins."
+    )
 
 
 def restricted(func):
@@ -118,7 +166,7 @@ def restricted(func):
     @wraps(func)
     def wrapped(update, context, *args, **kwargs):
         user_id = update.effective_user.id
-        if user_id not in ADMINS:
+        if user_id not in ADMIN_IDS:
             msg = f"Unauthorized access denied for {user_id}."
             print(msg)
             update.message.reply_text(msg)
@@ -128,6 +176,40 @@ def restricted(func):
     return wrapped
 
 
+@lru_cache(maxsize=USER_HASH_CACHE_SIZE)
 def hash_uid(user_id):
-    """Create hash from the user_id."""
-    return hashlib.sha512(str(user_id).encode()).hexdigest()
+    """Create hash from the user_id.
+
+    Either the SHA-512 hexdigest or, if USER_HASH is "blake2b", the
+    short keyed digest of it (see short_hash).
+
+    """
+    user_id_hash = hashlib.sha512(str(user_id).encode()).hexdigest()
+    if USER_HASH == "blake2b":
+        return short_hash(user_id_hash)
+    return user_id_hash
+
+
+def short_hash(user_id_hash):
+    """Create the keyed 16 byte BLAKE2b digest of a SHA-512 user hash.
+
+    Hashing the SHA-512 hexdigest instead of the user ID itself allows
+    to rewrite the users already stored in the database.
+
+    """
+    return hashlib.blake2b(
+        user_id_hash.encode(), digest_size=16, key=USER_HASH_KEY.encode()
+    ).digest()
+
+
+def init_user_hashes():
+    """Rewrite the stored SHA-512 user hashes if USER_HASH is "blake2b"."""
+    if USER_HASH != "blake2b":
+        return
+    print("Rewrite user hashes... ", end="")
+    try:
+        count = db_rehash_users(short_hash)
+    except ValueError as error:
+        print(f"Error during rewrite: {error}")
+        return
+    print(f"Done. {count} users.")
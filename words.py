@@ -0,0 +1,202 @@
+"""Word and emoji frequencies of the groups.
+
+process_message only queues the text of a message. A background thread
+splits it into words and emoji and counts them per group and day, the
+counts are added to the Word_Daily table in batches by flush(). The
+text itself is never written.
+
+"""
+
+
+import re
+import threading
+from datetime import timezone
+from queue import Queue, Full
+
+from dbqueries import db_add_words
+
+
+# Links, mentions, hashtags and bot commands are not counted
+SKIP = re.compile(r"(?:https?://|www\.)\S+|[@#/]\w+")
+# Words of at least two letters and single emoji (pictographs and
+# symbols, without the skin tone modifiers)
+TOKENS = re.compile(
+    r"(?P<emoji>[\U0001F300-\U0001F3FA\U0001F400-\U0001FAFF\u2600-\u27BF])"
+    r"|[^\W\d_]{2,}"
+)
+
+STOP_WORDS = frozenset(
+    """
+    aber alle allem allen aller alles als also am an ander andere anderen
+    auch auf aus bei beim bin bis bist da dabei dadurch dafür dagegen daher
+    dahin damals damit danach dann dar darauf darum das dass dein deine dem
+    den denn der des dessen deshalb dich die dies diese diesem diesen dieser
+    dieses dir doch dort du durch ein eine einem einen einer eines er es
+    etwas euch euer für gegen gehabt habe haben hat hatte hier hin hinter ich
+    ihm ihn ihnen ihr ihre im in ins ist ja jede jedem jeden jeder jedes
+    jetzt kann kein keine können man manche mein meine mich mir mit muss
+    nach nicht nichts noch nun nur ob oder ohne schon sehr sein seine sich
+    sie sind so solche soll sondern sonst um und uns unser unter viel vom
+    von vor war waren was weil welche wenn wer wie wieder will wir wird
+    wirst wo zu zum zur über
+    a an and are as at be but by do for from have he i if in is it its me
+    my no not of on or so that the this to was we what with you your
+    """.split()
+)
+
+_STOP = object()
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+def tokenize(text, stop_words=STOP_WORDS):
+    """Return the words (lower case) and emoji of a text, without the
+    stop words, links, mentions, hashtags and commands.
+
+    Returns:
+        List of (token, emoji) tuples.
+
+    """
+    text = SKIP.sub(" ", text)
+    tokens = []
+    for match in TOKENS.finditer(text):
+        if match.lastgroup == "emoji":
+            tokens.append((match.group(), True))
+            continue
+        word = match.group().lower()
+        if word not in stop_words:
+            tokens.append((word, False))
+    return tokens
+
+
+class WordStats:
+    """Count the words and emoji of the messages per group and day.
+
+    put() only queues the text, a full queue drops it. The counting
+    thread keeps at most 2 * vocabulary tokens per group and day, then
+    the vocabulary most frequent ones are kept and the others dropped,
+    so rare words don't take the memory of the frequent ones. flush()
+    writes and resets the counters.
+
+    Args:
+        vocabulary (int): Tokens kept per group and day between flushes
+        maxsize (int): Texts waiting for the counting thread
+        stop_words (set): Words that are not counted
+        run (function): Calls a database function, run(func, *args).
+                        The bot passes the writer thread here.
+
+    """
+
+    def __init__(self, vocabulary=1000, maxsize=10000, stop_words=STOP_WORDS, run=None):
+        self.vocabulary = vocabulary
+        self.stop_words = frozenset(stop_words)
+        self._run = run or _call
+        self._queue = Queue(maxsize=maxsize)
+        self._thread = threading.Thread(
+            target=self._work, name="word_stats", daemon=True
+        )
+        self._lock = threading.Lock()
+        # (group_id, day): {(token, emoji): count}
+        self._counts = {}
+        self.counted = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.flushed = 0
+
+    def start(self):
+        """Start the counting thread."""
+        self._thread.start()
+
+    def put(self, group_id, timestamp, text):
+        """Queue the text of a message for counting.
+
+        Args:
+            group_id (int): Telegram Group ID
+            timestamp (datetime): Date of the message
+            text (str): Text of the message
+
+        """
+        day = timestamp.astimezone(timezone.utc).date().isoformat()
+        try:
+            self._queue.put_nowait((group_id, day, text))
+        except Full:
+            self.dropped += 1
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            self._count(*item)
+
+    def _count(self, group_id, day, text):
+        tokens = tokenize(text, self.stop_words)
+        if not tokens:
+            return
+        with self._lock:
+            counts = self._counts.setdefault((group_id, day), {})
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            if len(counts) > 2 * self.vocabulary:
+                self._prune(counts)
+            self.counted += 1
+
+    def _prune(self, counts):
+        keep = sorted(counts, key=counts.__getitem__, reverse=True)[: self.vocabulary]
+        kept = {token: counts[token] for token in keep}
+        self.evicted += len(counts) - len(kept)
+        counts.clear()
+        counts.update(kept)
+
+    def flush(self, context=None):  # pylint: disable=unused-argument
+        """Add the counters to the database and reset them. Used as
+        JobQueue callback.
+
+        """
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        rows = [
+            (group_id, day, token, emoji, count)
+            for (group_id, day), tokens in counts.items()
+            for (token, emoji), count in tokens.items()
+        ]
+        if not rows:
+            return
+        try:
+            self._run(db_add_words, rows)
+        except ValueError as error:
+            print(f"Can't save the word statistics: {error}")
+            # Count them again with the next flush
+            with self._lock:
+                for key, tokens in counts.items():
+                    merged = self._counts.setdefault(key, {})
+                    for token, count in tokens.items():
+                        merged[token] = merged.get(token, 0) + count
+            return
+        self.flushed += len(rows)
+
+    def stop(self, timeout=None):
+        """Count the queued texts and stop the counting thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def depth(self):
+        """Return the number of texts waiting for the counting thread."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return the counters of the word statistics."""
+        with self._lock:
+            tokens = sum(len(counts) for counts in self._counts.values())
+        return {
+            "depth": self.depth(),
+            "counted": self.counted,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "pending": tokens,
+            "flushed": self.flushed,
+        }
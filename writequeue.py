@@ -0,0 +1,182 @@
+"""Single writer thread for the database."""
+
+
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+from dbqueries import db_add_message, db_add_messages
+
+
+_STOP = object()
+
+# A function to run in the writer thread, see WriteQueue.submit()
+_Job = namedtuple("_Job", ["func", "args", "future"])
+
+
+class WriteQueue:
+    """Run all database writes in one dedicated writer thread.
+
+    Incoming messages are buffered in a bounded queue and written in
+    batches. A batch is flushed as soon as it holds batch_size messages
+    or the oldest message in it is older than flush_ms milliseconds.
+    Other writes are submitted as functions and run in order with the
+    messages. on_commit(rows) is called in the writer thread with the
+    messages of every successful write.
+
+    """
+
+    def __init__(self, batch_size=500, flush_ms=250, maxsize=10000, on_commit=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.on_commit = on_commit
+        self._queue = Queue(maxsize=maxsize)
+        self._thread = threading.Thread(
+            target=self._run, name="db_writer", daemon=True
+        )
+        self._lock = threading.Lock()
+        self.flushed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.jobs = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread.start()
+
+    def put(self, row):
+        """Queue a message. Blocks if the queue is full.
+
+        Args:
+            row (tuple): (group_id, user_id_hash, user_name, msg_type,
+                          msg_length, timestamp)
+
+        """
+        self._queue.put(row)
+
+    def submit(self, func, *args):
+        """Run func(*args) in the writer thread, after all messages
+        queued before are written.
+
+        Returns:
+            concurrent.futures.Future with the result of the function
+
+        """
+        future = Future()
+        self._queue.put(_Job(func, args, future))
+        return future
+
+    def write(self, row):
+        """Write a message right away, after all messages queued before.
+
+        Returns:
+            concurrent.futures.Future, done when the message is written
+
+        """
+        return self.submit(self._write, row)
+
+    def _write(self, row):
+        db_add_message(*row)
+        self._committed([row])
+
+    def _committed(self, rows):
+        if self.on_commit and rows:
+            self.on_commit(rows)
+
+    def stop(self, timeout=None):
+        """Write all queued messages and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def depth(self):
+        """Return the number of queued messages and functions."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return the queue depth and the flush statistics."""
+        with self._lock:
+            avg_flush_ms = self.total_flush_ms / self.batches if self.batches else 0.0
+            return {
+                "depth": self.depth(),
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "jobs": self.jobs,
+                "last_flush_ms": self.last_flush_ms,
+                "avg_flush_ms": avg_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+            }
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                break
+            if isinstance(item, _Job):
+                self._flush(batch)
+                batch = []
+                self._run_job(item)
+            elif item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or (
+                batch and time.monotonic() >= deadline
+            ):
+                self._flush(batch)
+                batch = []
+
+    def _run_job(self, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.func(*job.args))
+        except Exception as error:  # pylint: disable=broad-except
+            job.future.set_exception(error)
+        with self._lock:
+            self.jobs += 1
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        dropped = 0
+        try:
+            db_add_messages(batch)
+            self._committed(batch)
+        except Exception as error:  # pylint: disable=broad-except
+            # Retry one by one so a single bad row doesn't cost the batch
+            print(f"Batch insert failed: {error}\nRetrying row by row.")
+            for row in batch:
+                try:
+                    db_add_messages([row])
+                except Exception as err:  # pylint: disable=broad-except
+                    print(f"Dropping message {row[:2]}: {err}")
+                    dropped += 1
+                else:
+                    self._committed([row])
+        flush_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.flushed += len(batch) - dropped
+            self.dropped += dropped
+            self.batches += 1
+            self.last_flush_ms = flush_ms
+            self.max_flush_ms = max(self.max_flush_ms, flush_ms)
+            self.total_flush_ms += flush_ms
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+
+"""
+    Yve maintenance commands.
+
+    Usage: ./yve_admin.py <command>
+
+    Only the modules of a command are imported, neither telegram nor the
+    bot handlers, so the commands start quickly.
+
+"""
+
+import sys
+import random
+import sqlite3
+import argparse
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from dbhelper import DBHelper, SCHEMA, ROLLUP_SCHEMA
+import migrations
+import queries
+from retention import Retention
+import exporter
+from dbqueries import (
+    db_add_groups,
+    db_get_stats_snapshot,
+    db_get_user_counts,
+    db_get_user_names,
+    db_load_ids,
+)
+from leaderboard import Leaderboards
+from config import (
+    GROUPS,
+    RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_VACUUM_PAGES,
+)
+
+TIMESPANS = ("month", "30days", "today", "all")
+
+
+def init(args):  # pylint: disable=unused-argument
+    """Create the database if it is new, apply pending migrations and
+    register the GROUPS of the config.
+
+    """
+    start = time.perf_counter()
+    if migrations.create_schema():
+        print("Created the database schema.")
+    elif migrations.apply_schema():
+        print("Pending backfills, run migrate.")
+    groups = [group_id for group_id in GROUPS if group_id]
+    db_add_groups(groups)
+    print(f"{len(groups)} groups registered in {time.perf_counter() - start:.3f}s.")
+
+
+def print_stats(args):
+    """Print the statistics of a group or of all groups."""
+    timespan = TIMESPANS.index(args.timespan)
+    snapshot = db_get_stats_snapshot(args.group_id, timespan)
+    print(f"{snapshot.total} messages ({args.timespan})")
+    for count, msg_type in snapshot.types:
+        print(f"{count:>10}  {msg_type}")
+
+    db_load_ids()
+    group_rowid = DBHelper.ids.groups.get(args.group_id)
+    users = {}
+    for group, user, count in db_get_user_counts(queries.timespan_start(timespan)):
+        if args.group_id is None or group == group_rowid:
+            users[user] = users.get(user, 0) + count
+    top = sorted(users, key=users.get, reverse=True)[: args.top]
+    names = db_get_user_names(top)
+    print("\nTop posters:")
+    for user in top:
+        print(f"{users[user]:>10}  {names.get(user, '')}")
+
+
+def backfill_rollups(args):
+    """Build the daily rollup tables from the existing Message rows.
+    Days before the retention keep their rollups.
+
+    """
+    days = args.days or RETENTION_DAYS
+    since = ""
+    if days:
+        cutoff = Retention(days).cutoff()
+        since = datetime.fromtimestamp(cutoff, timezone.utc).date().isoformat()
+    print("Building rollup tables... ", end="", flush=True)
+    start = time.perf_counter()
+    total = DBHelper().sql_rebuild_rollups(since)
+    print(f"Done. {total} messages in {time.perf_counter() - start:.1f}s.")
+
+
+def migrate(args):
+    """Apply all pending schema migrations and run their backfills.
+    Can be run while the bot is running.
+
+    """
+    print(f"Schema version: {migrations.get_version()}")
+    if not migrations.apply_schema():
+        print("Nothing to do.")
+        return
+    migrations.run_backfills(batch_size=args.batch_size, pause_ms=args.pause_ms)
+    print(f"Schema version: {migrations.get_version()}")
+
+
+def retention(args):
+    """Delete the messages older than the retention. Their counts stay
+    in the daily rollups. Can be run while the bot is running.
+
+    """
+    days = args.days or RETENTION_DAYS
+    if not days:
+        print("No retention configured, use --days.")
+        return
+    if not migrations.is_complete():
+        print("Pending migrations, run migrate first.")
+        return
+    print(f"Deleting messages older than {days} days... ", end="", flush=True)
+    start = time.perf_counter()
+    deleted = Retention(
+        days, RETENTION_BATCH_SIZE, pause_ms=0, vacuum_pages=RETENTION_VACUUM_PAGES
+    ).run_once()
+    print(f"Done. {deleted} messages in {time.perf_counter() - start:.1f}s.")
+
+
+def vacuum(args):
+    """Rebuild the database file and switch it to incremental
+    auto-vacuum. Stop the bot first.
+
+    """
+    print("Vacuuming the database... ", end="", flush=True)
+    start = time.perf_counter()
+    DBHelper().sql_vacuum()
+    print(f"Done in {time.perf_counter() - start:.1f}s.")
+
+
+def import_history(args):
+    """Import the messages of a Telegram Desktop export (result.json).
+    An interrupted import continues where it stopped when run again.
+
+    """
+
+    import importer  # pylint: disable=import-outside-toplevel
+
+    def report(stats):
+        print(
+            f"\r{stats['imported']} messages, {stats['rows_per_sec']:.0f} rows/s",
+            end="",
+            flush=True,
+        )
+
+    stats = importer.import_export(
+        args.path, args.group_id, args.batch_size or importer.BATCH_SIZE, report=report
+    )
+    print(
+        f"\rImported {stats['imported']} messages into group {stats['group_id']} "
+        f"in {stats['seconds']:.1f}s ({stats['rows_per_sec']:.0f} rows/s), "
+        f"{stats['skipped']} skipped."
+    )
+
+
+def export(args):
+    """Export messages or daily statistics to CSV or NDJSON. Can be run
+    while the bot is running.
+
+    """
+    start = time.perf_counter()
+    count = exporter.export(
+        args.dataset, args.output, args.format, args.group_id, args.since, args.until
+    )
+    print(
+        f"Exported {count} rows to {args.output} "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+
+
+def seed_database(db, groups=3, users=50, messages=5000):
+    """Create the schema and add random messages of the last 60 days."""
+    for script in (SCHEMA, ROLLUP_SCHEMA):
+        with open(script) as fp:
+            db.executescript(fp.read())
+    db.executemany(
+        "INSERT INTO Telegram_Group (group_id) VALUES (?)",
+        [(-1000 - n,) for n in range(groups)],
+    )
+    db.executemany(
+        "INSERT INTO Telegram_User (user_id, user_name) VALUES (?, ?)",
+        [(f"{n:0128x}", f"user{n}") for n in range(users)],
+    )
+    now = datetime.now(timezone.utc)
+    rows = []
+    for _ in range(messages):
+        timestamp = now - timedelta(seconds=random.randrange(60 * 86400))
+        rows.append(
+            (
+                random.randint(1, groups),
+                random.randint(1, users),
+                random.randint(1, 15),
+                random.randrange(20),
+                timestamp,
+                int(timestamp.timestamp()),
+            )
+        )
+    db.executemany(
+        "INSERT INTO Message (group_id, user_id, msg_type, msg_length, timestamp, ts) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    db.commit()
+
+
+def check_plans(args):
+    """Show the query plan of every registered query. Exits with 1 if a
+    query scans the whole Message table without being meant to.
+
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.database:
+            db = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+        else:
+            db = sqlite3.connect(f"{tmpdir}/plans.sqlite3")
+            seed_database(db)
+        results = queries.check_plans(db)
+        db.close()
+
+    for name, plan, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        for line in plan:
+            print(f"       {line}")
+    failed = [name for name, _, ok in results if not ok]
+    if failed:
+        print(f"Full scan of Message in: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"All {len(results)} queries ok.")
+
+
+def verify_columns(args):  # pylint: disable=unused-argument
+    """Compare the statistics of the NumPy columnar engine with the SQL
+    statistics for every group and timespan.
+
+    """
+    import columns  # pylint: disable=import-outside-toplevel
+
+    if not columns.available():
+        print("numpy is not installed.")
+        sys.exit(1)
+    db_load_ids()
+    start = time.perf_counter()
+    store = columns.ColumnStore()
+    store.load()
+    print(
+        f"Loaded {store.stats()['messages']} messages in "
+        f"{time.perf_counter() - start:.1f}s."
+    )
+    boards = Leaderboards(store.top_size)
+    boards.rebuild()
+
+    failed = 0
+    for group_id in [None] + sorted(DBHelper.ids.groups):
+        for timespan in range(4):
+            expected = db_get_stats_snapshot(group_id, timespan)
+            snapshot = store.snapshot(group_id, timespan)
+            checks = {
+                "total": (expected.total, snapshot.total),
+                "types": (
+                    {name: count for count, name in expected.types},
+                    {name: count for count, name in snapshot.types},
+                ),
+                # Users with the same count may be ordered differently
+                "top": (
+                    [count for count, _ in boards.top(group_id, timespan)],
+                    [count for count, _ in store.top(group_id, timespan)],
+                ),
+            }
+            for name, (sql, numpy) in checks.items():
+                if sql != numpy:
+                    failed += 1
+                    print(
+                        f"FAIL {group_id or 'all'}/{timespan} {name}: "
+                        f"SQL {sql}, numpy {numpy}"
+                    )
+    if failed:
+        sys.exit(1)
+    print("The columnar engine matches the SQL statistics.")
+
+
+def main():
+    """Parse the command line and run the command."""
+    parser = argparse.ArgumentParser(description="Yve maintenance commands.")
+    commands = parser.add_subparsers(title="commands", dest="command")
+    commands.required = True
+
+    cmd = commands.add_parser(
+        "init", help="create the database and register the configured groups"
+    )
+    cmd.set_defaults(func=init)
+
+    cmd = commands.add_parser("stats", help="print the statistics")
+    cmd.add_argument("--group-id", type=int, help="group ID, default: all groups")
+    cmd.add_argument("--timespan", choices=TIMESPANS, default="month")
+    cmd.add_argument("--top", type=int, default=10, help="number of top posters")
+    cmd.set_defaults(func=print_stats)
+
+    cmd = commands.add_parser(
+        "backfill-rollups", help="build the daily rollup tables from Message"
+    )
+    cmd.add_argument(
+        "--days", type=int, help="retention in days (default: RETENTION_DAYS)"
+    )
+    cmd.set_defaults(func=backfill_rollups)
+
+    cmd = commands.add_parser("migrate", help="apply pending schema migrations")
+    cmd.add_argument("--batch-size", type=int, help="messages per transaction")
+    cmd.add_argument("--pause-ms", type=int, help="pause between transactions")
+    cmd.set_defaults(func=migrate)
+
+    cmd = commands.add_parser("import", help="import a Telegram Desktop export")
+    cmd.add_argument("path", help="path of the result.json")
+    cmd.add_argument("--group-id", type=int, help="group ID, default: from the export")
+    cmd.add_argument(
+        "--batch-size", type=int, help="messages per transaction, default 10000"
+    )
+    cmd.set_defaults(func=import_history)
+
+    cmd = commands.add_parser("export", help="export messages or daily statistics")
+    cmd.add_argument("dataset", choices=exporter.DATASETS)
+    cmd.add_argument("output", help="output file, gzip compressed if it ends in .gz")
+    cmd.add_argument("--format", choices=exporter.FORMATS, default="csv")
+    cmd.add_argument("--group-id", type=int, help="group ID, default: all groups")
+    cmd.add_argument(
+        "--since", type=date.fromisoformat, help="first day (YYYY-MM-DD, UTC)"
+    )
+    cmd.add_argument(
+        "--until", type=date.fromisoformat, help="day after the last day (YYYY-MM-DD)"
+    )
+    cmd.set_defaults(func=export)
+
+    cmd = commands.add_parser(
+        "check-plans", help="check the query plans of all registered queries"
+    )
+    cmd.add_argument(
+        "--database", help="check this database instead of a seeded temporary one"
+    )
+    cmd.set_defaults(func=check_plans)
+
+    cmd = commands.add_parser("retention", help="delete old messages")
+    cmd.add_argument("--days", type=int, help="keep the messages of this many days")
+    cmd.set_defaults(func=retention)
+
+    cmd = commands.add_parser(
+        "vacuum", help="rebuild the database file with incremental auto-vacuum"
+    )
+    cmd.set_defaults(func=vacuum)
+
+    cmd = commands.add_parser(
+        "verify-columns", help="compare the numpy engine with the SQL statistics"
+    )
+    cmd.set_defaults(func=verify_columns)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,64 +6,213 @@
 
 """
 
+import io
 import sys
+import time
+import signal
 
 # import pprint
-from telegram import ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Bot,
+    ParseMode,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+)
 from telegram.utils.helpers import escape_markdown
+from telegram.utils.request import Request
 from telegram.ext import (
     Updater,
+    Dispatcher,
+    JobQueue,
     Filters,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
 )
-from telegram.utils.helpers import effective_message_type
 from dbqueries import (
+    db_get_day_counts,
+    db_get_top_words,
     db_get_all_messages,
     db_get_user_messages,
-    db_add_message,
-    db_get_message_types,
-    db_get_top_posters,
+    db_load_ids,
+    db_close,
 )
 from util import (
     init_logging,
     get_name,
-    add_user,
     hash_uid,
     init_groups,
+    init_user_hashes,
     restricted,
     group_chat_only,
-    selected_groups_only,
-    selected_messages_only,
+    reload_selection,
+    SELECTED_MESSAGES,
+)
+from writequeue import WriteQueue
+from statscache import StatsCache, REFRESH_CHECK_INTERVAL
+from singleflight import SingleFlight
+from outbox import Outbox
+from journal import JournalQueue
+from leaderboard import Leaderboards
+from pagination import PaginationStore
+from migrations import create_schema, apply_schema, MigrationRunner
+from retention import Retention
+from shards import Shards
+import columns
+from words import WordStats, STOP_WORDS
+import charts
+from metrics import (
+    REGISTRY,
+    INGESTION_LAG,
+    Gauge,
+    instrument_handler,
+    start_http_server,
+)
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    BOT_VERSION,
+    PUB_IP,
+    CERT,
+    PRIV_KEY,
+    WRITE_BEHIND,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_MS,
+    WRITE_BEHIND_QUEUE_SIZE,
+    DISPATCHER_WORKERS,
+    METRICS_HOST,
+    METRICS_PORT,
+    STATS_MAX_AGE,
+    STATS_MAX_WRITES,
+    PAGINATION_MAX_PER_CHAT,
+    PAGINATION_TTL_DAYS,
+    PAGINATION_PERSIST,
+    RETENTION_DAYS,
+    RETENTION_INTERVAL,
+    RETENTION_BATCH_SIZE,
+    RETENTION_PAUSE_MS,
+    RETENTION_VACUUM_PAGES,
+    SHARDS,
+    ANALYTICS_NUMPY_COMMANDS,
+    WORD_STATS,
+    WORD_STATS_VOCABULARY,
+    WORD_STATS_QUEUE_SIZE,
+    WORD_STATS_FLUSH_INTERVAL,
+    WORD_STATS_STOP_WORDS,
+    CHARTS,
+    CHART_WORKERS,
+    CHART_CACHE_SIZE,
+    CHART_TIMEOUT,
+    RATE_LIMIT,
+    RATE_LIMIT_GROUP_PER_MINUTE,
+    RATE_LIMIT_CHAT_PER_SECOND,
+    RATE_LIMIT_GLOBAL_PER_SECOND,
+    RATE_LIMIT_RETRIES,
+    RATE_LIMIT_STOP_TIMEOUT,
+    JOURNAL_DB,
+    JOURNAL_CHECKPOINT_INTERVAL,
 )
-from config import TELEGRAM_BOT_TOKEN, BOT_VERSION, PUB_IP, CERT, PRIV_KEY
 
 
 # Debug Mode default Off
 DEBUG = False
 
+# Headers of the timespans
+TIMESPANS = {0: "Diesen Monat", 1: "Letzte 30 Tage", 2: "Heute", 3: "Gesamt"}
+
+# Writer thread, all database writes go through it
+WRITE_QUEUE = None
+
+# Journal of the received updates, the update queue of the dispatcher
+JOURNAL = None
+
+# Statistics snapshots, refreshed by the JobQueue
+STATS_CACHE = StatsCache(STATS_MAX_AGE, STATS_MAX_WRITES)
+
+# Concurrent requests of the same statistics message share one result
+STATS_FLIGHTS = SingleFlight()
+
+# Flood limits of the sent messages
+OUTBOX = None
+if RATE_LIMIT:
+    OUTBOX = Outbox(
+        RATE_LIMIT_GROUP_PER_MINUTE,
+        RATE_LIMIT_CHAT_PER_SECOND,
+        RATE_LIMIT_GLOBAL_PER_SECOND,
+        RATE_LIMIT_RETRIES,
+    )
+
+# Network statistics of a sharded deployment, read from all shards
+NETWORK = Shards(SHARDS) if SHARDS else None
+NETWORK_CACHE = (
+    StatsCache(STATS_MAX_AGE, STATS_MAX_WRITES, load=NETWORK.snapshot)
+    if NETWORK
+    else None
+)
+
+# Top posters, counted by the writer thread
+LEADERBOARDS = Leaderboards()
+
+# NumPy columns of all messages, for ANALYTICS_NUMPY_COMMANDS
+COLUMNS = None
+
+# Group and timespan of the statistics messages, for their buttons
+PAGINATION = PaginationStore(
+    PAGINATION_MAX_PER_CHAT,
+    PAGINATION_TTL_DAYS * 86400,
+    PAGINATION_PERSIST,
+    run=lambda func, *args: WRITE_QUEUE.submit(func, *args).result(),
+)
+
+# Deletes old messages, runs in the JobQueue
+RETENTION = Retention(
+    RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_PAUSE_MS,
+    RETENTION_VACUUM_PAGES,
+    run=lambda func, *args: WRITE_QUEUE.submit(func, *args).result(),
+)
+
+# Charts of the /stats messages, drawn by worker processes
+CHART_CACHE = None
+if CHARTS and charts.available():
+    CHART_CACHE = charts.Charts(CHART_WORKERS, CHART_CACHE_SIZE, CHART_TIMEOUT)
+
+# Word and emoji counts, written in batches by the JobQueue
+WORDS = None
+if WORD_STATS:
+    WORDS = WordStats(
+        WORD_STATS_VOCABULARY,
+        WORD_STATS_QUEUE_SIZE,
+        STOP_WORDS | set(WORD_STATS_STOP_WORDS),
+        run=lambda func, *args: WRITE_QUEUE.submit(func, *args).result(),
+    )
+
 # Init logging
 LOGGER = init_logging()
 
 
-@selected_groups_only
-@selected_messages_only
 def process_message(update, context):
-    """Process every new update."""
+    """Process every new update of the selected groups and message
+    types, SELECTED_MESSAGES filters the others.
+
+    """
     # pp = pprint.PrettyPrinter(indent=4)
     # pp.pprint(update.to_dict())
 
     group_id = update.effective_chat.id
     user_id = update.effective_user.id
     user_name = get_name(update)
-    msg_type = effective_message_type(update)
+    msg_type = context.msg_type[0]
     text = update.effective_message.text
     if text:
         msg_length = len(text.split())
     else:
         msg_length = 0
     timestamp = update.effective_message.date
+    INGESTION_LAG.observe(time.time() - timestamp.timestamp())
+    if WORDS and text:
+        WORDS.put(group_id, timestamp, text)
 
     if DEBUG:
         debug_msg = (
@@ -77,11 +226,36 @@ def process_message(update, context):
         )
         context.bot.send_message(chat_id=update.effective_chat.id, text=debug_msg)
 
+    STATS_CACHE.count_write()
+    if NETWORK_CACHE:
+        NETWORK_CACHE.count_write()
+    row = (group_id, hash_uid(user_id), user_name, msg_type, msg_length, timestamp)
+    if WRITE_BEHIND:
+        WRITE_QUEUE.put(row)
+        return
+
     try:
-        db_add_message(group_id, hash_uid(user_id), msg_type, msg_length, timestamp)
+        WRITE_QUEUE.write(row).result()
     except ValueError as err:
-        print(f"An error has occurred: {err}\nTrying to add new user.")
-        add_user(hash_uid(user_id), user_name)
+        print(f"An error has occurred: {err}")
+
+
+def send(method, callback=None, **kwargs):
+    """Call a send or edit method of the bot. If RATE_LIMIT is on, the
+    call is queued and made within the flood limits, the handler doesn't
+    wait for it.
+
+    Args:
+        callback: Called with the result of the method, e.g. the sent
+                  Message, not if the call failed or was replaced
+
+    """
+    if OUTBOX:
+        OUTBOX.send(method, callback, **kwargs)
+        return
+    result = method(**kwargs)
+    if callback:
+        callback(result)
 
 
 def user_statistic(update, context):
@@ -109,8 +283,44 @@ def user_statistic(update, context):
     else:
         text = f"{user_msg} Nachrichten in allen Gruppen."
 
-    context.bot.send_message(
-        chat_id=update.effective_chat.id, text=text, parse_mode=ParseMode.MARKDOWN
+    send(
+        context.bot.send_message,
+        chat_id=update.effective_chat.id,
+        text=text,
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+
+def word_statistic(update, context):
+    """Outputs the most frequent words and emoji either of the current
+    group, or of all groups if the bot command is send in a private chat.
+    The timespan is the optional argument: monat (default), 30, heute
+    or gesamt.
+
+    """
+    if update.effective_chat.type == "private":
+        group_id = None
+    else:
+        group_id = update.effective_chat.id
+    timespans = {"monat": 0, "30": 1, "heute": 2, "gesamt": 3}
+    timespan = timespans.get(context.args[0].lower() if context.args else "", 0)
+
+    if not WORDS:
+        text = "Die Wortstatistik ist ausgeschaltet."
+    else:
+        text = f"*Wörter* _({TIMESPANS[timespan]})_\n\n"
+        for count, word in db_get_top_words(group_id, timespan):
+            text += f"{escape_markdown(word)} {count}\n"
+        emoji = db_get_top_words(group_id, timespan, emoji=True)
+        if emoji:
+            text += "\n*Emoji*:\n\n"
+            text += "  ".join(f"{word} {count}" for count, word in emoji)
+
+    send(
+        context.bot.send_message,
+        chat_id=update.effective_chat.id,
+        text=text,
+        parse_mode=ParseMode.MARKDOWN,
     )
 
 
@@ -137,7 +347,8 @@ def build_markup(button_state):
 
 
 def get_statistic_message(group_id, timespan):
-    """Build the total statistics message.
+    """Build the total statistics message, once for all concurrent
+    requests of the same group and timespan.
 
     Args:
         group_id (int|None): The Telegram group ID or None for all groups
@@ -147,38 +358,109 @@ def get_statistic_message(group_id, timespan):
         text (str): The complete message with the statistics
 
     """
-    header = {0: "Diesen Monat", 1: "Letzte 30 Tage", 2: "Heute", 3: "Gesamt"}
-    total_msg = db_get_all_messages(group_id, timespan)
-    text = f"*{total_msg} Nachrichten gesamt* _({header[timespan]})_"
-    text += db_get_message_types(group_id, timespan)
-    text += db_get_top_posters(group_id, timespan)
+    return STATS_FLIGHTS.do(
+        (group_id, timespan), build_statistic_message, group_id, timespan
+    )
 
-    return text
 
+def build_statistic_message(group_id, timespan):
+    """Build the total statistics message, see get_statistic_message()."""
+    if group_id is None and NETWORK_CACHE:
+        return render_statistic_message(*NETWORK_CACHE.get(None, timespan))
+    command = "stats" if group_id else "networkstats"
+    if COLUMNS and command in ANALYTICS_NUMPY_COMMANDS:
+        return render_statistic_message(
+            COLUMNS.snapshot(group_id, timespan), COLUMNS.top(group_id, timespan)
+        )
+    return render_statistic_message(
+        STATS_CACHE.get(group_id, timespan), LEADERBOARDS.top(group_id, timespan)
+    )
 
-def fetch_group_id(update, context, msg_id):
-    """Get the Telegram group ID depending on the command that was send
-    and the value stored in chat_data["nws"].
+
+def get_statistic_chart(group_id, timespan):
+    """Get the chart of a /stats message.
 
     Args:
-        msg_id (int): Telegram message ID, either from Message object
-                      or from the CallbackQuery object
-        chat_data (dict): A dictionary to store chat related stuff
-        nws (list}: Stores the message IDs of the messages that where
-                    called with the /networkstats command
+        group_id (int|None): The Telegram group ID, None for all groups
+        timespan (int):
 
     Returns:
-        Either the current Telegram group ID or None
+        Tuple of the cache key and the chart, either the Telegram
+        file_id or the PNG. The chart is None without charts, for all
+        groups or if it couldn't be drawn.
 
     """
-    nws = context.chat_data.get("nws", [])
+    if not CHART_CACHE or group_id is None:
+        return None, None
+    # The day counts of the rollups are cheap, drawing is not
+    args = (
+        TIMESPANS[timespan],
+        db_get_day_counts(group_id, timespan),
+        STATS_CACHE.get(group_id, timespan).types,
+    )
+    key = charts.chart_key(*args)
+    return key, CHART_CACHE.get(key, args)
 
-    if msg_id in nws or "/networkstat" in update.effective_message.text:
-        group_id = None
-    else:
-        group_id = update.effective_chat.id
 
-    return group_id
+def chart_photo(chart):
+    """Return the file_id or the PNG of a chart for the Telegram API."""
+    if isinstance(chart, bytes):
+        return io.BytesIO(chart)
+    return chart
+
+
+def render_statistic_message(snapshot, top_posters):
+    """Format the total statistics message.
+
+    Args:
+        snapshot (StatsSnapshot): The statistics to output
+        top_posters (list): (count, user name) tuples of the Highscore
+
+    Returns:
+        text (str): The complete message with the statistics
+
+    """
+    total_msg = snapshot.total
+    text = f"*{total_msg} Nachrichten gesamt* _({TIMESPANS[snapshot.timespan]})_"
+
+    text += "\n\n`"
+    for posts, msg_type in snapshot.types:
+        text += f"{posts:<4} - {msg_type:>10} ({posts/total_msg*100:>4.1f}%)\n"
+    text += "`\n"
+
+    text += "\n*Highscore*:\n\n"
+    for posts, user in top_posters:
+        user = escape_markdown(user)
+        text += f"{user} {posts} Nachrichten\n"
+
+    return text
+
+
+def check_leaderboards(context):  # pylint: disable=unused-argument
+    """Rebuild the leaderboards on a new day and reload the columns if a
+    message was missed. Used as JobQueue callback.
+
+    """
+    if LEADERBOARDS.needs_rebuild():
+        WRITE_QUEUE.submit(LEADERBOARDS.rebuild).result()
+    if COLUMNS and COLUMNS.stale:
+        WRITE_QUEUE.submit(COLUMNS.load).result()
+
+
+def checkpoint_journal(context=None):  # pylint: disable=unused-argument
+    """Delete the processed updates from the journal once their
+    messages are written. Used as JobQueue callback.
+
+    """
+    if JOURNAL.processed > JOURNAL.checkpointed:
+        WRITE_QUEUE.submit(JOURNAL.checkpoint, JOURNAL.processed)
+
+
+def committed(rows):
+    """Count the written messages, called by the writer thread."""
+    LEADERBOARDS.add(rows)
+    if COLUMNS:
+        COLUMNS.add(rows)
 
 
 @group_chat_only
@@ -191,31 +473,48 @@ def total_statistics(update, context):
                              the /networkstats command
 
     """
-    group_id = fetch_group_id(update, context, update.message.message_id)
+    if "/networkstat" in update.effective_message.text:
+        group_id = None
+    else:
+        group_id = update.effective_chat.id
 
     reply_markup = build_markup(button_state=0)
     stat_message = get_statistic_message(group_id, timespan=0)
-
-    send = context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=stat_message,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=reply_markup,
-    )
-
-    # The /networkstat command calls up the statistics for all groups.
-    # The message ID is then saved in chat_data["nws"] to be able to
-    # identify the message again.
-    if not group_id:
-        nws = context.chat_data.get("nws", [])
-        nws.append(send.message_id)
-        context.chat_data["nws"] = nws
+    key, chart = get_statistic_chart(group_id, timespan=0)
+    chat_id = update.effective_chat.id
+
+    def sent(message):
+        # Remember the group, the buttons don't know whether the message
+        # was sent for /stats or /networkstats
+        PAGINATION.put(chat_id, message.message_id, group_id)
+        if chart:
+            CHART_CACHE.uploaded(key, message.photo[-1].file_id)
+
+    if chart:
+        send(
+            context.bot.send_photo,
+            sent,
+            chat_id=chat_id,
+            photo=chart_photo(chart),
+            caption=charts.caption(stat_message),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+        )
+    else:
+        send(
+            context.bot.send_message,
+            sent,
+            chat_id=chat_id,
+            text=stat_message,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+        )
 
 
 def button_pressed(update, context):
     """Handle the forward/backward button of the statistics message.
-    Get the direction from the callback_query.data and the button state
-    from the chat_data.
+    Get the direction from the callback_query.data and the group and
+    button state from the PAGINATION store.
 
     Args:
         direction (str): "forward" or "backward"
@@ -226,8 +525,9 @@ def button_pressed(update, context):
     msg_id = query.message.message_id
     direction = query.data
 
-    button_state = context.chat_data.get(msg_id, 0)
-    group_id = fetch_group_id(update, context, msg_id)
+    state = PAGINATION.get(update.effective_chat.id, msg_id)
+    # Unknown messages are too old, show the current group
+    group_id, button_state = state or (update.effective_chat.id, 0)
 
     if direction == "forward":
         button_state += 1
@@ -244,15 +544,49 @@ def button_pressed(update, context):
     reply_markup = build_markup(button_state)
     stat_message = get_statistic_message(group_id, timespan=button_state)
 
-    context.bot.editMessageText(
-        chat_id=update.effective_chat.id,
-        message_id=msg_id,
-        text=stat_message,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=reply_markup,
-    )
-
-    context.chat_data[msg_id] = button_state
+    chat_id = update.effective_chat.id
+    key, chart = None, None
+
+    def edited(message):
+        PAGINATION.put(chat_id, msg_id, group_id, button_state)
+        if chart:
+            CHART_CACHE.uploaded(key, message.photo[-1].file_id)
+
+    if query.message.photo:
+        # A cached chart is sent by its file_id, no drawing or upload
+        key, chart = get_statistic_chart(group_id, button_state)
+        caption = charts.caption(stat_message)
+        if chart:
+            send(
+                context.bot.edit_message_media,
+                edited,
+                chat_id=chat_id,
+                message_id=msg_id,
+                media=InputMediaPhoto(
+                    chart_photo(chart), caption=caption, parse_mode=ParseMode.MARKDOWN
+                ),
+                reply_markup=reply_markup,
+            )
+        else:
+            send(
+                context.bot.edit_message_caption,
+                edited,
+                chat_id=chat_id,
+                message_id=msg_id,
+                caption=caption,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup,
+            )
+    else:
+        send(
+            context.bot.editMessageText,
+            edited,
+            chat_id=chat_id,
+            message_id=msg_id,
+            text=stat_message,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+        )
 
 
 @restricted
@@ -276,8 +610,123 @@ def toggle_debug_mode(update, context):
     """Toggle the debug mode on/off."""
     global DEBUG
     DEBUG = not DEBUG
-    context.bot.send_message(
-        chat_id=update.effective_chat.id, text=f"Debug Mode: {'On' if DEBUG else 'Off'}"
+    send(
+        context.bot.send_message,
+        chat_id=update.effective_chat.id,
+        text=f"Debug Mode: {'On' if DEBUG else 'Off'}",
+    )
+
+
+@restricted
+def output_status(update, context):
+    """Output the state of the write queue and the stats cache.
+    Only for admins.
+
+    """
+    stats = WRITE_QUEUE.stats()
+    text = (
+        f"Write queue (write-behind {'on' if WRITE_BEHIND else 'off'}):\n"
+        f"Depth: {stats['depth']}\n"
+        f"Written: {stats['flushed']} ({stats['batches']} batches)\n"
+        f"Other writes: {stats['jobs']}\n"
+        f"Dropped: {stats['dropped']}\n"
+        f"Flush latency: {stats['last_flush_ms']:.1f} ms last, "
+        f"{stats['avg_flush_ms']:.1f} ms avg, {stats['max_flush_ms']:.1f} ms max"
+    )
+
+    stats = STATS_CACHE.stats()
+    text += (
+        "\n\nStats cache:\n"
+        f"Hits: {stats['hits']}, misses: {stats['misses']}\n"
+        f"Snapshots: {stats['snapshots']} ({stats['refreshes']} refreshes)\n"
+        f"Age: {stats['min_age']:.0f}-{stats['max_age']:.0f} s\n"
+        f"Messages since refresh: {stats['pending_writes']}"
+    )
+
+    stats = STATS_FLIGHTS.stats()
+    requests = stats["calls"] + stats["shared"]
+    text += f"\nShared requests: {stats['shared']} of {requests}"
+
+    if OUTBOX:
+        stats = OUTBOX.stats()
+        text += (
+            "\n\nOutbox:\n"
+            f"Queued: {stats['queued']}, sent: {stats['sent']}, "
+            f"delayed: {stats['delayed']}, replaced: {stats['replaced']}\n"
+            f"RetryAfter: {stats['retried']}, failed: {stats['failed']}, "
+            f"chats: {stats['chats']}"
+        )
+
+    if NETWORK:
+        text += (
+            f"\n\nShards: {len(NETWORK.paths)}\n"
+            f"Read errors: {NETWORK.failures}"
+        )
+
+    if CHART_CACHE:
+        stats = CHART_CACHE.stats()
+        text += (
+            "\n\nCharts:\n"
+            f"Cached: {stats['charts']}, hits: {stats['hits']}\n"
+            f"Drawn: {stats['renders']}, uploaded: {stats['uploads']}, "
+            f"errors: {stats['errors']}"
+        )
+
+    if WORDS:
+        stats = WORDS.stats()
+        text += (
+            "\n\nWord statistics:\n"
+            f"Counted: {stats['counted']}, queued: {stats['depth']}, "
+            f"dropped: {stats['dropped']}\n"
+            f"Words: {stats['pending']} unsaved, {stats['flushed']} saved, "
+            f"{stats['evicted']} evicted"
+        )
+
+    if COLUMNS:
+        stats = COLUMNS.stats()
+        text += (
+            "\n\nColumns (numpy):\n"
+            f"Messages: {stats['messages']} ({stats['bytes'] / 2 ** 20:.1f} MiB)"
+        )
+
+    if JOURNAL:
+        stats = JOURNAL.stats()
+        text += (
+            "\n\nJournal:\n"
+            f"Backlog: {stats['backlog']}, saved: {stats['entries']}\n"
+            f"Appended: {stats['appended']}, replayed: {stats['replayed']}, "
+            f"checkpoints: {stats['checkpoints']}"
+        )
+
+    stats = PAGINATION.stats()
+    text += (
+        "\n\nPagination:\n"
+        f"States: {stats['states']} in {stats['chats']} chats\n"
+        f"Evicted: {stats['evicted']}, unsaved: {stats['pending']}"
+    )
+
+    stats = RETENTION.stats()
+    if stats["days"]:
+        last_run = "-"
+        if stats["last_run"]:
+            last_run = stats["last_run"].strftime("%d.%m.%Y %H:%M")
+        text += (
+            f"\n\nRetention ({stats['days']} days):\n"
+            f"Deleted: {stats['deleted']} ({stats['runs']} runs)\n"
+            f"Last run: {last_run} ({stats['last_seconds']:.1f} s)\n"
+            f"Free pages: {stats['free_pages']}"
+        )
+    send(context.bot.send_message, chat_id=update.effective_chat.id, text=text)
+
+
+@restricted
+def output_metrics(update, context):
+    """Send the metrics in the Prometheus text format. Only for admins."""
+    send(
+        context.bot.send_document,
+        chat_id=update.effective_chat.id,
+        document=io.BytesIO(REGISTRY.render().encode()),
+        filename="metrics.txt",
     )
 
 
@@ -291,14 +740,19 @@ def print_help(update, context):
         "erfährst du hiermit, wie viele Nachrichten hier bereits "
         "geschrieben wurden.\n"
         "/networkstats - Zeigt dir eine Gesamtstatistik aller Gruppen, "
-        "in denen Yve verwendet wird.\n\n"
+        "in denen Yve verwendet wird.\n"
+        "/words - Die häufigsten Wörter und Emoji, optional für heute, "
+        "30 (Tage), monat oder gesamt.\n\n"
         "Yve Version 0.0.2 - erschaffen von @thisdudeisvegan & @cri5h\n"
         "News-Channel: @yvenews\n"
         "Meinen Code findest du auf GitHub! Bitte respektiere meine Lizenz.\n"
         "https://github.com/Pandarinos/Yve"
     )
-    context.bot.send_message(
-        chat_id=update.effective_chat.id, text=help_msg, parse_mode=ParseMode.MARKDOWN
+    send(
+        context.bot.send_message,
+        chat_id=update.effective_chat.id,
+        text=help_msg,
+        parse_mode=ParseMode.MARKDOWN,
     )
 
 
@@ -307,6 +761,32 @@ def error(update, context):
     LOGGER.warning('Update "%s" caused error "%s"', update, context.error)
 
 
+def create_updater():
+    """Create the updater, with the journal as update queue if
+    JOURNAL_DB is set.
+
+    """
+    if not JOURNAL:
+        return Updater(
+            token=TELEGRAM_BOT_TOKEN, workers=DISPATCHER_WORKERS, use_context=True
+        )
+    # Connections for the workers, the dispatcher, the updater, the
+    # JobQueue and the main thread, like Updater does, and the outbox
+    bot = Bot(
+        TELEGRAM_BOT_TOKEN, request=Request(con_pool_size=DISPATCHER_WORKERS + 5)
+    )
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(
+        bot,
+        JOURNAL,
+        workers=DISPATCHER_WORKERS,
+        job_queue=job_queue,
+        use_context=True,
+    )
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
+
+
 def start_local(updater):
     """Start the bot on local machine."""
     updater.start_polling()  # (timeout=30)
@@ -332,26 +812,166 @@ def start_webhook(updater):
 
 def main():
     """Start the bot."""
+    global WRITE_QUEUE, COLUMNS, JOURNAL
     print(f"{BOT_VERSION[0], BOT_VERSION[1]} starting...")
+    # Create a new database or update the schema, existing rows are
+    # backfilled while the bot is running
+    migrations = None
+    if create_schema():
+        print("Database created.")
+    elif apply_schema():
+        # The leaderboards are built from the rollups, which are still
+        # incomplete, so they are rebuilt after the backfills
+        migrations = MigrationRunner(
+            run=lambda func, *args: WRITE_QUEUE.submit(func, *args).result(),
+            on_complete=LEADERBOARDS.invalidate,
+        )
+
     # Transfer groups from config to db
     init_groups()
+    init_user_hashes()
+    db_load_ids()
+
+    LEADERBOARDS.rebuild()
+    PAGINATION.load()
+    if CHARTS and not CHART_CACHE:
+        print("CHARTS needs matplotlib, sending the statistics without charts")
+    if ANALYTICS_NUMPY_COMMANDS:
+        if not columns.available():
+            print("ANALYTICS_NUMPY_COMMANDS needs numpy, using the SQL statistics")
+        elif RETENTION_DAYS:
+            print("ANALYTICS_NUMPY_COMMANDS needs all messages, no RETENTION_DAYS")
+        elif migrations:
+            print("Migrations running, using the SQL statistics until the restart")
+        else:
+            COLUMNS = columns.ColumnStore()
+            COLUMNS.load()
+
+    WRITE_QUEUE = WriteQueue(
+        WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_FLUSH_MS,
+        WRITE_BEHIND_QUEUE_SIZE,
+        on_commit=committed,
+    )
+    WRITE_QUEUE.start()
+    # The backfill batches are written by the writer thread
+    if migrations:
+        migrations.start()
+    if WORDS:
+        WORDS.start()
+    if OUTBOX:
+        OUTBOX.start()
+
+    if JOURNAL_DB:
+        JOURNAL = JournalQueue(JOURNAL_DB)
 
     # Create EventHandler and pass it your bot's token.
-    updater = Updater(token=TELEGRAM_BOT_TOKEN, use_context=True)
+    updater = create_updater()
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
 
-    dispatcher.add_handler(CallbackQueryHandler(button_pressed))
-    dispatcher.add_handler(CommandHandler("me", user_statistic))
-    dispatcher.add_handler(CommandHandler("stats", total_statistics))
-    dispatcher.add_handler(CommandHandler("networkstats", total_statistics))
-    dispatcher.add_handler(CommandHandler("clear", clear_statistic))
-    dispatcher.add_handler(CommandHandler("gid", output_group_id))
-    dispatcher.add_handler(CommandHandler("debug", toggle_debug_mode))
-    dispatcher.add_handler(CommandHandler("help", print_help))
+    # Refresh the cached statistics in the background
+    updater.job_queue.run_repeating(
+        STATS_CACHE.refresh,
+        interval=REFRESH_CHECK_INTERVAL,
+        first=REFRESH_CHECK_INTERVAL,
+    )
+    if NETWORK_CACHE:
+        updater.job_queue.run_repeating(
+            NETWORK_CACHE.refresh,
+            interval=REFRESH_CHECK_INTERVAL,
+            first=REFRESH_CHECK_INTERVAL,
+        )
+    updater.job_queue.run_repeating(
+        PAGINATION.flush,
+        interval=REFRESH_CHECK_INTERVAL,
+        first=REFRESH_CHECK_INTERVAL,
+    )
+    updater.job_queue.run_repeating(
+        check_leaderboards,
+        interval=REFRESH_CHECK_INTERVAL,
+        first=REFRESH_CHECK_INTERVAL,
+    )
+    if WORDS:
+        updater.job_queue.run_repeating(
+            WORDS.flush,
+            interval=WORD_STATS_FLUSH_INTERVAL,
+            first=WORD_STATS_FLUSH_INTERVAL,
+        )
+    if RETENTION_DAYS:
+        updater.job_queue.run_repeating(
+            RETENTION, interval=RETENTION_INTERVAL, first=RETENTION_INTERVAL
+        )
+    if JOURNAL:
+        updater.job_queue.run_repeating(
+            checkpoint_journal,
+            interval=JOURNAL_CHECKPOINT_INTERVAL,
+            first=JOURNAL_CHECKPOINT_INTERVAL,
+        )
+
+    # All handlers count their calls, errors and run time
+    timed = instrument_handler
+
+    # Read-only commands run in the worker pool, so they don't hold up
+    # the ingestion of new messages
+    dispatcher.add_handler(CallbackQueryHandler(timed(button_pressed), run_async=True))
+    dispatcher.add_handler(CommandHandler("me", timed(user_statistic), run_async=True))
+    dispatcher.add_handler(
+        CommandHandler("stats", timed(total_statistics), run_async=True)
+    )
     dispatcher.add_handler(
-        MessageHandler(Filters.all & ~Filters.command, process_message)
+        CommandHandler("networkstats", timed(total_statistics), run_async=True)
+    )
+    dispatcher.add_handler(
+        CommandHandler("words", timed(word_statistic), run_async=True)
+    )
+    dispatcher.add_handler(CommandHandler("clear", timed(clear_statistic)))
+    dispatcher.add_handler(CommandHandler("gid", timed(output_group_id)))
+    dispatcher.add_handler(CommandHandler("debug", timed(toggle_debug_mode)))
+    dispatcher.add_handler(CommandHandler("status", timed(output_status)))
+    dispatcher.add_handler(CommandHandler("metrics", timed(output_metrics)))
+    dispatcher.add_handler(CommandHandler("help", timed(print_help)))
+    dispatcher.add_handler(
+        MessageHandler(~Filters.command & SELECTED_MESSAGES, timed(process_message))
+    )
+
+    # Reload the selected groups, message types and admins on SIGHUP
+    # New groups are registered by the writer thread
+    signal.signal(
+        signal.SIGHUP,
+        lambda signum, frame: reload_selection(
+            run=lambda func, *args: WRITE_QUEUE.submit(func, *args).result()
+        ),
+    )
+
+    REGISTRY.register(
+        Gauge(
+            "yve_write_queue_depth",
+            "Messages and writes waiting for the writer thread.",
+            WRITE_QUEUE.depth,
+        )
+    )
+    REGISTRY.register(
+        Gauge(
+            "yve_stats_cache_max_age_seconds",
+            "Age of the oldest cached statistics snapshot.",
+            lambda: STATS_CACHE.stats()["max_age"],
+        )
     )
+    if JOURNAL:
+        REGISTRY.register(
+            Gauge(
+                "yve_journal_backlog",
+                "Journaled updates waiting for the dispatcher.",
+                JOURNAL.backlog,
+            )
+        )
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_HOST)
+
+    # Updates left in the journal by the last run are processed first
+    if JOURNAL:
+        print(f"Replaying {JOURNAL.replay(updater.bot)} updates from the journal.")
 
     # log all errors
     dispatcher.add_error_handler(error)
@@ -362,6 +982,33 @@ def main():
     else:
         start_local(updater)
 
+    # updater.idle() returns after SIGINT/SIGTERM/SIGABRT stopped the
+    # updater, so no new messages are queued from here on.
+    RETENTION.stop()
+    if OUTBOX:
+        print(f"Sending the outbox ({OUTBOX.depth()} messages)... ")
+        OUTBOX.stop(RATE_LIMIT_STOP_TIMEOUT)
+    if NETWORK:
+        NETWORK.close()
+    if CHART_CACHE:
+        CHART_CACHE.close()
+    PAGINATION.flush()
+    if WORDS:
+        WORDS.stop()
+        WORDS.flush()
+    print(f"Draining write queue ({WRITE_QUEUE.depth()} messages)... ")
+    WRITE_QUEUE.stop()
+    LOGGER.info("Write queue stopped: %s", WRITE_QUEUE.stats())
+    if JOURNAL:
+        # All messages are written, unprocessed updates stay for the
+        # next start
+        JOURNAL.checkpoint(JOURNAL.processed)
+        print(f"Journal closed, {JOURNAL.stats()['entries']} updates left.")
+        JOURNAL.close()
+    if migrations:
+        migrations.stop()
+    db_close()
+
 
 if __name__ == "__main__":
     main()